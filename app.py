@@ -2,14 +2,26 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
 import subprocess
+import socket
 import csv
 import os
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import sys
+import itertools
 import json
+import tempfile
+import uuid
 from datetime import datetime
+from dotenv import load_dotenv
+from events import PROTOCOL_VERSION, parse_event
+from history import RankHistory, history_path
+from marketplaces import primary_marketplace, split_tagged_keyword
+from metrics import Metrics
+from run_profiles import PROFILE_NAMES, get_profile
+from sheets import get_client
+from sheet_layout import FIRST_DATA_ROW, DateIndex, SheetLayout, normalize_keyword
 
 # ----- UI設定 -----
 BG_COLOR = "#F0F5FF"
@@ -23,7 +35,7 @@ class AmazonRankingApp(tk.Tk):
 
         # Window dimensions
         window_width = 830
-        window_height = 650
+        window_height = 790
 
         self.title("アマゾンランキング取得ツール")
         self.geometry(f"{window_width}x{window_height}")
@@ -114,6 +126,50 @@ class AmazonRankingApp(tk.Tk):
         self.sheet_dropdown["values"] = ("シートを選択してください",)
         self.sheet_dropdown.set("シートを選択してください")
 
+        # 書き込み先リスト（複数のスプレッドシート/シートに1回の取得結果を書き込む）
+        targets_frame = tk.Frame(spreadsheet_frame, bg=BG_COLOR)
+        targets_frame.pack(fill="x")
+        targets_label = tk.Label(
+            targets_frame,
+            text="書き込み先（未追加の場合は上で選択したシートのみ）",
+            font=(FONT_FAMILY, 10),
+            bg=BG_COLOR
+        )
+        targets_label.pack(anchor="w")
+        self.targets_listbox = tk.Listbox(targets_frame, height=3, font=(FONT_FAMILY, 10))
+        self.targets_listbox.pack(side="left", fill="x", expand=True)
+        self.targets = []
+        targets_buttons = tk.Frame(targets_frame, bg=BG_COLOR)
+        targets_buttons.pack(side="left", padx=(10, 0))
+        add_target_button = tk.Button(targets_buttons, text="＋ 追加", font=(FONT_FAMILY, 10), command=self.add_target)
+        add_target_button.pack(fill="x")
+        remove_target_button = tk.Button(targets_buttons, text="－ 削除", font=(FONT_FAMILY, 10), command=self.remove_target)
+        remove_target_button.pack(fill="x", pady=(5, 0))
+
+        # 実行オプション
+        options_frame = tk.Frame(main_frame, bg=BG_COLOR)
+        options_frame.pack(fill="x")
+        self.resume_var = tk.BooleanVar(value=False)
+        resume_check = tk.Checkbutton(
+            options_frame,
+            text="本日取得済みのキーワードをスキップ（中断した実行の再開）",
+            variable=self.resume_var,
+            font=(FONT_FAMILY, 10),
+            bg=BG_COLOR,
+            activebackground=BG_COLOR
+        )
+        resume_check.pack(anchor="w")
+        profile_frame = tk.Frame(options_frame, bg=BG_COLOR)
+        profile_frame.pack(anchor="w", pady=(2, 0))
+        profile_label = tk.Label(profile_frame, text="実行プロファイル:", font=(FONT_FAMILY, 10), bg=BG_COLOR)
+        profile_label.pack(side="left")
+        # interactive: 画面を表示して確認しながら実行 / throughput: ヘッドレスで高速に実行
+        self.profile_dropdown = ttk.Combobox(profile_frame, state="readonly", width=15, values=PROFILE_NAMES)
+        # 既定値は .env の RUN_PROFILE（変更しなければ scrap.py 側の RUN_PROFILE に任せる）
+        self.default_profile = get_profile().name
+        self.profile_dropdown.set(self.default_profile)
+        self.profile_dropdown.pack(side="left", padx=(5, 0))
+
         # 開始ボタン
         self.start_button = tk.Button(
             main_frame,
@@ -153,24 +209,19 @@ class AmazonRankingApp(tk.Tk):
         self.log_text = tk.Text(log_frame, wrap="word", state="disabled", font=(FONT_FAMILY, 10))
         self.log_text.pack(expand=True, fill="both", padx=10, pady=(0, 10))
 
-    def get_google_sheets_service(self):
-        """Google Sheets API サービスクライアントを返す。"""
+    def get_sheets_client(self):
+        """Google Sheets API クライアントを返す（プロセス内で1つを使い回す）。"""
         # Use executable directory when frozen so users can replace the JSON
         if getattr(sys, 'frozen', False):
             base_dir = os.path.dirname(sys.executable)
         else:
             base_dir = os.path.dirname(os.path.abspath(__file__))
         creds_path = os.path.join(base_dir, "weighty-vertex-464012-u4-7cd9bab1166b.json")
-        scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-        credentials = service_account.Credentials.from_service_account_file(creds_path, scopes=scopes)
-        return build("sheets", "v4", credentials=credentials)
+        return get_client(creds_path)
 
     def fetch_sheet_titles(self, spreadsheet_id):
         """スプレッドシート ID からシート名一覧を取得して返す。"""
-        service = self.get_google_sheets_service()
-        meta = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
-        sheets = meta.get("sheets", [])
-        return [s["properties"]["title"] for s in sheets if "properties" in s and "title" in s["properties"]]
+        return self.get_sheets_client().sheet_titles(spreadsheet_id, log=lambda message: self.after(0, self.update_log, message))
 
     def load_sheets_for_selected_id(self, event=None):
         selected_id = self.id_dropdown.get()
@@ -206,8 +257,13 @@ class AmazonRankingApp(tk.Tk):
             self.after(0, messagebox.showerror, "エラー", f"シート取得中にエラーが発生しました: {e}")
 
     def load_spreadsheet_ids(self):
-        """spreadsheetIDs.csv の先頭列から ID を読み込み、リストで返す。"""
+        """spreadsheetIDs.csv の先頭列から ID を読み込み、リストで返す。
+
+        2列目にキーワードファイル名があれば、そのスプレッドシートに書き込むキーワードとして使う
+        （self.keyword_files に保存。省略時は keywords.csv）。
+        """
         ids = []
+        self.keyword_files = {}
         try:
             if getattr(sys, 'frozen', False):
                 base_dir = os.path.dirname(sys.executable)
@@ -226,6 +282,8 @@ class AmazonRankingApp(tk.Tk):
                     if value.lower() in header_like:
                         continue
                     ids.append(value)
+                    if len(row) > 1 and row[1].strip():
+                        self.keyword_files[value] = row[1].strip()
         except FileNotFoundError:
             # ファイルが無い場合は空リストを返す（UI 側でプレースホルダのみ表示）
             pass
@@ -237,166 +295,504 @@ class AmazonRankingApp(tk.Tk):
                 pass
         return ids
 
-    def start_scraping(self):
-        self.error_label.config(text="")
+    def _selected_target(self):
+        """ドロップダウンで選択中の (ID, シート) を返す。未選択なら None。"""
         selected_id = self.id_dropdown.get()
         selected_sheet = self.sheet_dropdown.get()
-
         if selected_id == "IDを選択してください" or selected_sheet == "シートを選択してください":
+            return None
+        return selected_id, selected_sheet
+
+    def add_target(self):
+        self.error_label.config(text="")
+        target = self._selected_target()
+        if target is None:
             self.error_label.config(text="⚠️ スプレッドシートを選択してください。")
             return
+        if target in self.targets:
+            return
+        self.targets.append(target)
+        self.targets_listbox.insert(tk.END, f"{target[1]}  ({target[0]})")
+
+    def remove_target(self):
+        for index in reversed(self.targets_listbox.curselection()):
+            self.targets_listbox.delete(index)
+            del self.targets[index]
+
+    def start_scraping(self):
+        self.error_label.config(text="")
+        targets = list(self.targets)
+        if not targets:
+            target = self._selected_target()
+            if target is None:
+                self.error_label.config(text="⚠️ スプレッドシートを選択してください。")
+                return
+            targets = [target]
 
         # 開始ボタンを無効化
         self.start_button.config(state="disabled", text="🔄 実行中...")
 
         self.update_log("スクリプトを開始します...")
-        self.update_log(f"選択されたID: {selected_id}")
-        self.update_log(f"選択されたシート: {selected_sheet}")
+        for selected_id, selected_sheet in targets:
+            self.update_log(f"選択されたID: {selected_id}")
+            self.update_log(f"選択されたシート: {selected_sheet}")
 
         # scrap.py をバックグラウンドで実行し、出力を逐次ログに反映
-        thread = threading.Thread(target=self._run_scrap_and_stream_logs, args=(selected_id, selected_sheet), daemon=True)
+        options = {"resume": self.resume_var.get()}
+        selected_profile = self.profile_dropdown.get()
+        # 画面で選び直した場合だけ --profile を渡し、それ以外は RUN_PROFILE をそのまま使う
+        if selected_profile != self.default_profile:
+            options["profile"] = selected_profile
+        if options["resume"]:
+            self.update_log("再開モード: 本日取得済みのキーワードはスキップします。")
+        self.update_log(f"実行プロファイル: {selected_profile}")
+        thread = threading.Thread(target=self._run_scrap_and_stream_logs, args=(targets, options), daemon=True)
         thread.start()
 
-    def _run_scrap_and_stream_logs(self, spreadsheet_id, sheet_name):
+    def _prepare_targets(self, targets):
+        """書き込み先ごとのキーワードを読み込み、(書き込み先のリスト, 全体のキーワードファイル, マーケットプレイス) を返す。
+
+        書き込み先のキーワードがすべて keywords.csv の場合はキーワードファイルは None（scrap.py の既定）。
+        それ以外は全書き込み先のキーワードの和集合を一時ファイルに書き出し、1回の取得で済ませる。
+        「us:キーワード」の形のキーワードは、キーワードだけをそのマーケットプレイスで検索する
+        （一時ファイルの3列目にキーワードごとのマーケットプレイスを書き、結果は「us:キーワード」の列に書き込まれる）。
+        マーケットプレイスは、名前が付いたキーワードが無ければ None（MARKETPLACES のまま）。
+        """
+        prepared = []
+        union = {}  # keyword -> depth（同じキーワードは深い方を使う）
+        searched_in = {}  # keyword -> そのキーワードを検索するマーケットプレイス名の集合
+        primary = primary_marketplace(os.getenv("TARGET_URL")).name
+        custom = False
+        for spreadsheet_id, sheet_name in targets:
+            csv_name = self.keyword_files.get(spreadsheet_id, "keywords.csv")
+            custom = custom or csv_name != "keywords.csv"
+            rows = self.load_keyword_rows(csv_name)
+            prepared.append({
+                "spreadsheet_id": spreadsheet_id,
+                "sheet": sheet_name,
+                "keywords": [keyword for keyword, _ in rows],
+            })
+            for keyword, depth in rows:
+                name, keyword = split_tagged_keyword(keyword)
+                searched_in.setdefault(keyword, set()).add(name or primary)
+                known = union.get(keyword)
+                if known is None or (depth and (not known or int(depth) > int(known))):
+                    union[keyword] = depth
+        names = set().union(*searched_in.values())
+        tagged = bool(names - {primary})
+        marketplaces = None
+        if tagged:
+            # 名前が付いたキーワードだけを他のマーケットプレイスで検索する（すべてのキーワードを掛け合わせない）
+            marketplaces = ",".join([primary] + sorted(names - {primary}))
+            self.after(0, self.update_log, f"🌐 マーケットプレイス: {marketplaces}")
+        if not custom and not tagged:
+            return prepared, None, None
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", prefix="keywords_", delete=False, newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            for keyword, depth in union.items():
+                if tagged:
+                    writer.writerow([keyword, depth, " ".join(sorted(searched_in[keyword]))])
+                else:
+                    writer.writerow([keyword, depth] if depth else [keyword])
+        self.after(0, self.update_log, f"🔀 {len(prepared)} 件の書き込み先のキーワード {len(union)} 件をまとめて取得します。")
+        return prepared, f.name, marketplaces
+
+    def _connect_scrap_server(self):
+        """常駐スクレイパー（scrap_server.py）が起動していれば接続したソケットを返す。"""
+        host = os.getenv("SCRAP_SERVER_HOST", "127.0.0.1")
         try:
-            base_dir_script = os.path.dirname(os.path.abspath(__file__))
-            # When frozen (exe), re-invoke the same executable with a special flag to run scraping
-            if getattr(sys, 'frozen', False):
-                cmd = [sys.executable, "--run-scrap", "--spreadsheet-id", spreadsheet_id, "--sheet", sheet_name]
-                run_cwd = os.path.dirname(sys.executable)
+            port = int(os.getenv("SCRAP_SERVER_PORT", "8765"))
+        except ValueError:
+            port = 8765
+        try:
+            sock = socket.create_connection((host, port), timeout=1)
+        except OSError:
+            return None
+        sock.settimeout(None)
+        return sock
+
+    def _run_on_scrap_server(self, sock, spreadsheet_id, sheet_name, options):
+        """常駐スクレイパーにジョブを送り、(出力行のイテレータ, 終了コード取得関数) を返す。
+
+        常駐スクレイパーが別のジョブを実行中の場合は None を返す。
+        """
+        job = {"spreadsheet_id": spreadsheet_id, "sheet": sheet_name, **options}
+        sock.sendall((json.dumps(job, ensure_ascii=False) + "\n").encode("utf-8"))
+        stream = sock.makefile("r", encoding="utf-8", errors="replace")
+        state = {"return_code": None}
+        # 実行中のジョブがある場合、サーバーは SCRAP_BUSY の1行だけを返して切断する
+        first_line = stream.readline()
+        if first_line.strip() == "SCRAP_BUSY":
+            stream.close()
+            sock.close()
+            return None
+
+        def _lines():
+            try:
+                for line in itertools.chain([first_line] if first_line else [], stream):
+                    if line.startswith("SCRAP_EXIT:"):
+                        state["return_code"] = int(line[len("SCRAP_EXIT:"):].strip() or 1)
+                        break
+                    yield line
+            finally:
+                stream.close()
+                sock.close()
+
+        def _wait():
+            # The server closed the connection without an exit code: treat as a failure
+            return state["return_code"] if state["return_code"] is not None else 1
+
+        return _lines(), _wait
+
+    def _scrap_option_args(self, options):
+        """実行オプションを scrap.py のコマンドライン引数に変換する。"""
+        args = []
+        if options.get("resume"):
+            args.append("--resume")
+        if options.get("keywords_file"):
+            args.extend(["--keywords-file", options["keywords_file"]])
+        if options.get("profile"):
+            args.extend(["--profile", options["profile"]])
+        if options.get("marketplaces"):
+            args.extend(["--marketplaces", options["marketplaces"]])
+        return args
+
+    def _run_in_subprocess(self, spreadsheet_id, sheet_name, options):
+        """scrap.py を子プロセスで実行し、(出力行のイテレータ, 終了コード取得関数) を返す。"""
+        base_dir_script = os.path.dirname(os.path.abspath(__file__))
+        # When frozen (exe), re-invoke the same executable with a special flag to run scraping
+        if getattr(sys, 'frozen', False):
+            cmd = [sys.executable, "--run-scrap", "--spreadsheet-id", spreadsheet_id, "--sheet", sheet_name, *self._scrap_option_args(options)]
+            run_cwd = os.path.dirname(sys.executable)
+        else:
+            script_path = os.path.join(base_dir_script, "scrap.py")
+            if not os.path.exists(script_path):
+                return None
+            cmd = [sys.executable, "-u", script_path, "--spreadsheet-id", spreadsheet_id, "--sheet", sheet_name, *self._scrap_option_args(options)]
+            run_cwd = base_dir_script
+        env = os.environ.copy()
+        env["PYTHONIOENCODING"] = "utf-8"
+        env["PYTHONUNBUFFERED"] = "1"
+        env["PYTHONLEGACYWINDOWSSTDIO"] = "1"
+        proc = subprocess.Popen(
+            cmd,
+            cwd=run_cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=1,
+            universal_newlines=True,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            env=env,
+        )
+
+        def _lines():
+            if proc.stdout is None:
+                return
+            while True:
+                line = proc.stdout.readline()
+                if not line:
+                    if proc.poll() is not None:
+                        break
+                    continue
+                yield line
+
+        return _lines(), proc.wait
+
+    def _run_scrap_and_stream_logs(self, targets, options):
+        writer_queue = None
+        keywords_file = None
+        try:
+            targets, keywords_file, marketplaces = self._prepare_targets(targets)
+            if keywords_file:
+                options = {**options, "keywords_file": keywords_file}
+            if marketplaces:
+                options = {**options, "marketplaces": marketplaces}
+            # scrap.py には先頭の書き込み先を渡す（ログ表示用）
+            spreadsheet_id, sheet_name = targets[0]["spreadsheet_id"], targets[0]["sheet"]
+
+            # 常駐スクレイパーが起動していれば、起動済みのブラウザでジョブを実行する
+            run = None
+            sock = self._connect_scrap_server()
+            if sock is not None:
+                run = self._run_on_scrap_server(sock, spreadsheet_id, sheet_name, options)
+                if run is None:
+                    self.after(0, self.update_log, "⏳ 常駐スクレイパーは別のジョブを実行中のため、scrap.py を起動して実行します。")
+                else:
+                    self.after(0, self.update_log, "⚡ 常駐スクレイパーに接続しました。")
+            if run is not None:
+                lines, wait = run
             else:
-                script_path = os.path.join(base_dir_script, "scrap.py")
-                if not os.path.exists(script_path):
+                run = self._run_in_subprocess(spreadsheet_id, sheet_name, options)
+                if run is None:
                     self.after(0, self.update_log, "エラー: scrap.py が見つかりません。")
                     self.after(0, messagebox.showerror, "エラー", "scrap.py が見つかりません。ファイルが同じディレクトリにあるか確認してください。")
+                    self.after(0, self._enable_start_button)
                     return
-                cmd = [sys.executable, "-u", script_path, "--spreadsheet-id", spreadsheet_id, "--sheet", sheet_name]
-                run_cwd = base_dir_script
-            env = os.environ.copy()
-            env["PYTHONIOENCODING"] = "utf-8"
-            env["PYTHONUNBUFFERED"] = "1"
-            env["PYTHONLEGACYWINDOWSSTDIO"] = "1"
-            proc = subprocess.Popen(
-                cmd,
-                cwd=run_cwd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                bufsize=1,
-                universal_newlines=True,
-                text=True,
-                encoding="utf-8",
-                errors="replace",
-                env=env,
-            )
-
-            result_data = None
-            if proc.stdout is not None:
-                while True:
-                    line = proc.stdout.readline()
-                    if not line:
-                        if proc.poll() is not None:
-                            break
+                lines, wait = run
+
+            # キーワードごとの結果イベントを受け取るたびに、書き込みスレッドへ渡す
+            total_keywords = 0
+            received = 0
+            for line in lines:
+                line = line.rstrip("\n")
+                if not line:
+                    continue
+                event = parse_event(line)
+                if event is not None:
+                    if event.get("v") != PROTOCOL_VERSION:
+                        self.after(0, self.update_log, f"⚠️ 未対応のイベント形式です (v{event.get('v')})")
+                        continue
+                    event_type = event["type"]
+                    if event_type == "run_started":
+                        total_keywords = len(event.get("keywords", []))
+                        if writer_queue is None:
+                            writer_queue = self._start_sheet_writer(targets, event.get("run_id"))
+                    elif event_type == "keyword_result":
+                        received += 1
+                        if writer_queue is None:
+                            writer_queue = self._start_sheet_writer(targets)
+                        writer_queue.put(("result", event["result"]))
+                        self.after(0, self.update_log, f"📊 結果を受信しました ({received}/{total_keywords or '?'})")
+                    elif event_type == "keyword_error":
+                        self.after(0, self.update_log, f"⚠️ {event.get('keyword')}: {event.get('error')}")
+                    continue
+                # 結果データをキャプチャ（イベントに対応していない scrap.py の場合のみ使用）
+                if line.startswith("RESULT_DATA:"):
+                    if writer_queue is not None:
                         continue
-                    line = line.rstrip("\n")
-                    if line:
-                        # 結果データをキャプチャ
-                        if line.startswith("RESULT_DATA:"):
-                            try:
-                                result_json = line[12:]  # "RESULT_DATA:" を除去
-                                result_data = json.loads(result_json)
-                                self.after(0, self.update_log, f"📊 結果データを取得しました: {len(result_data)}件")
-                            except json.JSONDecodeError as e:
-                                self.after(0, self.update_log, f"⚠️ 結果データの解析に失敗: {e}")
-                        else:
-                            self.after(0, self.update_log, line)
-
-            return_code = proc.wait()
+                    try:
+                        result_json = line[12:]  # "RESULT_DATA:" を除去
+                        result_data = json.loads(result_json)
+                        self.after(0, self.update_log, f"📊 結果データを取得しました: {len(result_data)}件")
+                        writer_queue = self._start_sheet_writer(targets)
+                        for item in result_data:
+                            writer_queue.put(("result", item))
+                    except json.JSONDecodeError as e:
+                        self.after(0, self.update_log, f"⚠️ 結果データの解析に失敗: {e}")
+                else:
+                    self.after(0, self.update_log, line)
+
+            return_code = wait()
             if return_code == 0:
                 self.after(0, self.update_log, "✅ スクレイピングが完了しました。")
-                # 結果データをスプレッドシートに書き込み
-                if result_data:
-                    self.after(0, self._write_to_spreadsheet, spreadsheet_id, sheet_name, result_data)
-                else:
-                    self.after(0, self.update_log, "⚠️ 結果データがありません。")
-                    # 結果データがない場合もボタンを再有効化
-                    self.after(0, self._enable_start_button)
             else:
                 self.after(0, self.update_log, f"⚠️ scrap.py が異常終了しました (exit {return_code})")
-                # スクレイピングが異常終了した場合もボタンを再有効化
+            if writer_queue is not None:
+                # 残りの結果を書き込み、完了後に書き込みスレッドがボタンを再有効化する
+                writer_queue.put(("done", return_code))
+            else:
+                self.after(0, self.update_log, "⚠️ 結果データがありません。")
+                # 結果データがない場合もボタンを再有効化
                 self.after(0, self._enable_start_button)
         except Exception as e:
             self.after(0, self.update_log, f"実行中にエラーが発生しました: {e}")
             self.after(0, messagebox.showerror, "エラー", f"実行中にエラーが発生しました: {e}")
-            # エラーが発生した場合もボタンを再有効化
-            self.after(0, self._enable_start_button)
+            if writer_queue is not None:
+                writer_queue.put(("done", None))
+            else:
+                # エラーが発生した場合もボタンを再有効化
+                self.after(0, self._enable_start_button)
+        finally:
+            if keywords_file:
+                try:
+                    os.remove(keywords_file)
+                except OSError:
+                    pass
+
+    def _start_sheet_writer(self, targets, run_id=None):
+        """スクレイピングと並行してスプレッドシートへ書き込むスレッドを開始し、結果を渡すキューを返す。
+
+        run_id は scrap.py の実行ID（メトリクスのファイル名に使う）。なければ新しく作る。
+        """
+        self.after(0, self.update_log, f"📝 スプレッドシートの準備中... ({len(targets)}件)")
+        writer_queue = queue.Queue()
+        metrics = Metrics("sheets", run_id or uuid.uuid4().hex, targets=len(targets))
+        thread = threading.Thread(
+            target=self._sheet_fanout_thread,
+            args=(targets, writer_queue, metrics),
+            daemon=True
+        )
+        thread.start()
+        return writer_queue
 
-    def _write_to_spreadsheet(self, spreadsheet_id, sheet_name, result_data):
-        """スプレッドシートに結果データを書き込む"""
-        try:
-            self.update_log("📝 スプレッドシートに書き込み中...")
-            
-            # バックグラウンドでスプレッドシート操作を実行
-            thread = threading.Thread(
-                target=self._write_to_spreadsheet_thread, 
-                args=(spreadsheet_id, sheet_name, result_data), 
-                daemon=True
-            )
-            thread.start()
-            
-        except Exception as e:
-            self.update_log(f"スプレッドシート書き込みエラー: {e}")
-            messagebox.showerror("エラー", f"スプレッドシート書き込みエラー: {e}")
+    def _sheet_fanout_thread(self, targets, writer_queue, metrics):
+        """結果を書き込み先ごとに振り分け、最大 SHEET_WRITERS 個のスレッドで並行して書き込む。
 
-    def _write_to_spreadsheet_thread(self, spreadsheet_id, sheet_name, result_data):
-        """スプレッドシート書き込みのバックグラウンド処理"""
+        各書き込み先には、そのキーワードに含まれる結果だけを渡す。どの書き込み先にも含まれない結果はログに出す。
+        すべて終わったら Sheets API の読み書きの所要時間（metrics）を書き出す。
+        """
         try:
-            service = self.get_google_sheets_service()
-            
+            max_writers = max(1, int(os.getenv("SHEET_WRITERS", "4")))
+        except ValueError:
+            max_writers = 4
+        target_queues = [queue.Queue() for _ in targets]
+        keyword_sets = [{normalize_keyword(keyword) for keyword in target["keywords"]} for target in targets]
+        with ThreadPoolExecutor(max_workers=min(max_writers, len(targets)), thread_name_prefix="sheet-writer") as pool:
+            for target, target_queue in zip(targets, target_queues):
+                pool.submit(self._sheet_writer_thread, target["spreadsheet_id"], target["sheet"], target["keywords"], target_queue, metrics)
+            dropped = 0
+            while True:
+                kind, payload = writer_queue.get()
+                delivered = False
+                for target_queue, keyword_set in zip(target_queues, keyword_sets):
+                    if kind == "done" or normalize_keyword(payload["keyword"]) in keyword_set:
+                        target_queue.put((kind, payload))
+                        delivered = True
+                if kind == "done":
+                    break
+                if not delivered:
+                    dropped += 1
+                    self.after(0, self.update_log, f"⚠️ {payload['keyword']} はどの書き込み先のキーワードにも無いため、書き込みません。")
+        if dropped:
+            self.after(0, self.update_log, f"⚠️ 書き込み先の無い結果が {dropped} 件ありました（他のマーケットプレイスの結果は「us:キーワード」の形でキーワードファイルに並べてください）。")
+        if len(targets) > 1:
+            self.after(0, self.update_log, f"✅ {len(targets)} 件の書き込み先の処理が終わりました。")
+        for line in metrics.summary_lines():
+            self.after(0, self.update_log, line)
+        try:
+            if getattr(sys, 'frozen', False):
+                base_dir = os.path.dirname(sys.executable)
+            else:
+                base_dir = os.path.dirname(os.path.abspath(__file__))
+            metrics.write(base_dir)
+        except OSError as e:
+            self.after(0, self.update_log, f"⚠️ メトリクスの書き出しに失敗しました: {e}")
+        # すべての書き込み先の処理が終わったらボタンを再有効化
+        self.after(0, self._enable_start_button)
+
+    def _sheet_writer_thread(self, spreadsheet_id, sheet_name, keywords, writer_queue, metrics):
+        """スプレッドシート書き込みのバックグラウンド処理
+
+        キューから ("result", 結果) を受け取り、SHEET_FLUSH_EVERY 件ごとに当日の行を更新する。
+        ("done", 終了コード) を受け取ったら残りを書き込んで終了する。途中でスクレイピングが
+        異常終了しても、それまでに受け取った結果は書き込まれる。
+
+        読み込みは開始時の batchGet 1回、書き込みはヘッダーとデータ行をまとめた
+        values.batchUpdate をフラッシュごとに1回だけ行う。
+        """
+        try:
+            flush_every = max(1, int(os.getenv("SHEET_FLUSH_EVERY", "20")))
+        except ValueError:
+            flush_every = 20
+        result_data = []
+        unwritten = 0
+        ready = False
+        failed = False
+        client = layout = current_date = history = row_index = None
+        pending = []  # 次のデータ行の書き込みにまとめる範囲（ヘッダーの再設定など）
+        needs_clear = False  # ヘッダーが一致しないシートは、最初のデータ行を書き込む直前にクリアする
+
+        def _log(message):
+            self.after(0, self.update_log, message)
+
+        def _report_error(e):
+            self.after(0, self.update_log, f"スプレッドシート書き込みエラー（{sheet_name}）: {e}")
+            self.after(0, messagebox.showerror, "エラー", f"スプレッドシート書き込みエラー（{sheet_name}）: {e}")
+
+        def _write_rows():
+            nonlocal pending, unwritten, needs_clear
+            if needs_clear:
+                # 結果が1件も無いまま終わった場合に、既存のデータを消さないようにここまで遅らせる
+                self._clear_sheet(client, spreadsheet_id, sheet_name, layout, history, metrics)
+                needs_clear = False
+            self._add_or_update_data_row(client, spreadsheet_id, sheet_name, current_date, result_data, layout, history, row_index, pending, metrics)
+            pending = []
+            unwritten = 0
+
+        # ヘッダーの検証と行の特定はスクレイピングと並行して先に済ませる
+        try:
+            client = self.get_sheets_client()
+
+            # 当日の行番号はローカルの履歴DBから引く（シートを毎回読み直さない）
+            if getattr(sys, 'frozen', False):
+                base_dir = os.path.dirname(sys.executable)
+            else:
+                base_dir = os.path.dirname(os.path.abspath(__file__))
+            history = RankHistory(history_path(base_dir))
+
             # 現在の日付を取得
             current_date = datetime.now().strftime("%Y/%m/%d")
-            
-            # キーワードを読み込み
-            keywords = self.load_keywords()
+
             if not keywords:
-                self.after(0, self.update_log, "⚠️ keywords.csv が見つかりません。")
-                return
-            
-            # スプレッドシートの現在の内容を取得
-            range_name = f"{sheet_name}!A1:Z100"  # 十分な範囲を指定
-            result = service.spreadsheets().values().get(
-                spreadsheetId=spreadsheet_id, 
-                range=range_name
-            ).execute()
-            
-            values = result.get('values', [])
-            
-            # ヘッダーを検証・設定
-            if not self._validate_and_set_headers(service, spreadsheet_id, sheet_name, values, keywords):
-                self.after(0, self.update_log, "⚠️ ヘッダーの設定に失敗しました。")
-                return
-            
-            # データ行を追加/更新
-            self._add_or_update_data_row(service, spreadsheet_id, sheet_name, current_date, result_data, keywords)
-            
-            self.after(0, self.update_log, "✅ スプレッドシートへの書き込みが完了しました。")
-            # スプレッドシート書き込み完了後にボタンを再有効化
-            self.after(0, self._enable_start_button)
-            
+                self.after(0, self.update_log, f"⚠️ {sheet_name}: キーワードファイルが見つかりません。")
+            else:
+                layout = SheetLayout(keywords)
+                row_index = history.sheet_row(spreadsheet_id, sheet_name, current_date)
+
+                # Z 列・1000 行を超える場合に備えて、先にシートの行数・列数を確保する
+                with metrics.span("sheets_grid", sheet=sheet_name):
+                    properties = client.sheet_properties(spreadsheet_id, sheet_name, log=_log)
+                    client.ensure_grid(spreadsheet_id, properties, max(row_index or 0, FIRST_DATA_ROW), layout.total_columns, log=_log)
+
+                # ヘッダー行（1〜2行目）と、行番号が未記録なら日付列（A列）だけを1回で取得
+                ranges = [layout.header_range(sheet_name)]
+                if row_index is None:
+                    ranges.append(layout.date_column_range(sheet_name))
+                with metrics.span("sheets_read", sheet=sheet_name) as counts:
+                    fetched = client.batch_get(spreadsheet_id, ranges, log=_log)
+                    counts["ranges"] = len(ranges)
+                    counts["rows"] = sum(len(values) for values in fetched)
+
+                # ヘッダーを検証（書き込みは最初のデータ行とまとめる）
+                header_data = self._validate_and_set_headers(client, spreadsheet_id, sheet_name, fetched[0], layout, history, metrics)
+                if header_data is None:
+                    self.after(0, self.update_log, "⚠️ ヘッダーの設定に失敗しました。")
+                else:
+                    pending = header_data
+                    if header_data:
+                        # シートをクリアして書き直すのでデータ行は3行目から
+                        needs_clear = True
+                        row_index = FIRST_DATA_ROW
+                    elif row_index is None:
+                        row_index = DateIndex(fetched[1] if len(fetched) > 1 else []).row_for(current_date)
+                        with metrics.span("sheets_grid", sheet=sheet_name):
+                            client.ensure_grid(spreadsheet_id, properties, row_index, layout.total_columns, log=_log)
+                    ready = True
         except Exception as e:
-            self.after(0, self.update_log, f"スプレッドシート書き込みエラー: {e}")
-            self.after(0, messagebox.showerror, "エラー", f"スプレッドシート書き込みエラー: {e}")
-            # エラーが発生した場合もボタンを再有効化
-            self.after(0, self._enable_start_button)
+            failed = True
+            _report_error(e)
+
+        while True:
+            kind, payload = writer_queue.get()
+            if kind == "done":
+                break
+            result_data.append(payload)
+            unwritten += 1
+            if ready and not failed and unwritten >= flush_every:
+                try:
+                    # データ行を追加/更新（途中経過）
+                    _write_rows()
+                except Exception as e:
+                    failed = True
+                    _report_error(e)
+
+        if ready and not failed and result_data:
+            try:
+                if unwritten:
+                    # データ行を追加/更新
+                    _write_rows()
+                self.after(0, self.update_log, f"✅ {sheet_name}: スプレッドシートへの書き込みが完了しました。({len(result_data)}件)")
+            except Exception as e:
+                _report_error(e)
+        elif not result_data:
+            if needs_clear:
+                self.after(0, self.update_log, f"⚠️ {sheet_name}: 結果データがないため、ヘッダーの再設定（シートのクリア）は行いませんでした。")
+            else:
+                self.after(0, self.update_log, f"⚠️ {sheet_name}: 結果データがありません。")
+        if history is not None:
+            history.close()
 
-    def load_keywords(self):
-        """keywords.csvからキーワードを読み込む"""
+    def load_keyword_rows(self, csv_name="keywords.csv"):
+        """キーワードファイルから (キーワード, 検索ページ数の文字列) のリストを読み込む"""
         keywords = []
         try:
             if getattr(sys, 'frozen', False):
                 base_dir = os.path.dirname(sys.executable)
             else:
                 base_dir = os.path.dirname(os.path.abspath(__file__))
-            csv_path = os.path.join(base_dir, "keywords.csv")
+            csv_path = os.path.join(base_dir, csv_name)
             with open(csv_path, newline='', encoding='utf-8-sig') as f:
                 reader = csv.reader(f)
                 for row in reader:
@@ -408,150 +804,62 @@ class AmazonRankingApp(tk.Tk):
                     header_like = {"keyword", "keywords", "キーワード"}
                     if value.lower() in header_like:
                         continue
-                    keywords.append(value)
+                    depth = row[1].strip() if len(row) > 1 else ""
+                    keywords.append((value, depth if depth.isdigit() else ""))
         except FileNotFoundError:
             pass
         except Exception as e:
             self.after(0, self.update_log, f"キーワード読み込みエラー: {e}")
         return keywords
 
-    def _validate_and_set_headers(self, service, spreadsheet_id, sheet_name, values, keywords):
-        """ヘッダーを検証し、必要に応じて設定する"""
+    def _validate_and_set_headers(self, client, spreadsheet_id, sheet_name, values, layout, history, metrics):
+        """ヘッダーを検証する
+
+        一致すれば空のリスト、一致しなければ書き込むヘッダーの範囲のリストを返す。エラー時は None を返す。
+        シートのクリアとヘッダーの書き込みは、最初のデータ行の書き込みまで行わない（_clear_sheet を参照）。
+        """
         try:
-            # キーワード数に基づいて列数を計算
-            keyword_count = len(keywords)
-            total_columns = 1 + (keyword_count * 3)  # 日付列 + (キーワード数 × 3カテゴリ)
-            
-            # 期待するヘッダー構造を動的に生成
-            expected_header1 = ["日付/キーワード"]
-            expected_header2 = [""]
-            
-            # 各カテゴリ（自然検索、SP、SB）のヘッダーを生成
-            categories = ["自然検索", "SP", "SB"]
-            for category in categories:
-                expected_header1.append(category)
-                expected_header2.extend(keywords)  # 各カテゴリに全キーワードを配置
-                # カテゴリ名の後の空列を追加
-                for _ in range(keyword_count - 1):
-                    expected_header1.append("")
-            
             # 現在のヘッダーをチェック
-            if len(values) >= 2:
-                current_header1 = values[0][:total_columns] if len(values[0]) >= total_columns else values[0]
-                if len(current_header1) < total_columns:
-                    current_header1 += [""] * (total_columns - len(current_header1))
-                current_header2 = values[1][:total_columns] if len(values[1]) >= total_columns else values[1]
-                
-                # ヘッダーが一致するかチェック
-                if (current_header1 == expected_header1 and 
-                    current_header2 == expected_header2):
-                    return True
-            
-            # ヘッダーが一致しない場合はクリアして再設定
-            self.after(0, self.update_log, "🔄 ヘッダーを再設定します...")
-            
-            # シート全体をクリア
-            service.spreadsheets().values().clear(
-                spreadsheetId=spreadsheet_id,
-                range=f"{sheet_name}!A:Z"
-            ).execute()
+            if layout.headers_match(values):
+                return []
             
-            # 新しいヘッダーを設定
-            header1 = expected_header1
-            header2 = expected_header2
+            # ヘッダーが一致しない場合は、最初のデータ行の書き込み時にクリアして再設定
+            self.after(0, self.update_log, "🔄 ヘッダーを再設定します（最初の結果の書き込み時にシートをクリアします）...")
             
-            # ヘッダーを書き込み
-            end_column = chr(ord('A') + total_columns - 1)  # 最後の列を計算
-            body = {
-                'values': [header1, header2]
-            }
-            service.spreadsheets().values().update(
-                spreadsheetId=spreadsheet_id,
-                range=f"{sheet_name}!A1:{end_column}2",
-                valueInputOption='RAW',
-                body=body
-            ).execute()
-            
-            return True
+            # 新しいヘッダー（最初のデータ行と一緒に書き込む）
+            return [{
+                'range': layout.header_range(sheet_name),
+                'values': list(layout.expected_headers())
+            }]
             
         except Exception as e:
             self.after(0, self.update_log, f"ヘッダー設定エラー: {e}")
-            return False
+            return None
+
+    def _clear_sheet(self, client, spreadsheet_id, sheet_name, layout, history, metrics):
+        """ヘッダーを再設定するシート全体をクリアする"""
+        with metrics.span("sheets_clear", sheet=sheet_name):
+            client.clear(spreadsheet_id, layout.sheet_range(sheet_name), log=lambda message: self.after(0, self.update_log, message))
+        # クリアしたので記録済みの行番号は無効
+        history.forget_sheet(spreadsheet_id, sheet_name)
 
-    def _add_or_update_data_row(self, service, spreadsheet_id, sheet_name, current_date, result_data, keywords):
-        """データ行を追加または更新する"""
+    def _add_or_update_data_row(self, client, spreadsheet_id, sheet_name, current_date, result_data, layout, history, row_index, pending, metrics):
+        """データ行を書き込む（pending のヘッダーなどと1回の batchUpdate にまとめる）"""
         try:
-            # 既存のデータを取得
-            range_name = f"{sheet_name}!A3:Z100"
-            result = service.spreadsheets().values().get(
-                spreadsheetId=spreadsheet_id, 
-                range=range_name
-            ).execute()
-            
-            values = result.get('values', [])
-            
-            # 同じ日付の行を探す
-            row_index = None
-            for i, row in enumerate(values):
-                if row and len(row) > 0 and row[0] == current_date:
-                    row_index = i + 3  # 1ベースの行番号（ヘッダーが2行あるため+3）
-                    break
-            
-            # キーワード数に基づいて列数を計算
-            keyword_count = len(keywords)
-            total_columns = 1 + (keyword_count * 3)  # 日付列 + (キーワード数 × 3カテゴリ)
-            
-            # 結果データを整理（動的な列数のデータ行を作成）
-            # 各カテゴリ（自然検索、SP、SB）にキーワード数の結果を配置
-            organic_results = ["-"] * keyword_count  # 自然検索のキーワード結果
-            sp_results = ["-"] * keyword_count       # SPのキーワード結果
-            sb_results = ["-"] * keyword_count       # SBのキーワード結果
-            
-            # 結果データから各キーワードの結果を取得
-            for item in result_data:
-                # BOM文字を除去して比較
-                result_keyword = item["keyword"].lstrip('\ufeff').strip()
-                
-                # キーワードのインデックスを取得
-                keyword_index = None
-                for i, kw in enumerate(keywords):
-                    if result_keyword == kw.lstrip('\ufeff').strip():
-                        keyword_index = i
-                        break
-                
-                if keyword_index is not None:
-                    # 各カテゴリの結果を設定
-                    organic_results[keyword_index] = item["自然検索"]
-                    sp_results[keyword_index] = item["SP"]
-                    sb_results[keyword_index] = item["SB"]
+            # キーワード → 列の対応は layout の辞書で引く
+            new_row = layout.data_row(current_date, result_data)
             
-            # データ行を作成（動的な列数）
-            new_row = [current_date] + organic_results + sp_results + sb_results
-            
-            if row_index:
-                # 既存行を更新
-                end_column = chr(ord('A') + total_columns - 1)  # 最後の列を計算
-                range_name = f"{sheet_name}!A{row_index}:{end_column}{row_index}"
-                body = {'values': [new_row]}
-                service.spreadsheets().values().update(
-                    spreadsheetId=spreadsheet_id,
-                    range=range_name,
-                    valueInputOption='RAW',
-                    body=body
-                ).execute()
-                self.after(0, self.update_log, f"📝 日付 {current_date} の行を更新しました。")
-            else:
-                # 新しい行を追加
-                end_column = chr(ord('A') + total_columns - 1)  # 最後の列を計算
-                body = {'values': [new_row]}
-                service.spreadsheets().values().append(
-                    spreadsheetId=spreadsheet_id,
-                    range=f"{sheet_name}!A:{end_column}",
-                    valueInputOption='RAW',
-                    insertDataOption='INSERT_ROWS',
-                    body=body
-                ).execute()
-                self.after(0, self.update_log, f"📝 日付 {current_date} の新しい行を追加しました。")
+            # ヘッダーとデータ行を1回の batchUpdate で書き込む
+            data = list(pending) + [{
+                'range': layout.row_range(sheet_name, row_index),
+                'values': [new_row]
+            }]
+            with metrics.span("sheets_write", sheet=sheet_name) as counts:
+                client.batch_update(spreadsheet_id, data, log=lambda message: self.after(0, self.update_log, message))
+                counts["ranges"] = len(data)
+                counts["cells"] = sum(len(row) for item in data for row in item['values'])
+            history.set_sheet_row(spreadsheet_id, sheet_name, current_date, row_index)
+            self.after(0, self.update_log, f"📝 {sheet_name}: 日付 {current_date} の行（{row_index}行目）を書き込みました。")
                 
         except Exception as e:
             self.after(0, self.update_log, f"データ行追加エラー: {e}")
@@ -568,8 +876,37 @@ class AmazonRankingApp(tk.Tk):
         self.log_text.config(state="disabled")
 
 if __name__ == "__main__":
+    # Required so the HTML parser process pool can start child processes from the frozen exe
+    import multiprocessing
+    multiprocessing.freeze_support()
+
     # Support headless scrap mode when running the built exe to execute scraping in a child process
-    if "--run-scrap" in sys.argv:
+    if "--run-scrap-server" in sys.argv:
+        # Resident scraper with a warm browser (see scrap_server.py)
+        from scrap_server import main as run_scrap_server
+        run_scrap_server()
+    elif "--run-distributed-worker" in sys.argv:
+        # Worker node of a distributed run (see distributed.py)
+        from distributed import main as run_distributed_worker
+        run_distributed_worker()
+    elif "--run-scrap-shard" in sys.argv:
+        # Shard worker process started by a scraping run with SHARDS >= 2 (see shards.py)
+        import argparse
+        import asyncio
+        from scrap import run_shard_worker
+
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--run-scrap-shard", action="store_true")
+        parser.add_argument("--concurrency", type=int)
+        parser.add_argument("--profile", choices=PROFILE_NAMES)
+        args = parser.parse_args()
+        try:
+            if hasattr(sys.stdout, "reconfigure"):
+                sys.stdout.reconfigure(encoding="utf-8", errors="replace")
+        except Exception:
+            pass
+        asyncio.run(run_shard_worker(args.concurrency, args.profile))
+    elif "--run-scrap" in sys.argv:
         # Lazy imports to avoid impacting the GUI startup path
         import argparse
         import asyncio
@@ -579,6 +916,14 @@ if __name__ == "__main__":
         parser.add_argument("--run-scrap", action="store_true")
         parser.add_argument("--spreadsheet-id", required=True)
         parser.add_argument("--sheet", required=True)
+        parser.add_argument("--concurrency", type=int)
+        parser.add_argument("--depth", type=int)
+        parser.add_argument("--resume", action="store_true", default=None)
+        parser.add_argument("--keywords-file")
+        parser.add_argument("--profile", choices=PROFILE_NAMES)
+        parser.add_argument("--shards", type=int)
+        parser.add_argument("--coordinator-port", type=int)
+        parser.add_argument("--marketplaces")
         args = parser.parse_args()
 
         # Run scraping and stream prints to stdout for the parent GUI process to capture
@@ -589,7 +934,11 @@ if __name__ == "__main__":
                 _sys.stdout.reconfigure(encoding="utf-8", errors="replace")
         except Exception:
             pass
-        asyncio.run(scraping(args.spreadsheet_id, args.sheet))
+        asyncio.run(scraping(args.spreadsheet_id, args.sheet, args.concurrency, args.depth, resume=args.resume, keywords_file=args.keywords_file,
+                             profile=args.profile, shards=args.shards, coordinator_port=args.coordinator_port,
+                             marketplaces=args.marketplaces))
     else:
+        # scrap.py と同じ .env を読み込む（HISTORY_FILE・SHEET_FLUSH_EVERY・SHEET_WRITERS・SCRAP_SERVER_PORT など）
+        load_dotenv()
         app = AmazonRankingApp()
         app.mainloop()
\ No newline at end of file
@@ -0,0 +1,327 @@
+"""
+オフラインのベンチマーク。
+ローカルの偽 Amazon 検索結果サーバーを起動し、scraping() をそのサーバーに対して
+最後まで実行して、キーワード/秒・キーワードごとの所要時間（p50/p95）・最大メモリ使用量を出力する。
+
+    python benchmark.py --keywords 20 --pages 3 --items 48 --sponsored 4 --sb-blocks 2 --concurrency 2
+    python benchmark.py --recorded recorded_pages/ --json bench.json
+    python benchmark.py --profile interactive  # 実行プロファイルの比較（省略時は throughput）
+
+--recorded には保存した検索結果ページの HTML（ファイル名順に 1, 2, ... ページ目）を置いたディレクトリを指定する。
+ジャーナル・履歴・キャッシュは一時ディレクトリに作られ、通常の実行のデータには触れない。
+"""
+import argparse
+import asyncio
+import contextlib
+import csv
+import hashlib
+import html
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlencode, urlsplit
+from events import parse_event
+from metrics import percentile
+from run_profiles import PROFILE_NAMES
+
+SEARCH_PLACEHOLDER = "Amazon.co.jpを検索"
+
+
+def _asin(*parts):
+    """部品から決まった（毎回同じ）ASIN を作る。"""
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode("utf-8")).hexdigest().upper()
+    return "B0" + digest[:8]
+
+
+def target_asins(count):
+    return [f"B0TARGET{index:02d}" for index in range(1, count + 1)]
+
+
+class FakeSerp:
+    """キーワードとページ番号から、毎回同じ内容の検索結果ページを作る。
+
+    ターゲット ASIN は、キーワードごとに決まったページ・位置に自然検索・SP・SB として1つずつ置く。
+    """
+
+    def __init__(self, pages=3, items=48, sponsored=4, sb_blocks=2, targets=3, recorded_dir=None, latency_ms=0):
+        self.pages = pages
+        self.items = items
+        self.sponsored = sponsored
+        self.sb_blocks = sb_blocks
+        self.targets = target_asins(targets)
+        self.latency_ms = latency_ms
+        self.recorded = sorted(Path(recorded_dir).glob("*.html")) if recorded_dir else []
+        if self.recorded:
+            self.pages = len(self.recorded)
+        self.served_pages = 0
+        self._lock = threading.Lock()
+
+    def _placement(self, keyword, slot, length):
+        """(ページ, 位置) を返す。キーワードによってターゲットの位置を変える。"""
+        digest = int(hashlib.sha1(f"{keyword}|{slot}".encode("utf-8")).hexdigest(), 16)
+        return 1 + digest % self.pages, digest // self.pages % max(1, length)
+
+    def render_top(self):
+        return (
+            "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Amazon.co.jp</title></head><body>"
+            f"<form action='/s' method='get'><input type='text' name='k' placeholder='{SEARCH_PLACEHOLDER}'></form>"
+            "</body></html>"
+        )
+
+    def render_results(self, keyword, page_index):
+        if self.recorded:
+            return self.recorded[page_index - 1].read_text(encoding="utf-8")
+        products = []
+        for position in range(self.items):
+            sponsored = position < self.sponsored
+            products.append([_asin(keyword, page_index, position), sponsored])
+        organic_positions = [i for i, (_, sponsored) in enumerate(products) if not sponsored]
+        sponsored_positions = [i for i, (_, sponsored) in enumerate(products) if sponsored]
+        if self.targets:
+            page, offset = self._placement(keyword, "organic", len(organic_positions))
+            if page == page_index and organic_positions:
+                products[organic_positions[offset]][0] = self.targets[0]
+            page, offset = self._placement(keyword, "sp", len(sponsored_positions))
+            if page == page_index and sponsored_positions:
+                products[sponsored_positions[offset]][0] = self.targets[1 % len(self.targets)]
+        cards = []
+        for asin, sponsored in products:
+            label = "<span class='puis-label-popover'>スポンサー</span>" if sponsored else ""
+            cards.append(
+                f"<div role='listitem' data-asin='{asin}' class='s-result-item'>"
+                f"{label}<h2><a href='/dp/{asin}'><span>商品 {asin}</span></a></h2></div>"
+            )
+        blocks = []
+        sb_page, sb_offset = self._placement(keyword, "sb", self.sb_blocks)
+        for block_index in range(self.sb_blocks):
+            asins = [_asin(keyword, page_index, "sb", block_index, i) for i in range(3)]
+            if self.targets and sb_page == page_index and block_index == sb_offset:
+                asins[0] = self.targets[2 % len(self.targets)]
+            links = "".join(f"<a href='/dp/{asin}'>{asin}</a>" for asin in asins)
+            blocks.append(f"<div data-asin=''><h2 class='a-size-medium'>ブランド {block_index + 1}</h2>{links}</div>")
+        # SB blocks sit between the first rows of products, as on the real page
+        body = cards[:4] + blocks + cards[4:]
+        links = []
+        for number in range(1, self.pages + 1):
+            if number != page_index:
+                query = urlencode({"k": keyword, "page": number})
+                links.append(f"<a aria-label='{number}ページに移動' href='/s?{query}'>{number}</a>")
+        return (
+            "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+            f"<title>Amazon.co.jp : {html.escape(keyword)}</title></head><body>"
+            f"<form action='/s' method='get'><input type='text' name='k' placeholder='{SEARCH_PLACEHOLDER}'></form>"
+            f"<div class='s-main-slot'>{''.join(body)}</div>"
+            f"<div class='s-pagination-strip'>{''.join(links)}</div>"
+            "</body></html>"
+        )
+
+    def handle(self, path):
+        """(ステータス, HTML) を返す。"""
+        parts = urlsplit(path)
+        if parts.path == "/":
+            return 200, self.render_top()
+        if parts.path != "/s":
+            return 404, "<html><body>Not Found</body></html>"
+        query = parse_qs(parts.query)
+        keyword = query.get("k", [""])[0]
+        try:
+            page_index = int(query.get("page", ["1"])[0])
+        except ValueError:
+            page_index = 1
+        if not keyword or not 1 <= page_index <= self.pages:
+            return 404, "<html><body>Not Found</body></html>"
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        with self._lock:
+            self.served_pages += 1
+        return 200, self.render_results(keyword, page_index)
+
+
+def start_fake_server(fake, host="127.0.0.1", port=0):
+    """偽サーバーを別スレッドで起動し、サーバーを返す（server.server_address で待ち受け先が分かる）。"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            status, body = fake.handle(self.path)
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class _EventCapture(io.TextIOBase):
+    """scraping() の出力からイベントを拾う（--verbose のときはログもそのまま出す）。"""
+
+    def __init__(self, echo=None):
+        self.echo = echo
+        self.events = []
+        self._buffer = ""
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self._buffer += text
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            event = parse_event(line)
+            if event is not None:
+                self.events.append(event)
+            elif self.echo is not None:
+                self.echo.write(line + "\n")
+        return len(text)
+
+
+def peak_rss_mb():
+    """(このプロセス, 終了済みの子プロセスの最大) の最大常駐メモリ（MB）。取得できない環境では None。"""
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return own, children
+
+
+def _write_inputs(workdir, keyword_count, asins):
+    keywords_file = Path(workdir) / "keywords.csv"
+    asins_file = Path(workdir) / "asins.csv"
+    with open(keywords_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        for index in range(1, keyword_count + 1):
+            writer.writerow([f"ベンチマーク キーワード {index}"])
+    with open(asins_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        for asin in asins:
+            writer.writerow([asin])
+    return keywords_file, asins_file
+
+
+async def run_benchmark(args):
+    from scrap import scraping
+
+    fake = FakeSerp(
+        pages=args.pages,
+        items=args.items,
+        sponsored=args.sponsored,
+        sb_blocks=args.sb_blocks,
+        targets=args.targets,
+        recorded_dir=args.recorded,
+        latency_ms=args.latency_ms,
+    )
+    server = start_fake_server(fake)
+    host, port = server.server_address[:2]
+
+    with tempfile.TemporaryDirectory(prefix="scrap_bench_") as workdir:
+        keywords_file, asins_file = _write_inputs(workdir, args.keywords, fake.targets)
+        os.environ.update({
+            "TARGET_URL": f"http://{host}:{port}/?language=ja_JP",
+            "ASINS_FILE": str(asins_file),
+            "KEYWORDS_FILE": str(keywords_file),
+            "JOURNAL_FILE": str(Path(workdir) / "journal.sqlite3"),
+            "HISTORY_FILE": str(Path(workdir) / "history.sqlite3"),
+            "SERP_CACHE_FILE": str(Path(workdir) / "serp_cache.sqlite3"),
+            # Never reuse (or overwrite) the cookies of real runs; search only the fake marketplace
+            "SESSION_STATE_DIR": str(Path(workdir) / "session_state"),
+            "MARKETPLACES": "",
+        })
+        if not args.cache:
+            os.environ["SERP_CACHE_TTL"] = "0"
+        if not args.scheduler:
+            os.environ["SCHEDULER"] = "0"
+        # Span metrics are only kept when METRICS_DIR is set explicitly
+        os.environ.setdefault("METRICS_DIR", str(Path(workdir) / "metrics"))
+
+        capture = _EventCapture(echo=sys.stderr if args.verbose else None)
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(capture):
+            results = await scraping(concurrency=args.concurrency, depth=args.depth or args.pages, profile=args.profile)
+        elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    latencies = [event["seconds"] for event in capture.events if event["type"] == "timing"]
+    errors = sum(1 for event in capture.events if event["type"] == "keyword_error")
+    own_rss, children_rss = peak_rss_mb()
+    return {
+        "keywords": args.keywords,
+        "completed": len(results),
+        "errors": errors,
+        "pages_served": fake.served_pages,
+        "seconds": round(elapsed, 3),
+        "keywords_per_second": round(len(results) / elapsed, 3) if elapsed else None,
+        "latency_p50_seconds": percentile(latencies, 50),
+        "latency_p95_seconds": percentile(latencies, 95),
+        "peak_rss_mb": round(own_rss, 1) if own_rss is not None else None,
+        "peak_child_rss_mb": round(children_rss, 1) if children_rss is not None else None,
+        "config": {
+            "pages": fake.pages,
+            "items": args.items,
+            "sponsored": args.sponsored,
+            "sb_blocks": args.sb_blocks,
+            "concurrency": args.concurrency,
+            "profile": args.profile,
+            "recorded": str(args.recorded) if args.recorded else None,
+            "latency_ms": args.latency_ms,
+            "cache": args.cache,
+            "scheduler": args.scheduler,
+        },
+    }
+
+
+def _format(value, unit=""):
+    return "-" if value is None else f"{value}{unit}"
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Benchmark scraping() against a local fake SERP server")
+    parser.add_argument("--keywords", type=int, default=10, help="Number of keywords (default: 10)")
+    parser.add_argument("--pages", type=int, default=3, help="Result pages per keyword (default: 3)")
+    parser.add_argument("--depth", type=int, help="Pages to scrape per keyword (default: --pages)")
+    parser.add_argument("--items", type=int, default=48, help="Product cards per page (default: 48)")
+    parser.add_argument("--sponsored", type=int, default=4, help="Sponsored cards per page (default: 4)")
+    parser.add_argument("--sb-blocks", type=int, default=2, help="SB blocks per page (default: 2)")
+    parser.add_argument("--targets", type=int, default=3, help="Target ASINs (default: 3)")
+    parser.add_argument("--recorded", help="Directory of recorded SERP HTML files, one per page in name order")
+    parser.add_argument("--latency-ms", type=int, default=0, help="Artificial server latency per result page")
+    parser.add_argument("--concurrency", type=int, help="Passed to scraping() (default: CONCURRENCY or the profile's)")
+    parser.add_argument("--profile", choices=PROFILE_NAMES, default="throughput", help="Run profile (default: throughput)")
+    parser.add_argument("--cache", action="store_true", help="Keep the SERP cache enabled")
+    parser.add_argument("--scheduler", action="store_true", help="Keep the request scheduler (rate limit) enabled")
+    parser.add_argument("--json", help="Write the report to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Show scraping logs on stderr")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    report = asyncio.run(run_benchmark(args))
+    print(f"ベンチマーク結果（実行プロファイル: {args.profile}）:")
+    print(f"  キーワード: {report['completed']}/{report['keywords']}件（エラー {report['errors']}件）, 読み込んだページ: {report['pages_served']}")
+    print(f"  所要時間: {report['seconds']}秒, {_format(report['keywords_per_second'])} キーワード/秒")
+    print(f"  キーワードあたり: p50 {_format(report['latency_p50_seconds'], '秒')}, p95 {_format(report['latency_p95_seconds'], '秒')}")
+    print(f"  最大メモリ: このプロセス {_format(report['peak_rss_mb'], ' MB')}, 子プロセス {_format(report['peak_child_rss_mb'], ' MB')}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if report["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -81,10 +81,16 @@ def main():
     
     # Step 5: Verify data files are included
     print("\n[5/5] Verifying data files...")
+    # The classification rules are edited in place, so ship them next to the exe
+    rules_src = project_root / "serp_rules.json"
+    if rules_src.exists() and not (exe_dir / "serp_rules.json").exists():
+        shutil.copy2(rules_src, exe_dir / "serp_rules.json")
+        print("   ✓ Copied serp_rules.json")
     required_files = [
         "asins.csv",
         "keywords.csv",
         "spreadsheetIDs.csv",
+        "serp_rules.json",
         "weighty-vertex-464012-u4-7cd9bab1166b.json"
     ]
     
@@ -115,6 +121,7 @@ def main():
         print(f"     - AmazonRankingTool.exe")
         print(f"     - .playwright-browsers/ (folder)")
         print(f"     - *.csv files")
+        print(f"     - serp_rules.json")
         print(f"     - weighty-vertex-464012-u4-7cd9bab1166b.json")
         print(f"     - (Optional) .env file")
         print(f"\n  3. Users can edit the CSV files directly in this folder")
@@ -0,0 +1,359 @@
+"""
+複数のマシンでキーワードを分担して取得する（コーディネーターとワーカー）。
+
+コーディネーター:
+    COORDINATOR_PORT（または scrap.py --coordinator-port）を指定して scraping() を実行すると、
+    ブラウザを起動する代わりに HTTP でジョブを配る。結果は通常の実行と同じイベントとして出力されるので、
+    app.py からの実行ではそのままスプレッドシートに書き込まれる。
+
+        python scrap.py --coordinator-port 8780
+
+ワーカー（各マシンで起動したままにする。ブラウザは起動したまま使い回す）:
+        python distributed.py --coordinator http://192.168.0.10:8780
+        AmazonRankingTool.exe --run-distributed-worker --coordinator http://192.168.0.10:8780（exe の場合）
+
+キーワードはリース（期限付きの割り当て）として配る。ワーカーは処理中にハートビートを送り、
+DISTRIBUTED_LEASE_SECONDS 秒以内にハートビートが届かないリースは回収して他のワーカーに割り当て直す。
+ASIN と TARGET_URL はコーディネーターから受け取るので、ワーカー側に asins.csv は要らない。
+
+HTTP（JSON）:
+    POST /lease      {"worker", "size"}        → {"run_id", "lease", "items", "ttl", "target_url", "asins"}
+                                                  / {"wait": 秒} / {"done": true}
+    POST /heartbeat  {"lease"}                 → {"ok"}
+    POST /result     {"worker", "lease", "index", "keyword", "result"}  → {"ok"}（回収済み・他のワーカーのリースは false）
+    POST /done       {"lease", "worker", "spans"}
+    GET  /status                               → 進捗
+DISTRIBUTED_TOKEN を設定した場合、X-Worker-Token ヘッダーが一致しないリクエストは拒否する。
+"""
+import argparse
+import asyncio
+import json
+import os
+import queue
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from env import read_int
+from events import emit
+from shards import WorkQueue
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_IDLE_TIMEOUT = 600
+DEFAULT_MAX_ATTEMPTS = 3
+WAIT_SECONDS = 2
+RETRY_SECONDS = 5
+TOKEN_HEADER = "X-Worker-Token"
+
+
+def read_coordinator_address(port=None):
+    """(待ち受けホスト, ポート) を返す。ポートの指定が無ければ None（分散実行しない）。"""
+    if port is None:
+        port = os.getenv("COORDINATOR_PORT")
+    try:
+        port = int(port)
+    except (TypeError, ValueError):
+        return None
+    return os.getenv("COORDINATOR_HOST", DEFAULT_HOST), port
+
+
+class DistributedCoordinator:
+    """HTTP でワーカーにリースを配り、結果を on_result(index, keyword, result) に渡す。
+
+    HTTP の処理は別スレッドで行い、結果は run() を実行しているスレッドで on_result に渡す
+    （ジャーナルの SQLite 接続をスレッド間で共有しないため）。
+    """
+
+    def __init__(self, items, on_result, *, host, port, run_id, target_url, target_asins, on_metrics=None):
+        self.ttl = read_int("DISTRIBUTED_LEASE_SECONDS", DEFAULT_LEASE_SECONDS, 5)
+        self.idle_timeout = read_int("DISTRIBUTED_IDLE_TIMEOUT", DEFAULT_IDLE_TIMEOUT, 1)
+        self.work = WorkQueue(items, read_int("DISTRIBUTED_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS, 1))
+        self.on_result = on_result
+        self.on_metrics = on_metrics
+        self.host = host
+        self.port = port
+        self.run_id = run_id
+        self.target_url = target_url
+        self.asins = sorted(target_asins)
+        self.token = os.getenv("DISTRIBUTED_TOKEN") or None
+        self.workers = {}  # worker -> last contact (time.time())
+        self.expired = 0
+        self.last_activity = time.time()
+        self._inbox = queue.Queue()  # ("result", index, keyword, result) / ("metrics", worker, spans)
+        self._lock = threading.Lock()
+
+    def handle(self, path, payload):
+        """1件のリクエストを処理し、応答の dict を返す（HTTP ハンドラーのスレッドから呼ばれる）。"""
+        worker = payload.get("worker")
+        with self._lock:
+            self.last_activity = time.time()
+            if worker:
+                self.workers[worker] = self.last_activity
+        if path == "/lease":
+            if self.work.finished():
+                return {"done": True}
+            lease = self.work.lease(worker, max(1, int(payload.get("size") or 1)), ttl=self.ttl)
+            if lease is None:
+                return {"wait": WAIT_SECONDS}
+            lease_id, items = lease
+            print(f"🌐 {worker} にキーワード {len(items)} 件を割り当てました。", flush=True)
+            return {
+                "run_id": self.run_id,
+                "lease": lease_id,
+                "items": items,
+                "ttl": self.ttl,
+                "target_url": self.target_url,
+                "asins": self.asins,
+            }
+        if path == "/heartbeat":
+            return {"ok": self.work.renew(payload.get("lease"))}
+        if path == "/result":
+            # A lease that expired (or never existed) may already be re-leased to another worker
+            if not self.work.holds(payload.get("lease"), worker, payload["index"]):
+                return {"ok": False}
+            self._inbox.put(("result", payload["index"], payload["keyword"], payload["result"]))
+            return {"ok": True}
+        if path == "/done":
+            self._inbox.put(("done", payload.get("lease"), worker, payload.get("spans") or []))
+            return {"ok": True}
+        return None
+
+    def status(self):
+        with self._lock:
+            workers = dict(self.workers)
+        remaining = self.work.remaining()
+        return {
+            "run_id": self.run_id,
+            "keywords": len(self.work.items),
+            "remaining": len(remaining),
+            "leases": len(self.work.leases),
+            "expired_leases": self.expired,
+            "workers": {worker: round(time.time() - seen, 1) for worker, seen in workers.items()},
+        }
+
+    def _drain_inbox(self):
+        while True:
+            try:
+                message = self._inbox.get_nowait()
+            except queue.Empty:
+                return
+            if message[0] == "result":
+                _, index, keyword, result = message
+                if self.work.complete(index):
+                    self.on_result(index, keyword, result)
+            else:
+                _, lease_id, worker, spans = message
+                # A keyword that failed on the worker has no result yet: it goes back to the queue
+                self._give_up(self.work.finish_lease(lease_id))
+                if self.on_metrics is not None and spans:
+                    self.on_metrics(worker, spans)
+
+    def _give_up(self, items):
+        for index, keyword, _ in items:
+            emit("keyword_error", index=index, keyword=keyword, error="割り当て回数の上限に達したため取得を中止しました")
+
+    async def run(self):
+        server = ThreadingHTTPServer((self.host, self.port), _make_handler(self))
+        # Port 0 picks a free port
+        self.port = server.server_address[1]
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        print(f"🌐 分散実行のコーディネーターを起動しました: http://{self.host}:{self.port}（ワーカーの接続を待っています）", flush=True)
+        try:
+            while not self.work.finished():
+                self._drain_inbox()
+                expired, given_up = self.work.expire_leases()
+                if expired:
+                    self.expired += expired
+                    print(f"⏳ 期限切れのリース {expired} 件を回収し、キーワードを割り当て直します。", flush=True)
+                self._give_up(given_up)
+                with self._lock:
+                    idle = time.time() - self.last_activity
+                if idle > self.idle_timeout:
+                    print(f"⚠️ {self.idle_timeout}秒間ワーカーからの接続がないため、分散実行を終了します。", flush=True)
+                    break
+                await asyncio.sleep(0.2)
+            self._drain_inbox()
+        finally:
+            server.shutdown()
+            server.server_close()
+        for index, keyword, _ in self.work.remaining():
+            self.work.complete(index)
+            emit("keyword_error", index=index, keyword=keyword, error="ワーカーから結果が返りませんでした")
+
+
+def _make_handler(coordinator):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _authorized(self):
+            return coordinator.token is None or self.headers.get(TOKEN_HEADER) == coordinator.token
+
+        def do_GET(self):
+            if not self._authorized():
+                return self._send(403, {"error": "forbidden"})
+            if self.path == "/status":
+                return self._send(200, coordinator.status())
+            return self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if not self._authorized():
+                return self._send(403, {"error": "forbidden"})
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                response = coordinator.handle(self.path, payload)
+            except (ValueError, KeyError) as e:
+                return self._send(400, {"error": str(e)})
+            if response is None:
+                return self._send(404, {"error": "not found"})
+            return self._send(200, response)
+
+    return Handler
+
+
+class CoordinatorClient:
+    """ワーカーからコーディネーターへの HTTP 呼び出し。"""
+
+    def __init__(self, base_url, token=None, timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def post(self, path, payload):
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        if self.token:
+            request.add_header(TOKEN_HEADER, self.token)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+
+async def _heartbeat(client, lease_id, interval):
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(None, client.post, "/heartbeat", {"lease": lease_id})
+        except (OSError, ValueError) as e:
+            print(f"ハートビートの送信に失敗しました: {e}", flush=True)
+
+
+async def run_worker(coordinator_url, concurrency=None, profile=None, worker_id=None, exit_when_done=False, runner=None):
+    """コーディネーターからリースを受け取り続けて処理する。
+
+    exit_when_done が True の場合、実行が終わった（done を受け取った、または一度処理した後に
+    コーディネーターに接続できなくなった）ら終了する。False の場合は次の実行を待ち続ける。
+    runner は BatchRunner と同じ run() / close() / metrics / concurrency / profile を持つもの
+    （省略時は BatchRunner(concurrency, profile)）。
+    """
+    if runner is None:
+        # Lazy import: scrap imports this module for the coordinator side
+        from scrap import BatchRunner
+
+        runner = BatchRunner(concurrency, profile)
+    client = CoordinatorClient(coordinator_url, os.getenv("DISTRIBUTED_TOKEN") or None)
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    loop = asyncio.get_running_loop()
+    size = runner.concurrency * 2
+    worked = False
+    waiting_logged = False
+    print(f"分散ワーカーを起動しました: {worker_id}（コーディネーター: {coordinator_url}, 実行プロファイル: {runner.profile.name}）", flush=True)
+    try:
+        while True:
+            try:
+                lease = await loop.run_in_executor(None, client.post, "/lease", {"worker": worker_id, "size": size})
+            except (OSError, ValueError) as e:
+                if exit_when_done and worked:
+                    break
+                if not waiting_logged:
+                    print(f"コーディネーターに接続できません。{RETRY_SECONDS}秒ごとに再試行します: {e}", flush=True)
+                    waiting_logged = True
+                await asyncio.sleep(RETRY_SECONDS)
+                continue
+            waiting_logged = False
+            if lease.get("done"):
+                if exit_when_done:
+                    break
+                await asyncio.sleep(RETRY_SECONDS)
+                continue
+            if "wait" in lease:
+                await asyncio.sleep(lease["wait"])
+                continue
+
+            worked = True
+            lease_id = lease["lease"]
+            posts = []
+
+            def on_result(index, keyword, result):
+                posts.append(loop.run_in_executor(None, client.post, "/result", {
+                    "worker": worker_id, "lease": lease_id, "index": index, "keyword": keyword, "result": result,
+                }))
+
+            spans_before = len(runner.metrics.spans)
+            heartbeat = asyncio.create_task(_heartbeat(client, lease_id, max(1, lease["ttl"] / 3)))
+            try:
+                await runner.run(
+                    [tuple(item) for item in lease["items"]], on_result,
+                    target_url=lease.get("target_url"),
+                    target_asins=frozenset(lease.get("asins", [])),
+                )
+            except Exception as e:
+                # The unfinished keywords go back to the coordinator's queue via /done
+                print(f"リースの処理中にエラーが発生しました: {e}", flush=True)
+            finally:
+                heartbeat.cancel()
+            for outcome in await asyncio.gather(*posts, return_exceptions=True):
+                if isinstance(outcome, Exception):
+                    print(f"結果の送信に失敗しました: {outcome}", flush=True)
+                elif not outcome.get("ok"):
+                    print("リースが回収済みのため、結果はコーディネーターに受け付けられませんでした。", flush=True)
+            try:
+                await loop.run_in_executor(None, client.post, "/done", {
+                    "worker": worker_id, "lease": lease_id, "spans": runner.metrics.spans[spans_before:],
+                })
+            except (OSError, ValueError) as e:
+                print(f"完了の送信に失敗しました: {e}", flush=True)
+    finally:
+        await runner.close()
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    from run_profiles import PROFILE_NAMES
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Distributed scraping worker")
+    parser.add_argument("--run-distributed-worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--coordinator", default=os.getenv("COORDINATOR_URL"), help="Coordinator URL, e.g. http://192.168.0.10:8780 (default: COORDINATOR_URL)")
+    parser.add_argument("--concurrency", type=int, help="Tabs on this worker (default: CONCURRENCY or the profile's)")
+    parser.add_argument("--profile", choices=PROFILE_NAMES, help="Run profile (default: RUN_PROFILE or interactive)")
+    parser.add_argument("--worker-id", help="Name shown in the coordinator's logs (default: host-pid)")
+    parser.add_argument("--exit-when-done", action="store_true", help="Exit after the current run instead of waiting for the next one")
+    args = parser.parse_args(argv)
+    if not args.coordinator:
+        parser.error("--coordinator (or COORDINATOR_URL) is required")
+    try:
+        asyncio.run(run_worker(args.coordinator, args.concurrency, args.profile, args.worker_id, args.exit_when_done))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
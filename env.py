@@ -0,0 +1,29 @@
+"""
+環境変数（.env）の読み取り。
+
+数値は下限 minimum で切り詰め、数値にならない値は default を使う。
+オン・オフの設定は 0 / false / no / off（大文字小文字は問わない）でオフ、空欄は default として扱う。
+"""
+
+import os
+
+OFF_VALUES = ("0", "false", "no", "off")
+
+
+def read_int(name, default, minimum=0):
+    try:
+        return max(minimum, int(os.getenv(name, default)))
+    except ValueError:
+        return default
+
+
+def read_float(name, default, minimum=0):
+    try:
+        return max(minimum, float(os.getenv(name, default)))
+    except ValueError:
+        return default
+
+
+def read_flag(name, default="1"):
+    value = os.getenv(name, "").strip().lower() or str(default).strip().lower()
+    return value not in OFF_VALUES
@@ -0,0 +1,49 @@
+"""
+scrap.py → app.py の進捗イベントプロトコル（行区切り JSON）。
+
+scrap.py は通常のログ行に混ぜて、1イベント1行で次の形式を出力する:
+    EVENT:{"v": 1, "type": "keyword_result", "ts": 1730000000.0, ...}
+
+イベントの種類:
+    run_started      {"run_id", "keywords": [...], "started_at"}
+    keyword_started  {"index", "keyword", ("marketplace")}
+    keyword_result   {"index", "keyword", "result": {"keyword", "自然検索", "SP", "SB", "marketplace", ...}}
+    keyword_error    {"index", "keyword", "error", ("reason"), ("marketplace")}  reason: captcha / throttled / timeout
+    keyword_retry    {"index", "keyword", "reason", "delay"}  ボットチェック・タイムアウトで取り直す（reason: captcha / throttled / timeout）
+    timing           {"index", "keyword", "seconds"}
+    run_finished     {"run_id", "count", "errors", "seconds"}
+
+TARGET_URL 以外のマーケットプレイスを検索する場合、そのマーケットプレイスの run_started・keyword_result の
+キーワードは「us:キーワード」の形になる（marketplaces.py を参照）。
+
+互換性のない変更を加える場合は PROTOCOL_VERSION を上げること。
+"""
+import json
+import time
+
+PROTOCOL_VERSION = 1
+EVENT_PREFIX = "EVENT:"
+
+
+def format_event(event_type, **fields):
+    """イベントを1行の文字列にする。"""
+    payload = {"v": PROTOCOL_VERSION, "type": event_type, "ts": round(time.time(), 3), **fields}
+    return EVENT_PREFIX + json.dumps(payload, ensure_ascii=False)
+
+
+def emit(event_type, **fields):
+    """イベントを標準出力へ1行で出力する。"""
+    print(format_event(event_type, **fields), flush=True)
+
+
+def parse_event(line):
+    """EVENT: で始まる行ならイベントの dict を、それ以外（通常のログ行など）は None を返す。"""
+    if not line.startswith(EVENT_PREFIX):
+        return None
+    try:
+        event = json.loads(line[len(EVENT_PREFIX):])
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(event, dict) or "type" not in event:
+        return None
+    return event
@@ -0,0 +1,135 @@
+"""
+順位履歴のローカルデータベース（SQLite, WAL モード）。
+実行ごとに キーワード × ASIN × 枠（自然検索/SP/SB）の順位とページを1行ずつ保存する。
+見つからなかった ASIN も順位・ページを NULL にして保存する（順位の下落を推移で追えるように）。
+同じ日に同じキーワードを取得し直した場合は、そのキーワードの行をすべて最後の実行の結果で置き換える。
+(keyword, run_date) のインデックスで推移を引けるほか、スプレッドシート上の
+日付の行番号も記録し、当日の行を探すために Sheets API を読みに行かずに済むようにする。
+
+推移の確認:
+    python history.py "キーワード" [--asin B0XXXXXXXX] [--since 2025-01-01]
+"""
+import argparse
+import os
+import sqlite3
+from pathlib import Path
+from dotenv import load_dotenv
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rank_snapshots (
+    run_date TEXT NOT NULL,
+    keyword TEXT NOT NULL,
+    asin TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    page INTEGER,
+    rank INTEGER,
+    run_id TEXT,
+    PRIMARY KEY (run_date, keyword, asin, slot)
+);
+CREATE INDEX IF NOT EXISTS idx_rank_snapshots_keyword ON rank_snapshots (keyword, run_date);
+CREATE TABLE IF NOT EXISTS sheet_rows (
+    spreadsheet_id TEXT NOT NULL,
+    sheet TEXT NOT NULL,
+    run_date TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    PRIMARY KEY (spreadsheet_id, sheet, run_date)
+);
+"""
+
+
+def history_path(base_dir):
+    """HISTORY_FILE、未設定なら base_dir/rank_history.sqlite3 を返す。"""
+    return os.getenv("HISTORY_FILE") or Path(base_dir) / "rank_history.sqlite3"
+
+
+class RankHistory:
+    """順位のスナップショットとシートの行番号を保存する。接続は作成したスレッドでのみ使うこと。"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def record_run(self, run_id, run_date, results, target_asins=()):
+        """1回の実行の結果（rank_keyword の戻り値のリスト）を1トランザクションで保存する。
+
+        target_asins のうち枠で見つからなかった ASIN は、順位・ページが NULL の行になる。
+        """
+        rows = []
+        keywords = []
+        for result in results:
+            if not result:
+                continue
+            keywords.append((run_date, result["keyword"]))
+            for slot, asin_ranks in (result.get("ranks") or {}).items():
+                for asin in sorted(set(asin_ranks) | set(target_asins)):
+                    position = asin_ranks.get(asin) or {}
+                    rows.append((run_date, result["keyword"], asin, slot, position.get("page"), position.get("rank"), run_id))
+        with self.conn:
+            # An earlier run of the same day must not leave a rank the latest run no longer found
+            self.conn.executemany("DELETE FROM rank_snapshots WHERE run_date = ? AND keyword = ?", keywords)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO rank_snapshots (run_date, keyword, asin, slot, page, rank, run_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    def trend(self, keyword, asin=None, since=None):
+        """キーワードの順位推移を日付順に [(run_date, asin, slot, page, rank), ...] で返す。"""
+        query = "SELECT run_date, asin, slot, page, rank FROM rank_snapshots WHERE keyword = ?"
+        params = [keyword]
+        if asin:
+            query += " AND asin = ?"
+            params.append(asin)
+        if since:
+            query += " AND run_date >= ?"
+            params.append(since)
+        query += " ORDER BY run_date, slot, asin"
+        return self.conn.execute(query, params).fetchall()
+
+    def sheet_row(self, spreadsheet_id, sheet, run_date):
+        """記録済みのシート上の行番号（1始まり）を返す。未記録なら None。"""
+        row = self.conn.execute(
+            "SELECT row FROM sheet_rows WHERE spreadsheet_id = ? AND sheet = ? AND run_date = ?",
+            (spreadsheet_id, sheet, run_date),
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_sheet_row(self, spreadsheet_id, sheet, run_date, row):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sheet_rows (spreadsheet_id, sheet, run_date, row) VALUES (?, ?, ?, ?)",
+                (spreadsheet_id, sheet, run_date, row),
+            )
+
+    def forget_sheet(self, spreadsheet_id, sheet):
+        """シートをクリアしたときに、そのシートの行番号の記録を消す。"""
+        with self.conn:
+            self.conn.execute("DELETE FROM sheet_rows WHERE spreadsheet_id = ? AND sheet = ?", (spreadsheet_id, sheet))
+
+    def close(self):
+        self.conn.close()
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Show the rank history of a keyword")
+    parser.add_argument("keyword")
+    parser.add_argument("--asin")
+    parser.add_argument("--since", help="YYYY-MM-DD")
+    parser.add_argument("--file", help="History database (default: HISTORY_FILE or ./rank_history.sqlite3)")
+    args = parser.parse_args(argv)
+    history = RankHistory(args.file or history_path(Path(__file__).resolve().parent))
+    try:
+        for run_date, asin, slot, page, rank in history.trend(args.keyword, args.asin, args.since):
+            print(f"{run_date}\t{asin}\t{slot}\t{page if page is not None else '-'}\t{rank if rank is not None else '-'}")
+    finally:
+        history.close()
+
+
+if __name__ == "__main__":
+    main()
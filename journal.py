@@ -0,0 +1,71 @@
+"""
+スクレイピング結果のチェックポイント記録（SQLite, WAL モード）。
+キーワードの結果が出るたびに追記・コミットするため、Chromium やネットワークが
+途中で落ちても、それまでの結果は失われない。--resume で当日取得済みの
+キーワードを飛ばして再開できる。
+"""
+import json
+import sqlite3
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    run_date TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT
+);
+CREATE TABLE IF NOT EXISTS keyword_results (
+    run_id TEXT NOT NULL,
+    run_date TEXT NOT NULL,
+    keyword TEXT NOT NULL,
+    result_json TEXT NOT NULL,
+    recorded_at TEXT NOT NULL,
+    PRIMARY KEY (run_id, keyword)
+);
+CREATE INDEX IF NOT EXISTS idx_keyword_results_date ON keyword_results (run_date, keyword);
+"""
+
+
+class RunJournal:
+    """実行（run_id）と日付ごとに、キーワードの結果を追記するジャーナル。"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.conn = sqlite3.connect(self.path)
+        # WAL: each commit is durable without rewriting the whole database file
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def start_run(self, run_id, run_date, started_at):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO runs (run_id, run_date, started_at) VALUES (?, ?, ?)",
+                (run_id, run_date, started_at),
+            )
+
+    def record(self, run_id, run_date, keyword, result):
+        """1キーワードの結果を記録し、すぐにコミットする。"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO keyword_results (run_id, run_date, keyword, result_json, recorded_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (run_id, run_date, keyword, json.dumps(result, ensure_ascii=False), datetime.now().isoformat()),
+            )
+
+    def finish_run(self, run_id, finished_at):
+        with self.conn:
+            self.conn.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (finished_at, run_id))
+
+    def completed_on(self, run_date):
+        """指定日に記録済みのキーワードと結果を返す（同じキーワードは最新の記録を優先）。"""
+        rows = self.conn.execute(
+            "SELECT keyword, result_json FROM keyword_results WHERE run_date = ? ORDER BY recorded_at",
+            (run_date,),
+        )
+        return {keyword: json.loads(result_json) for keyword, result_json in rows}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,132 @@
+"""
+マーケットプレイスのプロファイル（トップページの URL・検索ボックスとページ送りリンクの表記・言語）。
+
+MARKETPLACES（または --marketplaces）にカンマ区切りで名前を指定すると、1回の実行で
+複数のマーケットプレイスを同じキーワードで検索する（例: MARKETPLACES=jp,us）。
+同じ Chromium の中でマーケットプレイスごとに別のブラウザコンテキスト（Cookie・言語が別）を使い、並行して処理する。
+
+- 省略時は TARGET_URL のマーケットプレイスだけを検索する（従来の動作）
+- TARGET_URL のマーケットプレイスの結果は従来どおりキーワードそのままで記録し、それ以外の結果は
+  キーワードを「us:キーワード」の形にして記録する（ジャーナル・順位履歴・スプレッドシートで区別するため）。
+  結果には "marketplace" にマーケットプレイス名が入る
+- キーワードファイルの3列目にマーケットプレイス名（空白区切り、例: "jp us"）を書くと、そのキーワードは
+  指定したマーケットプレイスだけで検索する（省略時はすべて）
+- スポンサーの目印や SB の除外見出しはホスト名ごとに serp_rules.json の marketplaces で上書きする
+"""
+import os
+from urllib.parse import urlsplit
+
+
+class MarketplaceProfile:
+    """1つのマーケットプレイスの URL と、画面の表記に依存するセレクター。"""
+
+    def __init__(self, name, base_url, search_placeholder, page_label, locale):
+        self.name = name
+        self.base_url = base_url
+        self.search_placeholder = search_placeholder
+        self.page_label = page_label  # aria-label of a pagination link, "{page}" is the page number
+        self.locale = locale
+
+    @property
+    def host(self):
+        """キャッシュと分類ルールのキーに使うホスト名。"""
+        return (urlsplit(self.base_url).hostname or "").lower()
+
+    def with_url(self, base_url):
+        """トップページの URL だけを差し替えたプロファイルを返す（TARGET_URL のクエリを引き継ぐため）。"""
+        return MarketplaceProfile(self.name, base_url, self.search_placeholder, self.page_label, self.locale)
+
+    def search_input_selector(self):
+        return f'input[placeholder="{self.search_placeholder}"]'
+
+    def page_link_selector(self, page_index):
+        return f'a[aria-label="{self.page_label.format(page=page_index)}"]'
+
+    def context_options(self):
+        """browser.new_context() に追加する引数。"""
+        return {"locale": self.locale}
+
+
+MARKETPLACE_PROFILES = {
+    "jp": MarketplaceProfile("jp", "https://www.amazon.co.jp/", "Amazon.co.jpを検索", "{page}ページに移動", "ja-JP"),
+    "us": MarketplaceProfile("us", "https://www.amazon.com/", "Search Amazon", "Go to page {page}", "en-US"),
+    "uk": MarketplaceProfile("uk", "https://www.amazon.co.uk/", "Search Amazon.co.uk", "Go to page {page}", "en-GB"),
+    "de": MarketplaceProfile("de", "https://www.amazon.de/", "Suche Amazon.de", "Gehe zu Seite {page}", "de-DE"),
+}
+MARKETPLACE_NAMES = tuple(MARKETPLACE_PROFILES)
+DEFAULT_MARKETPLACE = "jp"
+
+
+def marketplace_for_url(target_url):
+    """URL のホストに対応するプロファイルを返す（URL はその値を使う）。
+
+    未登録のホストの場合は、そのホスト名を名前にして日本の表記を使う。
+    """
+    host = (urlsplit(target_url or "").hostname or "").lower()
+    for profile in MARKETPLACE_PROFILES.values():
+        if profile.host == host:
+            return profile.with_url(target_url)
+    base = MARKETPLACE_PROFILES[DEFAULT_MARKETPLACE]
+    return MarketplaceProfile(host or base.name, target_url or base.base_url, base.search_placeholder, base.page_label, base.locale)
+
+
+def get_marketplaces(names=None, target_url=None):
+    """検索するマーケットプレイスのリストを返す（省略時は MARKETPLACES、それもなければ TARGET_URL のもの）。
+
+    TARGET_URL と同じホストのマーケットプレイスは TARGET_URL（language などのクエリ付き）を使う。
+    """
+    if names is None:
+        names = os.getenv("MARKETPLACES", "")
+    if isinstance(names, str):
+        names = [name.strip().lower() for name in names.split(",") if name.strip()]
+    target = marketplace_for_url(target_url) if target_url else None
+    profiles = []
+    for name in names:
+        profile = MARKETPLACE_PROFILES.get(name)
+        if profile is None and target is not None and name == target.name:
+            # An unregistered TARGET_URL host is named after the host itself
+            profile = target
+        if profile is None:
+            print(f"不明なマーケットプレイスです: {name}（選択肢: {', '.join(MARKETPLACE_NAMES)}）")
+            continue
+        if target is not None and target.host == profile.host:
+            profile = target
+        if profile.name not in {existing.name for existing in profiles}:
+            profiles.append(profile)
+    if not profiles:
+        profiles = [target or MARKETPLACE_PROFILES[DEFAULT_MARKETPLACE]]
+    return profiles
+
+
+def primary_marketplace(target_url):
+    """TARGET_URL（省略時は jp）のマーケットプレイス。結果をキーワードそのままで記録する。"""
+    return marketplace_for_url(target_url or MARKETPLACE_PROFILES[DEFAULT_MARKETPLACE].base_url)
+
+
+def is_primary(profile, target_url):
+    """TARGET_URL（省略時は jp）と同じマーケットプレイスなら True（結果をキーワードそのままで記録する）。"""
+    return profile.host == primary_marketplace(target_url).host
+
+
+def tagged_keyword(keyword, profile, primary=True):
+    """結果の記録に使うキーワード（TARGET_URL のマーケットプレイスはそのまま、それ以外は「名前:キーワード」）。"""
+    return keyword if primary else f"{profile.name}:{keyword}"
+
+
+def split_tagged_keyword(keyword):
+    """「us:キーワード」を (マーケットプレイス名, キーワード) に分ける。名前が付いていなければ (None, keyword)。
+
+    tagged_keyword() が作る形（小文字の既知のマーケットプレイス名）だけを区切りとみなす
+    （「:」を含む普通のキーワードはそのまま）。
+    """
+    name, sep, rest = keyword.partition(":")
+    if sep and name in MARKETPLACE_PROFILES and rest and rest == rest.strip():
+        return name, rest
+    return None, keyword
+
+
+def tag_result(result, profile, primary=True):
+    """結果にマーケットプレイス名を付け、キーワードを記録用の形にする（result をそのまま更新して返す）。"""
+    result["marketplace"] = profile.name
+    result["keyword"] = tagged_keyword(result["keyword"], profile, primary)
+    return result
@@ -0,0 +1,162 @@
+"""
+処理時間の計測（スパン）と、実行ごとのメトリクスの書き出し。
+
+スパンは キーワード・ページごとの処理（navigation / readiness / extraction / classification など）や
+Sheets API の読み書きの1回分で、所要時間と件数（スキャンした要素数・転送バイト数など）を持つ。
+実行の終わりに METRICS_DIR へ JSON（<名前>_<run_id>.json）を書き出し、
+METRICS_PROMETHEUS=1 の場合は Prometheus のテキスト形式（<名前>.prom、最新の実行で上書き）も書き出す。
+"""
+import json
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from env import read_flag
+
+
+def percentile(values, pct):
+    """最近傍順位法によるパーセンタイル。values が空なら None。"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def _prometheus_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _prometheus_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """スパンと実行全体の値（info）を集める。複数スレッドから記録してよい。"""
+
+    def __init__(self, name, run_id, **info):
+        self.name = name
+        self.run_id = run_id
+        self.info = dict(info)
+        self.spans = []  # [{"name", "seconds", "labels": {...}, "counts": {...}}, ...]
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **labels):
+        """with ブロックの所要時間を記録する。yield した dict に件数を足せる。"""
+        counts = {}
+        started = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.record(name, time.perf_counter() - started, labels, counts)
+
+    def record(self, name, seconds, labels=None, counts=None):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "seconds": round(seconds, 6),
+                "labels": labels or {},
+                "counts": counts or {},
+            })
+
+    def set_info(self, **info):
+        with self._lock:
+            self.info.update(info)
+
+    def aggregate(self):
+        """スパン名ごとに 件数・合計・p50・p95・最大 と counts の合計をまとめる。"""
+        with self._lock:
+            spans = list(self.spans)
+        grouped = {}
+        for span in spans:
+            grouped.setdefault(span["name"], []).append(span)
+        summary = {}
+        for name, items in grouped.items():
+            durations = sorted(item["seconds"] for item in items)
+            counts = {}
+            for item in items:
+                for key, value in item["counts"].items():
+                    counts[key] = counts.get(key, 0) + value
+            summary[name] = {
+                "count": len(items),
+                "total_seconds": round(sum(durations), 6),
+                "p50_seconds": percentile(durations, 50),
+                "p95_seconds": percentile(durations, 95),
+                "max_seconds": durations[-1],
+                "counts": counts,
+            }
+        return summary
+
+    def summary_lines(self):
+        lines = []
+        for name, item in sorted(self.aggregate().items(), key=lambda entry: -entry[1]["total_seconds"]):
+            counts = ", ".join(f"{key}: {value}" for key, value in sorted(item["counts"].items()))
+            lines.append(
+                f"  {name}: {item['count']}回, 合計 {item['total_seconds']:.2f}秒, "
+                f"p50 {item['p50_seconds']:.3f}秒, p95 {item['p95_seconds']:.3f}秒"
+                + (f" ({counts})" if counts else "")
+            )
+        return lines
+
+    def to_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+            info = dict(self.info)
+        return {
+            "name": self.name,
+            "run_id": self.run_id,
+            "started_at": self.started,
+            "finished_at": time.time(),
+            "info": info,
+            "summary": self.aggregate(),
+            "spans": spans,
+        }
+
+    def to_prometheus(self):
+        """集計値を Prometheus のテキスト形式にする（スパンごとの値は含めない）。"""
+        prefix = f"amazon_ranking_{_prometheus_name(self.name)}"
+        run_label = f'run_id="{_prometheus_label(self.run_id)}"'
+        lines = []
+        info_labels = ",".join(
+            [run_label] + [f'{_prometheus_name(key)}="{_prometheus_label(value)}"' for key, value in sorted(self.info.items())]
+        )
+        lines.append(f"# TYPE {prefix}_run_info gauge")
+        lines.append(f"{prefix}_run_info{{{info_labels}}} 1")
+        summary = self.aggregate()
+        for metric, key in (("span_count", "count"), ("span_seconds_total", "total_seconds"),
+                            ("span_seconds_p50", "p50_seconds"), ("span_seconds_p95", "p95_seconds"),
+                            ("span_seconds_max", "max_seconds")):
+            lines.append(f"# TYPE {prefix}_{metric} gauge")
+            for name, item in sorted(summary.items()):
+                lines.append(f'{prefix}_{metric}{{{run_label},span="{_prometheus_label(name)}"}} {item[key]}')
+        counted = sorted({(name, key) for name, item in summary.items() for key in item["counts"]})
+        if counted:
+            lines.append(f"# TYPE {prefix}_span_items_total gauge")
+            for name, key in counted:
+                lines.append(
+                    f'{prefix}_span_items_total{{{run_label},span="{_prometheus_label(name)}",'
+                    f'item="{_prometheus_label(key)}"}} {summary[name]["counts"][key]}'
+                )
+        return "\n".join(lines) + "\n"
+
+    def write(self, base_dir):
+        """METRICS_DIR（省略時は base_dir/metrics）に書き出し、JSON のパスを返す。METRICS=0 の場合は何もしない。"""
+        if not read_flag("METRICS"):
+            return None
+        directory = Path(os.getenv("METRICS_DIR") or Path(base_dir) / "metrics")
+        directory.mkdir(parents=True, exist_ok=True)
+        json_path = directory / f"{self.name}_{self.run_id}.json"
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        if read_flag("METRICS_PROMETHEUS", "0"):
+            prom_path = directory / f"{self.name}.prom"
+            # Write then rename so a textfile collector never reads a partial file
+            tmp_path = prom_path.with_suffix(".prom.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp_path, prom_path)
+        return json_path
@@ -0,0 +1,127 @@
+import time
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from env import read_int
+
+# Signals that tell us a search result page is usable
+RESULTS_SELECTOR = '[role="listitem"][data-asin]'
+PAGINATION_SELECTOR = '.s-pagination-strip'
+
+# The old fixed waits per result page (sleep(5) + sleep(3)), used for the saved-time summary
+FIXED_WAIT_SECONDS = 8.0
+
+
+class PageTimeoutError(Exception):
+    """検索結果ページの読み込みがタイムアウトした（検索結果が無いことも、ボットチェックも確認できない）。"""
+
+    def __init__(self, page_index, url=None):
+        super().__init__(f"{page_index}ページ目の読み込みがタイムアウトしました")
+        self.page_index = page_index
+        self.url = url
+
+
+class WaitTimings:
+    """待機ステップごとの実測時間を記録する。"""
+
+    def __init__(self):
+        self.samples = {}  # {"results": [seconds, ...], ...}
+        self.timeouts = {}  # {"results": count, ...}
+        self.pages = 0
+
+    def record(self, step, seconds, timed_out=False):
+        self.samples.setdefault(step, []).append(seconds)
+        if timed_out:
+            self.timeouts[step] = self.timeouts.get(step, 0) + 1
+
+    def total_seconds(self):
+        return sum(sum(values) for values in self.samples.values())
+
+    def summary_lines(self):
+        lines = []
+        for step, values in self.samples.items():
+            average = sum(values) / len(values)
+            lines.append(
+                f"  {step}: {len(values)}回, 平均 {average:.2f}秒, 最大 {max(values):.2f}秒, "
+                f"タイムアウト {self.timeouts.get(step, 0)}回"
+            )
+        if self.pages:
+            saved = FIXED_WAIT_SECONDS * self.pages - self.total_seconds()
+            lines.append(f"  固定待機({FIXED_WAIT_SECONDS:.0f}秒/ページ)と比べた短縮時間: {saved:.1f}秒 ({self.pages}ページ)")
+        return lines
+
+
+class PageReadiness:
+    """ページ遷移と検索結果の表示完了を、固定 sleep ではなく実際のシグナルで待つ。
+
+    wait_strategy が "full" の場合は商品グリッド・ページネーション・ネットワークアイドルを、
+    "results" の場合は商品グリッド（とページ送りに必要なときだけページネーション）を待つ。
+    """
+
+    def __init__(self, timings=None, wait_strategy="full"):
+        self.timings = timings or WaitTimings()
+        self.wait_strategy = wait_strategy
+        # Per-step timeouts; network idle often never happens on Amazon, so it gets a short one
+        self.navigation_timeout_ms = read_int("NAVIGATION_TIMEOUT_MS", 15000)
+        self.selector_timeout_ms = read_int("READY_TIMEOUT_MS", 10000)
+        self.network_idle_timeout_ms = read_int("NETWORK_IDLE_TIMEOUT_MS", 3000)
+
+    async def _timed(self, step, awaitable):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            await awaitable
+        except PlaywrightTimeoutError:
+            timed_out = True
+        self.timings.record(step, time.perf_counter() - started, timed_out)
+        return not timed_out
+
+    async def navigate(self, page, action):
+        """action（Enter 押下やリンククリック）を実行し、ナビゲーション完了を待つ。"""
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            async with page.expect_navigation(wait_until="domcontentloaded", timeout=self.navigation_timeout_ms):
+                await action()
+        except PlaywrightTimeoutError:
+            timed_out = True
+        self.timings.record("navigation", time.perf_counter() - started, timed_out)
+
+    async def goto(self, page, url):
+        """URL を直接開き、レスポンス（タイムアウト時は None）を返す。"""
+        started = time.perf_counter()
+        response = None
+        timed_out = False
+        try:
+            response = await page.goto(url, wait_until="domcontentloaded", timeout=self.navigation_timeout_ms)
+        except PlaywrightTimeoutError:
+            timed_out = True
+        self.timings.record("navigation", time.perf_counter() - started, timed_out)
+        return response
+
+    async def wait_for_results(self, page, needs_pagination=True):
+        """商品グリッド・ページネーション・ネットワークアイドルを順に待つ。
+
+        needs_pagination は次のページへのリンクをクリックする場合に True にする。
+        """
+        self.timings.pages += 1
+        has_results = await self._timed(
+            "results",
+            page.wait_for_selector(RESULTS_SELECTOR, state="attached", timeout=self.selector_timeout_ms),
+        )
+        if self.wait_strategy == "results":
+            if has_results and needs_pagination:
+                await self._timed(
+                    "pagination",
+                    page.wait_for_selector(PAGINATION_SELECTOR, state="attached", timeout=self.selector_timeout_ms),
+                )
+            return has_results
+        if has_results:
+            # Pagination renders late; it is needed for the next page link
+            await self._timed(
+                "pagination",
+                page.wait_for_selector(PAGINATION_SELECTOR, state="attached", timeout=self.selector_timeout_ms),
+            )
+        await self._timed(
+            "networkidle",
+            page.wait_for_load_state("networkidle", timeout=self.network_idle_timeout_ms),
+        )
+        return has_results
@@ -0,0 +1,110 @@
+import os
+from urllib.parse import urlsplit
+from env import read_flag
+
+# Resource types the ranking logic never needs
+DEFAULT_BLOCKED_TYPES = ["image", "font", "media"]
+
+# Ad, analytics and beacon hosts requested by every result page
+DEFAULT_BLOCKED_DOMAINS = [
+    "amazon-adsystem.com",
+    "doubleclick.net",
+    "google-analytics.com",
+    "googletagmanager.com",
+    "fls-fe.amazon.co.jp",
+    "unagi.amazon.co.jp",
+]
+
+# Blocked requests never reach the network, so their size is unknown.
+# The saved bytes are estimated from typical sizes per resource type.
+ESTIMATED_BYTES_BY_TYPE = {
+    "image": 20 * 1024,
+    "font": 40 * 1024,
+    "media": 300 * 1024,
+    "stylesheet": 30 * 1024,
+    "script": 30 * 1024,
+}
+ESTIMATED_BYTES_DEFAULT = 2 * 1024
+
+
+def _read_list(name, default):
+    value = os.getenv(name)
+    if value is None:
+        return list(default)
+    return [item.strip().lower() for item in value.split(",") if item.strip()]
+
+
+def _host_matches(host, domains):
+    return any(host == domain or host.endswith("." + domain) for domain in domains)
+
+
+class ResourceBlocker:
+    """Playwright のルーティングで不要なリソースを遮断し、遮断数と通信量を集計する。
+
+    判定順: ALLOW_DOMAINS に一致 → 許可、BLOCK_DOMAINS に一致 → 遮断、
+    BLOCK_RESOURCE_TYPES に一致 → 遮断、それ以外 → 許可。
+    """
+
+    def __init__(self, blocked_types=None, blocked_domains=None, allowed_domains=None):
+        self.blocked_types = set(blocked_types if blocked_types is not None else DEFAULT_BLOCKED_TYPES)
+        self.blocked_domains = list(blocked_domains if blocked_domains is not None else DEFAULT_BLOCKED_DOMAINS)
+        self.allowed_domains = list(allowed_domains or [])
+        self.reset_counters()
+
+    def reset_counters(self):
+        """実行ごとの集計をリセットする（常駐ブラウザで複数回実行する場合）。"""
+        self.blocked_requests = {}  # {"image": count, ...}
+        self.estimated_saved_bytes = 0
+        self.allowed_requests = 0
+        self.received_bytes = 0
+
+    @classmethod
+    def from_env(cls):
+        """環境変数から遮断ルールを読み込む。BLOCK_RESOURCES=0 の場合は None を返す。"""
+        if not read_flag("BLOCK_RESOURCES"):
+            return None
+        return cls(
+            blocked_types=_read_list("BLOCK_RESOURCE_TYPES", DEFAULT_BLOCKED_TYPES),
+            blocked_domains=_read_list("BLOCK_DOMAINS", DEFAULT_BLOCKED_DOMAINS),
+            allowed_domains=_read_list("ALLOW_DOMAINS", []),
+        )
+
+    def should_block(self, url, resource_type):
+        host = (urlsplit(url).hostname or "").lower()
+        if _host_matches(host, self.allowed_domains):
+            return False
+        if _host_matches(host, self.blocked_domains):
+            return True
+        return resource_type in self.blocked_types
+
+    async def install(self, context):
+        """ブラウザコンテキストにルーティングとレスポンス集計を登録する。"""
+        await context.route("**/*", self._handle_route)
+        context.on("response", self._on_response)
+
+    async def _handle_route(self, route):
+        request = route.request
+        resource_type = request.resource_type
+        if self.should_block(request.url, resource_type):
+            self.blocked_requests[resource_type] = self.blocked_requests.get(resource_type, 0) + 1
+            self.estimated_saved_bytes += ESTIMATED_BYTES_BY_TYPE.get(resource_type, ESTIMATED_BYTES_DEFAULT)
+            await route.abort()
+        else:
+            await route.continue_()
+
+    def _on_response(self, response):
+        self.allowed_requests += 1
+        try:
+            self.received_bytes += int(response.headers.get("content-length", 0))
+        except ValueError:
+            pass
+
+    def summary_lines(self):
+        blocked_total = sum(self.blocked_requests.values())
+        by_type = ", ".join(f"{resource_type}: {count}" for resource_type, count in sorted(self.blocked_requests.items()))
+        lines = [
+            f"  遮断したリクエスト: {blocked_total}件" + (f" ({by_type})" if by_type else ""),
+            f"  削減できた通信量（推定）: {self.estimated_saved_bytes / 1024 / 1024:.1f} MB",
+            f"  許可したリクエスト: {self.allowed_requests}件, 受信量: {self.received_bytes / 1024 / 1024:.1f} MB",
+        ]
+        return lines
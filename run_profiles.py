@@ -0,0 +1,73 @@
+"""
+実行プロファイル（ブラウザの表示・操作の遅延・画面サイズ・待機方法・同時実行数の組み合わせ）。
+
+- interactive: ウィンドウを表示し、操作を 200ms ずつ遅らせる（従来の動作。画面で確認しながら実行する場合）
+- throughput: ヘッドレスで遅延なし。待機は商品グリッドの表示までで、ネットワークアイドルは待たない
+  （無人の定期実行向け）
+
+RUN_PROFILE または --profile で選ぶ（省略時は interactive）。同時実行数は
+--concurrency / CONCURRENCY の指定があればそちらが優先される。
+"""
+import os
+
+DEFAULT_PROFILE = "interactive"
+
+# full: results grid, pagination and network idle / results: results grid (pagination only when clicking)
+WAIT_STRATEGIES = ("full", "results")
+
+
+class RunProfile:
+    """1回の実行のブラウザ設定と待機方法。"""
+
+    def __init__(self, name, headless, slow_mo, viewport, wait_strategy, concurrency):
+        self.name = name
+        self.headless = headless
+        self.slow_mo = slow_mo
+        self.viewport = viewport  # (width, height)
+        self.wait_strategy = wait_strategy
+        self.concurrency = concurrency
+
+    def launch_options(self):
+        """chromium.launch() に渡す引数。"""
+        return {"headless": self.headless, "slow_mo": self.slow_mo}
+
+    def context_options(self):
+        """browser.new_context() に渡す引数。"""
+        width, height = self.viewport
+        return {"viewport": {"width": width, "height": height}}
+
+    def browser_key(self):
+        """起動済みのブラウザをそのまま使えるかの判定用（待機方法・同時実行数は含まない）。"""
+        return (self.headless, self.slow_mo, self.viewport)
+
+    def to_info(self):
+        """メトリクスに記録する値。"""
+        width, height = self.viewport
+        return {
+            "profile": self.name,
+            "headless": self.headless,
+            "slow_mo_ms": self.slow_mo,
+            "viewport": f"{width}x{height}",
+            "wait_strategy": self.wait_strategy,
+        }
+
+
+PROFILES = {
+    "interactive": RunProfile("interactive", headless=False, slow_mo=200, viewport=(1600, 1000),
+                              wait_strategy="full", concurrency=1),
+    "throughput": RunProfile("throughput", headless=True, slow_mo=0, viewport=(1280, 800),
+                             wait_strategy="results", concurrency=4),
+}
+PROFILE_NAMES = tuple(PROFILES)
+
+
+def get_profile(name=None):
+    """名前（省略時は RUN_PROFILE）のプロファイルを返す。不明な名前の場合は interactive を使う。"""
+    if isinstance(name, RunProfile):
+        return name
+    name = (name or os.getenv("RUN_PROFILE") or DEFAULT_PROFILE).strip().lower()
+    profile = PROFILES.get(name)
+    if profile is None:
+        print(f"不明な実行プロファイルです: {name}（{DEFAULT_PROFILE} を使用します。選択肢: {', '.join(PROFILE_NAMES)}）")
+        profile = PROFILES[DEFAULT_PROFILE]
+    return profile
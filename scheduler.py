@@ -0,0 +1,184 @@
+"""
+リクエストのペース配分（ホストごとのトークンバケット）と、ボットチェック検出時のバックオフ。
+
+- 検索結果ページの読み込みはホストごとのトークンバケットを通す（SCHEDULER_RATE ページ/秒、
+  SCHEDULER_BURST ページまでまとめて送れる）
+- ボットチェック（CAPTCHA）・503/429 のページは「ブロック」として扱い、
+  そのホストへのリクエストを指数バックオフで止め、そのキーワードだけを取得し直す
+  （SCHEDULER_MAX_RETRIES 回まで）
+- ブロックされるたびに同時に処理するキーワード数とレートを半分にし、
+  SCHEDULER_RECOVER_PAGES ページ続けて正常に読み込めたら1つずつ・少しずつ戻す（AIMD）
+"""
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+from env import read_flag, read_float, read_int
+
+DEFAULT_RATE = 2.0
+DEFAULT_MIN_RATE = 0.2
+DEFAULT_MAX_RATE = 5.0
+DEFAULT_BURST = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RECOVER_PAGES = 20
+BACKOFF_BASE_SECONDS = 30.0
+BACKOFF_MAX_SECONDS = 600.0
+
+# Outcomes that count as a block
+BLOCK_KINDS = {
+    "captcha": "ボットチェック",
+    "throttled": "アクセス制限（503/429）",
+}
+
+
+class BlockedPageError(Exception):
+    """ボットチェック・アクセス制限のページを読み込んだ。"""
+
+    def __init__(self, kind, url=None):
+        super().__init__(f"{BLOCK_KINDS.get(kind, kind)}のページが返されました")
+        self.kind = kind
+        self.url = url
+
+
+def _host(url):
+    return (urlsplit(url or "").hostname or "").lower()
+
+
+class TokenBucket:
+    """rate 個/秒で補充され、最大 burst 個まで貯まるトークン。"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RequestScheduler:
+    """ホストごとのレートと、同時に処理するキーワード数を結果に応じて調整する。"""
+
+    def __init__(self, concurrency, rate=DEFAULT_RATE, burst=DEFAULT_BURST, min_rate=DEFAULT_MIN_RATE,
+                 max_rate=DEFAULT_MAX_RATE, max_retries=DEFAULT_MAX_RETRIES, recover_pages=DEFAULT_RECOVER_PAGES):
+        self.max_concurrency = max(1, concurrency)
+        self.limit = self.max_concurrency
+        self.initial_rate = rate
+        self.burst = burst
+        self.min_rate = min(min_rate, rate)
+        self.max_rate = max(max_rate, rate)
+        self.max_retries = max_retries
+        self.recover_pages = recover_pages
+        self.buckets = {}  # host -> TokenBucket
+        self.paused_until = {}  # host -> time.monotonic()
+        self.failures = {}  # host -> consecutive blocks
+        self.clean_pages = 0
+        self.active = 0
+        self.blocks = {}  # kind -> count
+        self.retries = 0
+        self.backoff_seconds = 0.0
+        self.lowest_limit = self.limit
+        self._condition = asyncio.Condition()
+
+    @classmethod
+    def from_env(cls, concurrency):
+        """環境変数から設定を読み込む。SCHEDULER=0 の場合は None を返す。"""
+        if not read_flag("SCHEDULER"):
+            return None
+        return cls(
+            concurrency,
+            rate=read_float("SCHEDULER_RATE", DEFAULT_RATE, 0.01),
+            burst=read_int("SCHEDULER_BURST", DEFAULT_BURST, 1),
+            min_rate=read_float("SCHEDULER_MIN_RATE", DEFAULT_MIN_RATE, 0.01),
+            max_rate=read_float("SCHEDULER_MAX_RATE", DEFAULT_MAX_RATE, 0.01),
+            max_retries=read_int("SCHEDULER_MAX_RETRIES", DEFAULT_MAX_RETRIES, 0),
+            recover_pages=read_int("SCHEDULER_RECOVER_PAGES", DEFAULT_RECOVER_PAGES, 1),
+        )
+
+    def _bucket(self, host):
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = TokenBucket(self.initial_rate, self.burst)
+            self.buckets[host] = bucket
+        return bucket
+
+    @asynccontextmanager
+    async def slot(self):
+        """同時に処理するキーワード数を現在の上限以内に抑える。"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.active -= 1
+                self._condition.notify_all()
+
+    async def before_request(self, url):
+        """ページを読み込む前に、バックオフ中なら待ち、トークンを1つ使う。"""
+        host = _host(url)
+        while True:
+            wait = self.paused_until.get(host, 0) - time.monotonic()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        await self._bucket(host).acquire()
+
+    def report_clean(self, url):
+        """正常なページを読み込んだ。続けば同時実行数とレートを少しずつ戻す。"""
+        host = _host(url)
+        self.failures[host] = 0
+        self.clean_pages += 1
+        if self.clean_pages < self.recover_pages:
+            return
+        self.clean_pages = 0
+        if self.limit < self.max_concurrency:
+            self.limit += 1
+        bucket = self._bucket(host)
+        bucket.rate = min(self.max_rate, bucket.rate + self.initial_rate * 0.25)
+
+    def report_block(self, url, kind):
+        """ブロックされた。そのホストを指数バックオフで止め、同時実行数とレートを半分にする。待ち時間（秒）を返す。"""
+        host = _host(url)
+        self.blocks[kind] = self.blocks.get(kind, 0) + 1
+        failures = self.failures.get(host, 0) + 1
+        self.failures[host] = failures
+        delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (failures - 1)) * random.uniform(1.0, 1.25)
+        self.paused_until[host] = max(self.paused_until.get(host, 0), time.monotonic() + delay)
+        self.backoff_seconds += delay
+        self.clean_pages = 0
+        self.limit = max(1, self.limit // 2)
+        self.lowest_limit = min(self.lowest_limit, self.limit)
+        bucket = self._bucket(host)
+        bucket.rate = max(self.min_rate, bucket.rate / 2)
+        return delay
+
+    def summary_lines(self):
+        rates = ", ".join(f"{host}: {bucket.rate:.2f}ページ/秒" for host, bucket in sorted(self.buckets.items()))
+        blocks = ", ".join(f"{BLOCK_KINDS.get(kind, kind)} {count}回" for kind, count in sorted(self.blocks.items()))
+        return [
+            f"  ブロック: {blocks or 'なし'}, 再試行: {self.retries}件, バックオフ合計: {self.backoff_seconds:.0f}秒",
+            f"  同時実行数: 現在 {self.limit}/{self.max_concurrency}（最小 {self.lowest_limit}）, レート: {rates or '-'}",
+        ]
+
+    def to_info(self):
+        """メトリクスに記録する値。"""
+        return {
+            "blocked_pages": sum(self.blocks.values()),
+            "keyword_retries": self.retries,
+            "backoff_seconds": round(self.backoff_seconds, 1),
+            "final_concurrency": self.limit,
+        }
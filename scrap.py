@@ -4,16 +4,787 @@ from playwright.async_api import async_playwright
 from dotenv import load_dotenv
 import os
 import csv
-import re
 from datetime import datetime
 from zoneinfo import ZoneInfo  # built-in since Python 3.9
 import argparse
 import json
 import sys
+import time
+import uuid
+from contextlib import nullcontext
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from concurrent.futures import ProcessPoolExecutor
+from env import read_flag
+from events import emit
+from journal import RunJournal
+from metrics import Metrics
+from history import RankHistory, history_path
+from readiness import PAGINATION_SELECTOR, PageReadiness, PageTimeoutError
+from resource_blocking import ResourceBlocker
+from run_profiles import PROFILE_NAMES, get_profile
+from marketplaces import get_marketplaces, is_primary, marketplace_for_url, tag_result, tagged_keyword
+from serp import SLOTS, SerpRanking, take_snapshot, parse_serp_html, best_rank, is_bot_check, is_no_results
+from serp_cache import SerpCache
+from session_state import SessionStateStore
+from scheduler import BlockedPageError, RequestScheduler
+from shards import ShardCoordinator, read_shards
+from distributed import DistributedCoordinator, read_coordinator_address
 
 jst = ZoneInfo("Asia/Tokyo")
 
-async def scraping(spreadsheet_id=None, sheet_name=None):
+DEFAULT_SEARCH_DEPTH = 2  # Scrape first 2 pages for each keyword unless configured
+MAX_SEARCH_DEPTH = 7
+DEFAULT_PAGE_PARALLELISM = 2
+
+
+def _read_concurrency(concurrency=None, default=1):
+    """同時に処理するページ数（ワーカー数）を返す。"""
+    if concurrency is None:
+        concurrency = os.getenv("CONCURRENCY", default)
+    try:
+        concurrency = int(concurrency)
+    except (TypeError, ValueError):
+        concurrency = default
+    return max(1, concurrency)
+
+
+def _read_extraction_mode():
+    """結果ページの抽出方式を返す（evaluate: ページ内で抽出 / html: HTML をプロセスプールで解析）。"""
+    mode = os.getenv("EXTRACTION_MODE", "evaluate").strip().lower()
+    return mode if mode in ("evaluate", "html") else "evaluate"
+
+
+def _read_parser_workers():
+    """HTML 解析プロセス数を返す（省略時は CPU コア数）。"""
+    try:
+        return max(1, int(os.getenv("PARSER_WORKERS", "")))
+    except ValueError:
+        return os.cpu_count() or 1
+
+
+def _parse_depth(value, default):
+    """検索ページ数を 1〜MAX_SEARCH_DEPTH の範囲で返す（不正な値は default）。"""
+    try:
+        return max(1, min(MAX_SEARCH_DEPTH, int(value)))
+    except (TypeError, ValueError):
+        return default
+
+
+def _read_page_parallelism(max_depth):
+    """1つのキーワードで同時に読み込むページ数を返す。"""
+    try:
+        return max(1, min(max_depth, int(os.getenv("PAGE_PARALLELISM", DEFAULT_PAGE_PARALLELISM))))
+    except ValueError:
+        return min(max_depth, DEFAULT_PAGE_PARALLELISM)
+
+
+def _read_tracked_slots():
+    """早期終了の判定対象にする枠を返す（TRACKED_SLOTS、省略時は全枠）。"""
+    value = os.getenv("TRACKED_SLOTS")
+    if not value:
+        return SLOTS
+    slots = tuple(slot for slot in (item.strip() for item in value.split(",")) if slot in SLOTS)
+    return slots or SLOTS
+
+
+def _read_target_asins(asins_file):
+    """ASIN ファイル（1列・ヘッダーなし）を読み込む。"""
+    with open(asins_file, "r", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        return frozenset(row[0].strip() for row in reader if row)  # remove empty lines; indexed for O(1) lookups
+
+
+def build_search_url(target_url, keyword, page_index):
+    """TARGET_URL のホストとクエリ（language など）を基に、キーワードとページ番号の検索 URL を作る。"""
+    parts = urlsplit(target_url)
+    query = [(key, value) for key, value in parse_qsl(parts.query) if key not in ("k", "page")]
+    query.append(("k", keyword))
+    if page_index > 1:
+        query.append(("page", str(page_index)))
+    return urlunsplit((parts.scheme, parts.netloc, "/s", urlencode(query), ""))
+
+
+class KeywordScraper:
+    """1回の実行で共有する設定と状態を持ち、キーワードごとの検索を行う。
+
+    parser_pool が渡された場合、ブラウザは page.content() の取得だけを行い、
+    解析はプロセスプールに任せて次のページの読み込みと並行させる。
+    """
+
+    # Give up on direct URLs for the rest of the run after this many consecutive rejections
+    MAX_DIRECT_REJECTIONS = 3
+    # Reload a keyword whose page timed out this many times before reporting it as an error
+    MAX_TIMEOUT_RETRIES = 1
+
+    def __init__(self, target_url, target_asins, readiness, parser_pool=None, direct_urls=True,
+                 early_stop=True, tracked_slots=SLOTS, cache=None, metrics=None, scheduler=None,
+                 marketplace_profile=None):
+        self.target_url = target_url
+        self.marketplace = marketplace_of(target_url)
+        # Search box and pagination labels differ per marketplace
+        self.marketplace_profile = marketplace_profile or marketplace_for_url(target_url)
+        self.target_asins = target_asins
+        self.readiness = readiness
+        self.parser_pool = parser_pool
+        self.direct_urls = direct_urls
+        self.early_stop = early_stop
+        self.tracked_slots = tracked_slots
+        self.cache = cache
+        self.metrics = metrics or Metrics("scrap", "")
+        self.scheduler = scheduler
+        self._direct_rejections = 0
+        self._attempts = {}  # index -> blocked attempts
+        self._timeouts = {}  # index -> timed out attempts
+        # Set once a bot check is seen: the cookies of this context must not be saved for the next run
+        self.session_stale = False
+
+    async def _pace(self, url):
+        if self.scheduler is not None:
+            await self.scheduler.before_request(url)
+
+    async def _check_page(self, page, page_index, has_results):
+        """読み込んだページを確認し、検索結果があれば True、「検索に一致する商品はありません」の表示なら False を返す。
+
+        ボットチェックは BlockedPageError を、どちらでもない（検索結果の表示を待ってタイムアウトした）場合は
+        PageTimeoutError を送出する。検索結果が無いだけのページはブロックとして扱わない。
+        """
+        if has_results:
+            if self.scheduler is not None:
+                self.scheduler.report_clean(page.url)
+            return True
+        if await is_bot_check(page):
+            raise BlockedPageError("captcha", page.url)
+        # A slow page must not be recorded (and cached) as a keyword without results
+        if await is_no_results(page, self.marketplace):
+            return False
+        raise PageTimeoutError(page_index, page.url)
+
+    def retry_blocked(self, index, error):
+        """ブロックされたキーワードを取り直すか判断する。取り直す場合はバックオフの秒数、諦める場合は None。"""
+        if error.kind == "captcha":
+            self.session_stale = True
+        if self.scheduler is None:
+            return None
+        delay = self.scheduler.report_block(error.url or self.target_url, error.kind)
+        attempts = self._attempts.get(index, 0) + 1
+        self._attempts[index] = attempts
+        if attempts > self.scheduler.max_retries:
+            return None
+        self.scheduler.retries += 1
+        return delay
+
+    def retry_timeout(self, index):
+        """読み込みがタイムアウトしたキーワードを取り直すなら True（MAX_TIMEOUT_RETRIES 回まで）。"""
+        attempts = self._timeouts.get(index, 0) + 1
+        self._timeouts[index] = attempts
+        return attempts <= self.MAX_TIMEOUT_RETRIES
+
+    async def _capture(self, page, keyword, page_index):
+        """現在のページのスナップショット（html モードでは解析中の Future）を返す。"""
+        with self.metrics.span("extraction", keyword=keyword, page=page_index) as counts:
+            if self.parser_pool is not None:
+                # Hand the raw HTML to the parser processes and move on to the next page
+                html = await page.content()
+                counts["bytes"] = len(html)
+                return asyncio.get_running_loop().run_in_executor(self.parser_pool, parse_serp_html, html, self.marketplace)
+            # Extract products and SB blocks in a single round trip
+            snapshot = await take_snapshot(page, self.marketplace)
+            counts["elements"] = len(snapshot["products"]) + len(snapshot["blocks"])
+            return snapshot
+
+    async def _add_snapshots(self, ranking, captured, keyword):
+        """取得したスナップショットをページ順に分類し、早期終了できるかを返す。"""
+        for page_index, snapshot in captured:
+            if asyncio.isfuture(snapshot):
+                with self.metrics.span("parse_wait", keyword=keyword, page=page_index):
+                    snapshot = await snapshot
+            with self.metrics.span("classification", keyword=keyword, page=page_index) as counts:
+                ranking.add_snapshot(snapshot, page_index)
+                counts["elements"] = len(snapshot["products"]) + len(snapshot["blocks"])
+            if self.cache is not None:
+                self.cache.put(self.marketplace, keyword, page_index, snapshot)
+        return self.early_stop and ranking.is_complete(self.tracked_slots)
+
+    def _cache_missing(self, keyword, page_index):
+        if self.cache is not None:
+            self.cache.put_missing(self.marketplace, keyword, page_index)
+
+    async def _load_direct(self, page, keyword, page_index):
+        """検索 URL を開き、検索結果があるかを返す（_check_page を参照）。応答が拒否された場合は None。"""
+        url = build_search_url(self.target_url, keyword, page_index)
+        await self._pace(url)
+        with self.metrics.span("navigation", keyword=keyword, page=page_index) as counts:
+            response = await self.readiness.goto(page, url)
+            if response is not None:
+                try:
+                    counts["bytes"] = int(response.headers.get("content-length", 0))
+                except ValueError:
+                    pass
+        if response is not None and response.status in (429, 503):
+            raise BlockedPageError("throttled", url)
+        if response is None:
+            raise PageTimeoutError(page_index, url)
+        if not response.ok:
+            return None
+        with self.metrics.span("readiness", keyword=keyword, page=page_index):
+            # Direct URLs never click the pagination links
+            has_results = await self.readiness.wait_for_results(page, needs_pagination=False)
+        return await self._check_page(page, page_index, has_results)
+
+    async def _collect_direct(self, tabs, keyword, depth, ranking):
+        """検索 URL を直接開き、各ページを tabs で並行して読み込む。
+
+        1ページ目の応答が拒否された場合は False を返す（クリック操作にフォールバック）。
+        1ページ目に「検索に一致する商品はありません」と表示された場合は、空の順位のまま True を返す。
+        早期終了が有効な場合、1ページ目だけを先に読み込み、すべての対象 ASIN が見つかれば残りのページは読み込まない。
+        """
+        start = 1
+        while start <= depth:
+            # Page 1 alone first: with the default depth 2 a parallel wave would always load page 2 too
+            size = 1 if start == 1 and self.early_stop else len(tabs)
+            wave = list(range(start, min(start + size, depth + 1)))
+            start = wave[-1] + 1
+            # Let every tab settle before raising: the next keyword reuses these tabs
+            loaded = await asyncio.gather(*(
+                self._load_direct(tab, keyword, page_index) for tab, page_index in zip(tabs, wave)
+            ), return_exceptions=True)
+            errors = [outcome for outcome in loaded if isinstance(outcome, BaseException)]
+            if errors:
+                # A block outranks a timeout on another tab (it decides the backoff and the session)
+                raise next((error for error in errors if isinstance(error, BlockedPageError)), errors[0])
+            captured = []  # [(page_index, snapshot or Future), ...]
+            for tab, page_index, has_results in zip(tabs, wave, loaded):
+                if has_results is None and page_index == 1:
+                    return False
+                if not has_results:
+                    if page_index == 1:
+                        print(f"検索結果がありません: {keyword}")
+                    else:
+                        print(f"ページ {page_index} が見つかりません。次のキーワードに進みます。")
+                    await self._add_snapshots(ranking, captured, keyword)
+                    # Only a page that answered "no results" is known not to exist; a rejected one may load next time
+                    if has_results is False:
+                        self._cache_missing(keyword, page_index)
+                    return True
+                captured.append((page_index, await self._capture(tab, keyword, page_index)))
+            if await self._add_snapshots(ranking, captured, keyword) and wave[-1] < depth:
+                print(f"すべての対象 ASIN が見つかったため、{wave[-1]}ページ目で終了します: {keyword}")
+                return True
+        return True
+
+    async def _collect_by_clicking(self, page, keyword, depth, ranking):
+        """検索ボックスとページ送りリンクを操作して各ページを順に読み込む。"""
+        for page_index in range(1, depth + 1):
+            if page_index == 1:
+                # Input keyword in search box (find input element that placeholder is e.g. "Amazon.co.jpを検索")
+                search_input = page.locator(self.marketplace_profile.search_input_selector())
+                if await search_input.count() == 0:
+                    await self.readiness.goto(page, self.target_url)
+                await search_input.fill(keyword)
+
+                # Click enter
+                await self._pace(self.target_url)
+                with self.metrics.span("navigation", keyword=keyword, page=page_index):
+                    await self.readiness.navigate(page, lambda: search_input.press("Enter"))
+
+            # If page_index > 1, navigate to the specific page(find a element that aria-label is e.g. "2ページに移動)
+            if page_index > 1:
+                page_navigator = page.locator(self.marketplace_profile.page_link_selector(page_index))
+                if await page_navigator.count() == 0:
+                    print(f"ページ {page_index} が見つかりません。次のキーワードに進みます。")
+                    # Without the pagination strip the link may just not have rendered yet
+                    if await page.locator(PAGINATION_SELECTOR).count() > 0:
+                        self._cache_missing(keyword, page_index)
+                    break
+                await self._pace(self.target_url)
+                with self.metrics.span("navigation", keyword=keyword, page=page_index):
+                    await self.readiness.navigate(page, page_navigator.click)
+
+            # Wait for the product grid, pagination and network idle instead of a fixed sleep
+            with self.metrics.span("readiness", keyword=keyword, page=page_index):
+                has_results = await self.readiness.wait_for_results(page, needs_pagination=page_index < depth)
+            if not await self._check_page(page, page_index, has_results):
+                if page_index == 1:
+                    print(f"検索結果がありません: {keyword}")
+                else:
+                    print(f"ページ {page_index} に検索結果がありません。次のキーワードに進みます。")
+                self._cache_missing(keyword, page_index)
+                break
+            captured = [(page_index, await self._capture(page, keyword, page_index))]
+            if await self._add_snapshots(ranking, captured, keyword) and page_index < depth:
+                print(f"すべての対象 ASIN が見つかったため、{page_index}ページ目で終了します: {keyword}")
+                break
+
+    async def scrape(self, tabs, keyword, depth):
+        """1つのキーワードを depth ページまで検索し、自然検索・SP・SB の順位を返す。"""
+        ranking = SerpRanking(self.target_asins, self.marketplace)
+        collected = False
+        if self.direct_urls:
+            collected = await self._collect_direct(tabs, keyword, depth, ranking)
+            if not collected:
+                self._direct_rejections += 1
+                print(f"直接 URL での検索が拒否されました。検索ボックスから再試行します: {keyword}")
+                if self._direct_rejections >= self.MAX_DIRECT_REJECTIONS:
+                    print("直接 URL での検索が続けて拒否されたため、以降は検索ボックスを使用します。")
+                    self.direct_urls = False
+                ranking = SerpRanking(self.target_asins, self.marketplace)
+            else:
+                self._direct_rejections = 0
+        if not collected:
+            await self._collect_by_clicking(tabs[0], keyword, depth, ranking)
+        return rank_keyword(keyword, ranking)
+
+
+def marketplace_of(target_url):
+    """キャッシュのキーに使うマーケットプレイス（TARGET_URL のホスト名）を返す。"""
+    return (urlsplit(target_url or "").hostname or "").lower()
+
+
+def plan_jobs(keyword_rows, marketplace_profiles, target_url, default_depth):
+    """キーワードファイルの行から [(マーケットプレイスのプロファイル, primary, キーワード, 検索ページ数), ...] を作る。
+
+    2列目は検索ページ数、3列目は検索するマーケットプレイス名（空白区切り、省略時はすべて）。
+    TARGET_URL のマーケットプレイスの結果はキーワードそのまま、それ以外は「us:キーワード」として記録する（primary）。
+    """
+    jobs = []
+    for marketplace_profile in marketplace_profiles:
+        primary = is_primary(marketplace_profile, target_url)
+        for row in keyword_rows:
+            names = row[2].lower().split() if len(row) > 2 else []
+            if names and marketplace_profile.name not in names:
+                continue
+            keyword_depth = _parse_depth(row[1], default_depth) if len(row) > 1 and row[1].strip() else default_depth
+            jobs.append((marketplace_profile, primary, row[0].strip(), keyword_depth))
+    return jobs
+
+
+def rank_from_cache(cache, marketplace, keyword, depth, target_asins, early_stop=True, tracked_slots=SLOTS):
+    """キャッシュ済みのスナップショットだけで順位を求める。必要なページが揃っていなければ None を返す。"""
+    ranking = SerpRanking(target_asins, marketplace)
+    for page_index in range(1, depth + 1):
+        snapshot = cache.get(marketplace, keyword, page_index)
+        if snapshot is None:
+            return None
+        if snapshot.get("missing"):
+            break
+        ranking.add_snapshot(snapshot, page_index)
+        if early_stop and ranking.is_complete(tracked_slots):
+            break
+    print(f"キャッシュ済みの検索結果から順位を求めます: {keyword}")
+    return rank_keyword(keyword, ranking)
+
+
+def rank_keyword(keyword, ranking):
+    """蓄積した分類結果から、自然検索・SP・SB の順位を返す。
+
+    結果の "ranks" には全ターゲット ASIN の枠ごとの順位が入る（serp.rank_targets を参照）。
+    順位は複数ページを通した通し番号（2ページ目の3番目なら 1ページ目の件数 + 3）。
+    """
+    # Rank of every target ASIN in every slot, found in one pass over each list
+    ranks = ranking.ranks()
+
+    # Format results for output (the sheet shows the best-ranked target ASIN per slot)
+    formatted = {}
+    for slot in SLOTS:
+        best = best_rank(ranks[slot])
+        formatted[slot] = str(best["rank"]) if best is not None else "-"
+
+    print(f"キーワード： {keyword}, 自然検索: {formatted['自然検索']}, SP: {formatted['SP']}, SB: {formatted['SB']}")
+
+    return {
+        "keyword": keyword,
+        "自然検索": formatted["自然検索"],
+        "SP": formatted["SP"],
+        "SB": formatted["SB"],
+        "pages": ranking.pages,
+        "ranks": ranks
+    }
+
+
+def app_base_dir():
+    """データファイルを置くディレクトリ（exe の場合は exe のディレクトリ）を返す。"""
+    # Use exe directory when frozen, script directory otherwise
+    if getattr(sys, 'frozen', False):
+        return Path(sys.executable).parent
+    return Path(__file__).parent
+
+
+# Location of the executable inside a chromium-* folder, per platform (older and newer Playwright layouts)
+CHROMIUM_EXECUTABLES = {
+    "win32": [("chrome-win", "chrome.exe"), ("chrome-win64", "chrome.exe")],
+    "linux": [("chrome-linux", "chrome"), ("chrome-linux64", "chrome")],
+    "darwin": [
+        ("chrome-mac", "Chromium.app", "Contents", "MacOS", "Chromium"),
+        ("chrome-mac-arm64", "Google Chrome for Testing.app", "Contents", "MacOS", "Google Chrome for Testing"),
+        ("chrome-mac-x64", "Google Chrome for Testing.app", "Contents", "MacOS", "Google Chrome for Testing"),
+    ],
+}
+
+
+def find_chromium():
+    """Chromium の実行ファイルを返す。
+
+    CHROMIUM_EXECUTABLE があればそれを、なければ同梱の .playwright-browsers から探す。
+    exe 以外で同梱のブラウザが無い場合は None（Playwright が導入したブラウザを使う）。
+    """
+    override = os.getenv("CHROMIUM_EXECUTABLE")
+    if override:
+        return Path(override)
+    browsers_dir = app_base_dir() / ".playwright-browsers"
+    candidates = CHROMIUM_EXECUTABLES.get(sys.platform, CHROMIUM_EXECUTABLES["linux"])
+
+    for chromium_dir in sorted(browsers_dir.glob("chromium-*")):
+        for relative in candidates:
+            executable = chromium_dir.joinpath(*relative)
+            if executable.exists():
+                return executable
+    if getattr(sys, 'frozen', False):
+        raise Exception("No Chromium browser found in .playwright-browsers")
+    return None
+
+
+class BrowserSession:
+    """Playwright・Chromium・ブラウザコンテキストとタブをまとめて保持する。
+
+    ブラウザコンテキストはマーケットプレイスごとに1つ作る（Cookie と言語を分けるため）。
+    保存済みのセッション（session_state.py）が有効なら、それを読み込んだ状態でコンテキストを作る。
+    scraping() は実行ごとに新しいセッションを作るが、scrap_server.py は
+    1つのセッションを使い回し、起動済みのブラウザで次のジョブを処理する。
+    """
+
+    def __init__(self, profile=None):
+        self.profile = get_profile(profile)
+        self.playwright = None
+        self.browser = None
+        self.blocker = None
+        self.state_store = SessionStateStore.from_env(app_base_dir())
+        self.contexts = {}  # marketplace name -> browser context
+        self.pages = {}  # marketplace name -> tabs
+        self.restored = set()  # marketplace names whose context started from a saved session
+
+    async def start(self):
+        self.playwright = await async_playwright().start()
+        executable = find_chromium()
+        # Headless mode, slow_mo and the viewport come from the run profile
+        self.browser = await self.playwright.chromium.launch(
+            **self.profile.launch_options(),
+            executable_path=str(executable) if executable is not None else None
+        )
+        # Skip images, fonts, media and trackers; none of them affect the ranking
+        self.blocker = ResourceBlocker.from_env()
+        self.contexts = {}
+        self.pages = {}
+        self.restored = set()
+
+    def is_alive(self):
+        return self.browser is not None and self.browser.is_connected()
+
+    async def context_for(self, marketplace_profile):
+        """マーケットプレイスのブラウザコンテキストを返す（初回だけ作る）。"""
+        context = self.contexts.get(marketplace_profile.name)
+        if context is None:
+            state = None
+            if self.state_store is not None:
+                state = self.state_store.load(self.profile, marketplace_profile)
+            context = await self.browser.new_context(
+                **self.profile.context_options(),
+                **marketplace_profile.context_options(),
+                storage_state=state
+            )
+            if self.blocker is not None:
+                await self.blocker.install(context)
+            self.contexts[marketplace_profile.name] = context
+            if state is not None:
+                print(f"保存済みのセッションを使用します（{marketplace_profile.name}）。")
+                self.restored.add(marketplace_profile.name)
+        return context
+
+    async def save_state(self, marketplace_profile):
+        """コンテキストの Cookie・ストレージを次回の起動のために保存する。"""
+        context = self.contexts.get(marketplace_profile.name)
+        if self.state_store is None or context is None:
+            return
+        state = await context.storage_state()
+        if self.state_store.is_valid(state, marketplace_profile.host):
+            self.state_store.save(self.profile, marketplace_profile, state)
+
+    async def discard_context(self, marketplace_profile):
+        """ボットチェックが出たコンテキストを閉じ、保存済みのセッションも削除する（次は新しいセッションで始める）。"""
+        if self.state_store is not None:
+            self.state_store.invalidate(self.profile, marketplace_profile)
+        context = self.contexts.pop(marketplace_profile.name, None)
+        self.pages.pop(marketplace_profile.name, None)
+        self.restored.discard(marketplace_profile.name)
+        if context is not None:
+            await context.close()
+
+    async def worker_tabs(self, worker_count, page_parallelism, marketplace_profile):
+        """マーケットプレイスのワーカーごとのタブのグループを返す。既存のタブは再利用し、不足分だけ開く。"""
+        context = await self.context_for(marketplace_profile)
+        pages = [page for page in self.pages.get(marketplace_profile.name, []) if not page.is_closed()]
+        needed = worker_count * page_parallelism
+        while len(pages) < needed:
+            pages.append(await context.new_page())
+        self.pages[marketplace_profile.name] = pages
+        return [
+            pages[start:start + page_parallelism]
+            for start in range(0, needed, page_parallelism)
+        ]
+
+    async def close(self):
+        if self.browser is not None:
+            await self.browser.close()
+        if self.playwright is not None:
+            await self.playwright.stop()
+        self.playwright = None
+        self.browser = None
+        self.contexts = {}
+        self.pages = {}
+        self.restored = set()
+
+
+async def _keyword_worker(tabs, queue, results, scraper, on_result, warm_up=True):
+    """キューからキーワードを取り出し、担当タブで順に処理する。
+
+    warm_up が False（保存済みのセッションを読み込んだコンテキスト）の場合は、トップページを開かずに始める。
+    """
+    if warm_up and tabs[0].url == "about:blank":
+        # New tab: open the top page once to establish the session (reused tabs and saved sessions skip this)
+        try:
+            with scraper.metrics.span("warmup", marketplace=scraper.marketplace_profile.name):
+                await tabs[0].goto(scraper.target_url)
+        except Exception as e:
+            # The keywords still load their own pages; only the warm-up cookies are missing
+            print(f"トップページを開けませんでした（そのままキーワードの取得を始めます）: {e}")
+    while True:
+        try:
+            index, keyword, depth = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        marketplace = scraper.marketplace_profile.name
+        emit("keyword_started", index=index, keyword=keyword, marketplace=marketplace)
+        started = time.perf_counter()
+        try:
+            async with scraper.scheduler.slot() if scraper.scheduler is not None else nullcontext():
+                with scraper.metrics.span("keyword", keyword=keyword, marketplace=marketplace) as counts:
+                    result = await scraper.scrape(tabs, keyword, depth)
+                    counts["pages"] = result["pages"]
+            # A failure to record the result (journal, event) is this keyword's error, not the whole run's
+            on_result(index, keyword, result)
+        except BlockedPageError as e:
+            delay = scraper.retry_blocked(index, e)
+            if delay is None:
+                print(f"キーワード「{keyword}」: {e}。取得を中止します。")
+                emit("keyword_error", index=index, keyword=keyword, error=str(e), reason=e.kind, marketplace=marketplace)
+            else:
+                # Only this keyword is retried, after the host's backoff
+                print(f"キーワード「{keyword}」: {e}。{delay:.0f}秒待ってから取得し直します。")
+                emit("keyword_retry", index=index, keyword=keyword, reason=e.kind, delay=round(delay, 1))
+                queue.put_nowait((index, keyword, depth))
+        except PageTimeoutError as e:
+            # Not a block and not an empty result: reload, then report it with its own reason
+            if scraper.retry_timeout(index):
+                print(f"キーワード「{keyword}」: {e}。取得し直します。")
+                emit("keyword_retry", index=index, keyword=keyword, reason="timeout", delay=0)
+                queue.put_nowait((index, keyword, depth))
+            else:
+                print(f"キーワード「{keyword}」: {e}。取得を中止します。")
+                emit("keyword_error", index=index, keyword=keyword, error=str(e), reason="timeout", marketplace=marketplace)
+        except Exception as e:
+            # One failing keyword must not lose the results of the others
+            print(f"キーワード「{keyword}」の取得中にエラーが発生しました: {e}")
+            emit("keyword_error", index=index, keyword=keyword, error=str(e), marketplace=marketplace)
+        else:
+            results[index] = result
+        finally:
+            emit("timing", index=index, keyword=keyword, seconds=round(time.perf_counter() - started, 3))
+            queue.task_done()
+
+
+async def _run_workers(session, lanes, results, readiness, on_result, *, target_asins,
+                       concurrency, default_depth, page_parallelism, extraction_mode, direct_urls,
+                       early_stop, tracked_slots, cache, metrics, profile, scheduler):
+    """ブラウザを用意し、キューが空になるまでワーカーにキーワードを処理させる。
+
+    lanes は [(マーケットプレイスのプロファイル, キュー), ...]。マーケットプレイスごとに
+    別のブラウザコンテキストで最大 concurrency 個のワーカーを動かし、すべてを並行して処理する。
+    session が None の場合はこの実行専用のブラウザを起動し、終了時に閉じる。
+    """
+    # start playwright (or reuse the warm browser of the resident server)
+    own_session = session is None
+    if own_session:
+        session = BrowserSession(profile)
+        await session.start()
+    else:
+        if session.blocker is not None:
+            session.blocker.reset_counters()
+        if session.state_store is not None:
+            session.state_store.reset_counters()
+
+    parser_pool = None
+    scrapers = []
+    try:
+        lanes = [(marketplace_profile, queue) for marketplace_profile, queue in lanes if not queue.empty()]
+        print(f"検索ページ数: {default_depth}（キーワードごとの指定を除く）")
+        print(f"キーワードあたりの同時読み込みページ数: {page_parallelism}")
+
+        if extraction_mode == "html":
+            parser_workers = _read_parser_workers()
+            parser_pool = ProcessPoolExecutor(max_workers=parser_workers)
+            print(f"HTML 解析プロセス数: {parser_workers}")
+        workers = []
+        for marketplace_profile, queue in lanes:
+            worker_count = max(1, min(concurrency, queue.qsize()))
+            if len(lanes) > 1:
+                print(f"同時実行数（{marketplace_profile.name}）: {worker_count}")
+            else:
+                print(f"同時実行数: {worker_count}")
+            worker_tabs = await session.worker_tabs(worker_count, page_parallelism, marketplace_profile)
+            scraper = KeywordScraper(
+                marketplace_profile.base_url, target_asins, readiness, parser_pool, direct_urls,
+                early_stop=early_stop,
+                tracked_slots=tracked_slots,
+                cache=cache,
+                metrics=metrics,
+                scheduler=scheduler,
+                marketplace_profile=marketplace_profile,
+            )
+            scrapers.append(scraper)
+            warm_up = marketplace_profile.name not in session.restored
+            workers.extend(_keyword_worker(tabs, queue, results, scraper, on_result, warm_up) for tabs in worker_tabs)
+        await asyncio.gather(*workers)
+    finally:
+        if parser_pool is not None:
+            parser_pool.shutdown()
+        if session.is_alive():
+            await _save_sessions(session, scrapers)
+        if own_session:
+            await session.close()
+    return session
+
+
+async def _save_sessions(session, scrapers):
+    """実行の終わりにマーケットプレイスごとのセッションを保存する（ボットチェックが出たものは破棄する）。"""
+    for scraper in scrapers:
+        try:
+            if scraper.session_stale:
+                print(f"ボットチェックが出たため、保存済みのセッションを破棄します（{scraper.marketplace_profile.name}）。")
+                await session.discard_context(scraper.marketplace_profile)
+            else:
+                await session.save_state(scraper.marketplace_profile)
+        except Exception as e:
+            # A session that cannot be saved only costs the next run its warm start
+            print(f"セッションの保存に失敗しました（{scraper.marketplace_profile.name}）: {e}")
+
+
+class BatchRunner:
+    """起動したブラウザを使い回し、渡されたキーワードのまとまりを順に処理する。
+
+    シャードのワーカープロセス（--shard-worker）と分散ワーカー（distributed.py）が使う。
+    設定は scraping() と同じ環境変数から読み込む。ジャーナル・履歴への記録はコーディネーター側で行う。
+    """
+
+    def __init__(self, concurrency=None, profile=None):
+        load_dotenv()
+        self.profile = get_profile(profile)
+        # Shards and distributed workers search a single marketplace (the first of MARKETPLACES)
+        self.target_url = get_marketplaces(target_url=os.getenv("TARGET_URL"))[0].base_url
+        asins_file = os.getenv("ASINS_FILE")
+        self.target_asins = _read_target_asins(asins_file) if asins_file else frozenset()
+        self.concurrency = _read_concurrency(concurrency, self.profile.concurrency)
+        self.extraction_mode = _read_extraction_mode()
+        self.direct_urls = read_flag("DIRECT_URL_PAGINATION")
+        self.early_stop = read_flag("EARLY_STOP")
+        self.tracked_slots = _read_tracked_slots()
+        self.cache = SerpCache.from_env(app_base_dir())
+        self.readiness = PageReadiness(wait_strategy=self.profile.wait_strategy)
+        self.metrics = Metrics("scrap_worker", uuid.uuid4().hex)
+        self.scheduler = RequestScheduler.from_env(self.concurrency)
+        self.session = BrowserSession(self.profile)
+
+    async def run(self, items, on_result, target_url=None, target_asins=None):
+        """items（[(index, keyword, depth), ...]）を処理し、結果ごとに on_result(index, keyword, result) を呼ぶ。
+
+        target_url / target_asins を渡すと、環境変数の代わりにその値を使う（分散ワーカーはジョブから受け取る）。
+        """
+        if not self.session.is_alive():
+            if self.session.browser is not None:
+                await self.session.close()
+            await self.session.start()
+        queue = asyncio.Queue()
+        for index, keyword, depth in items:
+            queue.put_nowait((index, keyword, depth))
+        max_depth = max(depth for _, _, depth in items)
+        results = {}
+        await _run_workers(
+            self.session, [(marketplace_for_url(target_url or self.target_url), queue)], results, self.readiness, on_result,
+            target_asins=target_asins if target_asins is not None else self.target_asins,
+            concurrency=self.concurrency,
+            default_depth=max_depth,
+            page_parallelism=_read_page_parallelism(max_depth) if self.direct_urls else 1,
+            extraction_mode=self.extraction_mode,
+            direct_urls=self.direct_urls,
+            early_stop=self.early_stop,
+            tracked_slots=self.tracked_slots,
+            cache=self.cache,
+            metrics=self.metrics,
+            profile=self.profile,
+            scheduler=self.scheduler,
+        )
+        return results
+
+    async def close(self):
+        await self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+async def run_shard_worker(concurrency=None, profile=None):
+    """シャードのワーカー: 標準入力から受け取ったバッチを処理し、結果をイベントで返す（shards.py を参照）。"""
+    runner = BatchRunner(concurrency, profile)
+    loop = asyncio.get_running_loop()
+
+    def on_result(index, keyword, result):
+        emit("keyword_result", index=index, keyword=keyword, result=result)
+
+    try:
+        while True:
+            line = await loop.run_in_executor(None, sys.stdin.readline)
+            if not line:
+                break
+            batch = json.loads(line)
+            await runner.run(batch["items"], on_result)
+            emit("shard_batch_done", lease=batch["lease"])
+    finally:
+        await runner.close()
+        emit("shard_metrics", spans=runner.metrics.spans)
+
+
+def _shard_worker_command(concurrency, profile):
+    """シャードのワーカープロセスを起動するコマンド（exe の場合は exe 自身を起動する）。"""
+    if getattr(sys, 'frozen', False):
+        command = [sys.executable, "--run-scrap-shard"]
+    else:
+        command = [sys.executable, "-u", str(Path(__file__).resolve()), "--shard-worker"]
+    return command + ["--concurrency", str(concurrency), "--profile", profile.name]
+
+
+async def scraping(spreadsheet_id=None, sheet_name=None, concurrency=None, depth=None, session=None, resume=None,
+                   keywords_file=None, profile=None, shards=None, coordinator_port=None, marketplaces=None):
+    """keywords.csv の全キーワードの順位を取得する。
+
+    session（BrowserSession）を渡すと起動済みのブラウザを使い、終了時も閉じない。
+    resume が True（省略時は RESUME）の場合、当日ジャーナルに記録済みのキーワードは取得し直さない。
+    keywords_file を渡すと KEYWORDS_FILE の代わりにそのファイルのキーワードを取得する。
+    profile は実行プロファイル名（省略時は RUN_PROFILE、run_profiles.py を参照）。
+    session を渡した場合、ブラウザの設定はそのセッションのプロファイルのものになる。
+    shards（省略時は SHARDS）が 2 以上の場合、キーワードをその数のワーカープロセスに分けて取得する
+    （shards.py を参照。session を渡した場合は使わない）。
+    coordinator_port（省略時は COORDINATOR_PORT）を指定すると、ブラウザを起動せずに
+    他のマシンのワーカーへキーワードを配る（distributed.py を参照）。
+    marketplaces（省略時は MARKETPLACES、marketplaces.py を参照）に複数のマーケットプレイスを指定すると、
+    同じキーワードをマーケットプレイスごとに別のブラウザコンテキストで並行して検索する。
+    """
     # --- start time ---
     print("スクレイピングが始まりました...")
     start_time = datetime.now(jst)
@@ -24,233 +795,276 @@ async def scraping(spreadsheet_id=None, sheet_name=None):
 
     target_url = os.getenv("TARGET_URL")
     asins_file = os.getenv("ASINS_FILE")
-    keywords_file = os.getenv("KEYWORDS_FILE")
+    keywords_file = keywords_file or os.getenv("KEYWORDS_FILE")
+    profile = get_profile(profile)
+    print(f"実行プロファイル: {profile.name}")
+    concurrency = _read_concurrency(concurrency, profile.concurrency)
+    extraction_mode = _read_extraction_mode()
+    direct_urls = read_flag("DIRECT_URL_PAGINATION")
+    shards = read_shards(shards) if session is None else 1
+    coordinator_address = read_coordinator_address(coordinator_port) if session is None else None
+    marketplace_profiles = get_marketplaces(marketplaces, target_url)
+    if len(marketplace_profiles) > 1:
+        print(f"マーケットプレイス: {', '.join(item.name for item in marketplace_profiles)}")
+        if shards > 1 or coordinator_address is not None:
+            print("複数のマーケットプレイスを検索する場合、シャード・分散実行は使わずにこのプロセスで実行します。")
+            shards = 1
+            coordinator_address = None
+    default_depth = _parse_depth(depth if depth is not None else os.getenv("SEARCH_DEPTH"), DEFAULT_SEARCH_DEPTH)
 
     # Read ASINs (one column, no header)
-    with open(asins_file, "r", encoding="utf-8") as f:
-        reader = csv.reader(f)
-        target_asins = [row[0].strip() for row in reader if row]  # remove empty lines
+    target_asins = _read_target_asins(asins_file)
 
-    # Read Keywords (one column, no header)
+    # Read Keywords (no header; optional second column = search depth for that keyword)
     with open(keywords_file, "r", encoding="utf-8") as f:
         reader = csv.reader(f)
-        keywords = [row[0].strip() for row in reader if row]
+        keyword_rows = [row for row in reader if row]
+    keywords = [row[0].strip() for row in keyword_rows]
+    jobs = plan_jobs(keyword_rows, marketplace_profiles, target_url, default_depth)
+    page_parallelism = _read_page_parallelism(max((job[3] for job in jobs), default=1)) if direct_urls else 1
+    record_keywords = [tagged_keyword(keyword, marketplace_profile, primary) for marketplace_profile, primary, keyword, _ in jobs]
 
-    # chromium
-    # Use exe directory when frozen, script directory otherwise
-    if getattr(sys, 'frozen', False):
-        base_dir = Path(sys.executable).parent
-    else:
-        base_dir = Path(__file__).parent
-    browsers_dir = base_dir / ".playwright-browsers"
-    
-    chromium_dirs = list(browsers_dir.glob("chromium-*"))
-    if not chromium_dirs:
-        raise Exception("No Chromium browser found in .playwright-browsers")
-    chromium_path = chromium_dirs[0] / "chrome-win" / "chrome.exe"
-
-    # start playwright
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(
-            headless=False,
-            slow_mo=200,
-            executable_path=str(chromium_path)
-        )
-        context = await browser.new_context(
-            viewport={"width": 1600, "height": 1000}
-        )
-        page = await context.new_page()
-        await page.goto(target_url)
+    run_id = uuid.uuid4().hex
+    run_date = start_time.strftime("%Y-%m-%d")
+    emit("run_started", run_id=run_id, keywords=record_keywords, started_at=start_time.isoformat())
+    metrics = Metrics(
+        "scrap", run_id,
+        keywords=len(keywords),
+        marketplaces=[item.name for item in marketplace_profiles],
+        concurrency=concurrency,
+        default_depth=default_depth,
+        extraction_mode=extraction_mode,
+        direct_urls=direct_urls,
+        shards=shards,
+        distributed=coordinator_address is not None,
+        **profile.to_info(),
+    )
 
-        result = []  # [{"keyword": "自然検索", "SP": "", "SB": ""}, ...]
+    # Every keyword result is committed to the journal as soon as it is produced
+    journal = RunJournal(os.getenv("JOURNAL_FILE") or app_base_dir() / "scrap_journal.sqlite3")
+    journal.start_run(run_id, run_date, start_time.isoformat())
+    results = [None] * len(jobs)
+    if resume is None:
+        resume = read_flag("RESUME", "0")
+    if resume:
+        completed = journal.completed_on(run_date)
+        for index, record_keyword in enumerate(record_keywords):
+            if record_keyword in completed:
+                results[index] = completed[record_keyword]
+                emit("keyword_result", index=index, keyword=record_keyword, result=completed[record_keyword], resumed=True)
+        resumed_count = sum(1 for item in results if item is not None)
+        print(f"再開モード: 本日取得済みの {resumed_count} 件のキーワードをスキップします。")
 
-        for keyword in keywords:
-            organic_products_info = []  # [{"asin": "", "page": ""}, ...]
-            sponsored_products_info = []  # [{"asin": "", "page": ""}, ...]
-            sb_products_info = [] # [{"asins": ["", ""], "page": number}, ...]
-            for page_index in range(1, 3):  # Scrape first 2 pages for each keyword
-                if page_index == 1:
-                    # Input keyword in search box (find input element that placeholder is "Amazon.co.jpを検索")
-                    search_input = page.locator('input[placeholder="Amazon.co.jpを検索"]')
-                    await search_input.fill(keyword)
+    def on_result(index, keyword, result):
+        marketplace_profile, primary = jobs[index][:2]
+        tag_result(result, marketplace_profile, primary)
+        journal.record(run_id, run_date, result["keyword"], result)
+        emit("keyword_result", index=index, keyword=result["keyword"], result=result)
 
-                    # Click enter
-                    await search_input.press("Enter")
+    early_stop = read_flag("EARLY_STOP")
+    tracked_slots = _read_tracked_slots()
+    cache = SerpCache.from_env(app_base_dir())
 
-                # If page_index > 1, navigate to the specific page(find a element that aria-label is "2ページに移動)
-                if page_index > 1:
-                    page_navigator = page.locator(f'a[aria-label="{page_index}ページに移動"]')
-                    if await page_navigator.count() == 0:
-                        print(f"ページ {page_index} が見つかりません。次のキーワードに進みます。")
-                        break
-                    await page_navigator.click()
-
-                await asyncio.sleep(5)  # wait for page load
-
-                # Get product elements (role is "listitem" and each product must have data-asin attribute in it)
-                product_elements = await page.locator('[role="listitem"][data-asin]').all()
-
-                # Get product elements for SB ads (data-asin attribute is existed in it, but it' s "")
-                sb_ad_elements = await page.locator('[data-asin=""]').all()
-                
-                filtered_sb_ad_elements = []
-
-                # Step 1: Cut from "関連検索キーワード"
-                cut_index = None
-                for i, element in enumerate(sb_ad_elements):
-                    element_content = await element.inner_html()
-                    if '<h2 class="a-size-medium-plus a-color-base">関連検索キーワード</h2>' in element_content:
-                        cut_index = i
-                        break
-
-                if cut_index is not None:
-                    sb_ad_elements = sb_ad_elements[:cut_index]
-
-                # Step 2: Remove unwanted <h2> blocks
-                unwanted_blocks = [
-                    '<h2 class="a-size-medium-plus a-spacing-none a-color-base a-text-bold">結果</h2>',
-                    '<h2 id="loom-desktop-inline-slot_featuredasins-heading" class="a-size-medium-plus a-color-base">高評価</h2>',
-                    '<h2 class="a-size-medium-plus a-spacing-none a-color-base a-text-bold">その他の結果</h2>',
-                    '<h2 id="loom-desktop-bottom-slot_featuredasins-heading" class="a-size-medium-plus a-color-base">開催中のタイムセール</h2>',
-                    '<h2 id="loom-desktop-inline-slot_featuredasins-heading" class="a-size-medium-plus a-color-base">今のトレンド</h2>',
-                ]
-
-                for element in sb_ad_elements:
-                    element_content = await element.inner_html()
-                    if any(block in element_content for block in unwanted_blocks):
-                        continue
-                    filtered_sb_ad_elements.append(element)
-
-                for product_element in product_elements:
-                    asin = await product_element.get_attribute("data-asin")
-
-                    element_content = await product_element.inner_html()
-                    if "スポンサー" in element_content:
-                        sponsored_products_info.append({
-                            "asin": asin,
-                            "page": page_index
-                        })
-                    else:
-                        organic_products_info.append({
-                            "asin": asin,
-                            "page": page_index
-                        })
-
-                asin_pattern = re.compile(r'B0[A-Z0-9]{8}')
-                for element in filtered_sb_ad_elements:
-                    element_content = await element.inner_html()
-                    asins = asin_pattern.findall(element_content)
-                    asins = list(set(asins))  # remove duplicates
-                    if asins:
-                        sb_products_info.append({
-                            "asins": asins,
-                            "page": page_index
-                        })
-                await asyncio.sleep(3)
-            
-            
-            gotRankedForOrganic = False
-            gotProductForOrganic = {}  # {"asin": "", "page": number, "rank": number}
-
-            for index, product in enumerate(organic_products_info, start=1):
-                ASIN = product["asin"]
-
-                if ASIN not in target_asins:
-                    continue
-                gotRankedForOrganic = True
-                gotProductForOrganic = {
-                    "asin": ASIN,
-                    "page": product["page"],
-                    "rank": index
-                }
-                break
+    # Each marketplace has one queue of (index, keyword, depth); its workers own tabs in its context.
+    # Results are stored by index so the output keeps the keywords.csv order (per marketplace).
+    # Keywords whose pages are all in the SERP cache are ranked here without the browser.
+    queues = {marketplace_profile.name: asyncio.Queue() for marketplace_profile in marketplace_profiles}
+    for index, (marketplace_profile, _, keyword, keyword_depth) in enumerate(jobs):
+        if results[index] is not None:
+            continue
+        cached = None
+        if cache is not None:
+            with metrics.span("cache_lookup", keyword=keyword) as counts:
+                cached = rank_from_cache(cache, marketplace_profile.host, keyword, keyword_depth, target_asins, early_stop, tracked_slots)
+                counts["hits"] = int(cached is not None)
+        if cached is not None:
+            results[index] = cached
+            on_result(index, keyword, cached)
+        else:
+            queues[marketplace_profile.name].put_nowait((index, keyword, keyword_depth))
+    lanes = [(marketplace_profile, queues[marketplace_profile.name]) for marketplace_profile in marketplace_profiles]
+    # Shards and distributed runs only ever have the one marketplace
+    queue = lanes[0][1]
+    readiness = PageReadiness(wait_strategy=profile.wait_strategy)
+    scheduler = RequestScheduler.from_env(concurrency * len(marketplace_profiles))
+    blocker = None
+    state_store = None
 
-            gotRankedForSponsored = False
-            gotProductForSponsored = {}  # {"asin": "", "page": number, "rank": number}
-
-            for index, product in enumerate(sponsored_products_info, start=1):
-                ASIN = product["asin"]
-                if ASIN not in target_asins:
-                    continue
-                gotRankedForSponsored = True
-                gotProductForSponsored = {
-                    "asin": ASIN,
-                    "page": product["page"],
-                    "rank": index
-                }
-                break
+    try:
+        if all(lane_queue.empty() for _, lane_queue in lanes):
+            print("取得が必要なキーワードはありません。")
+        elif coordinator_address is not None:
+            items = []
+            while not queue.empty():
+                items.append(queue.get_nowait())
 
-            gotRankedForSB = False
-            gotProductForSB = {}  # {"asin": "", "page": number, "rank": number}
+            def on_remote_result(index, keyword, result):
+                results[index] = result
+                on_result(index, keyword, result)
 
-            for index, product in enumerate(sb_products_info, start=1):
-                ASINS = product["asins"]  # list of ASINs in this SB ad
-                
-                found_asin = next((a for a in ASINS if a in target_asins), None)
+            def on_remote_metrics(worker, spans):
+                for span in spans:
+                    metrics.record(span["name"], span["seconds"], {**span["labels"], "worker": worker}, span["counts"])
 
-                if not found_asin:
-                    continue  # no matching target ASIN in this SB block
+            host, port = coordinator_address
+            coordinator = DistributedCoordinator(
+                items, on_remote_result,
+                host=host,
+                port=port,
+                run_id=run_id,
+                target_url=marketplace_profiles[0].base_url,
+                target_asins=target_asins,
+                on_metrics=on_remote_metrics,
+            )
+            await coordinator.run()
+            metrics.set_info(distributed_workers=len(coordinator.workers), expired_leases=coordinator.expired)
+        elif shards > 1:
+            items = []
+            while not queue.empty():
+                items.append(queue.get_nowait())
+            shards = min(shards, len(items))
+            print(f"シャード数: {shards}（ワーカーごとの同時実行数: {concurrency}）")
 
-                gotRankedForSB = True
-                gotProductForSB = {
-                    "asin": found_asin,     # store the first matching ASIN
-                    "page": product["page"],
-                    "rank": index
-                }
-                break
-            
-            # Format results for output
-            organic_result = "-"
-            if gotRankedForOrganic:
-                if gotProductForOrganic["page"] == 1:
-                    organic_result = str(gotProductForOrganic["rank"])
-                else:
-                    organic_result = "2ページ目"
+            def on_shard_result(index, keyword, result):
+                results[index] = result
+                on_result(index, keyword, result)
 
-            sponsored_result = "-"
-            if gotRankedForSponsored:
-                if gotProductForSponsored["page"] == 1:
-                    sponsored_result = str(gotProductForSponsored["rank"])
-                else:
-                    sponsored_result = "2ページ目"
+            def on_shard_metrics(shard, spans):
+                for span in spans:
+                    metrics.record(span["name"], span["seconds"], {**span["labels"], "shard": shard}, span["counts"])
 
-            sb_result = "-"
-            if gotRankedForSB:
-                if gotProductForSB["page"] == 1:
-                    sb_result = str(gotProductForSB["rank"])
-                else:
-                    sb_result = "2ページ目"
+            coordinator = ShardCoordinator(
+                items, on_shard_result,
+                shards=shards,
+                command=_shard_worker_command(concurrency, profile),
+                # Small batches keep fast workers busy while a slow one finishes its share
+                batch_size=concurrency * 2,
+                on_metrics=on_shard_metrics,
+            )
+            await coordinator.run()
+            metrics.set_info(shard_restarts=coordinator.restarts, shard_stolen_keywords=coordinator.stolen)
+        else:
+            session = await _run_workers(
+                session, lanes, results, readiness, on_result,
+                target_asins=target_asins,
+                concurrency=concurrency,
+                default_depth=default_depth,
+                page_parallelism=page_parallelism,
+                extraction_mode=extraction_mode,
+                direct_urls=direct_urls,
+                early_stop=early_stop,
+                tracked_slots=tracked_slots,
+                cache=cache,
+                metrics=metrics,
+                profile=profile,
+                scheduler=scheduler,
+            )
+            blocker = session.blocker
+            state_store = session.state_store
+    finally:
+        journal.finish_run(run_id, datetime.now(jst).isoformat())
+        journal.close()
+        if cache is not None:
+            cache.close()
 
-            print(f"キーワード： {keyword}, 自然検索: {organic_result}, SP: {sponsored_result}, SB: {sb_result}")
+    result = [item for item in results if item is not None]  # [{"keyword": "自然検索", "SP": "", "SB": ""}, ...]
 
-            result.append({
-                "keyword": keyword,
-                "自然検索": organic_result,
-                "SP": sponsored_result,
-                "SB": sb_result
-            })
+    # One transaction per run into the local rank history (trend queries, sheet row lookup)
+    history = RankHistory(history_path(app_base_dir()))
+    try:
+        history.record_run(run_id, run_date, result, target_asins)
+    finally:
+        history.close()
 
-        await browser.close()
-        # --- finish time ---
-        print("スクレイピングが完了しました。")
-        finish_time = datetime.now(jst)
-        print(f"終了時刻: {finish_time.strftime('%Y-%m-%d, %H:%M:%S')}")
+    # --- finish time ---
+    print("スクレイピングが完了しました。")
+    finish_time = datetime.now(jst)
+    print(f"終了時刻: {finish_time.strftime('%Y-%m-%d, %H:%M:%S')}")
 
-        # --- execution time ---
-        execution_time = finish_time - start_time
-        print(f"実行時間: {execution_time}", flush=True)
+    # --- execution time ---
+    execution_time = finish_time - start_time
+    print(f"実行時間: {execution_time}")
 
-        # 結果をJSONとして出力（app.pyが読み取るため）
-        if result:
-            print(f"RESULT_DATA:{json.dumps(result, ensure_ascii=False)}", flush=True)
-        
-        return result
+    # --- readiness wait times ---
+    print("待機時間の内訳:")
+    for line in readiness.timings.summary_lines():
+        print(line)
+    if blocker is not None:
+        print("リソース遮断:")
+        for line in blocker.summary_lines():
+            print(line)
+    if cache is not None:
+        print("検索結果キャッシュ:")
+        for line in cache.summary_lines():
+            print(line)
+    if state_store is not None:
+        print("セッションの保存:")
+        for line in state_store.summary_lines():
+            print(line)
+        metrics.set_info(sessions_restored=state_store.restored, sessions_saved=state_store.refreshed)
+    if scheduler is not None:
+        print("ペース配分:")
+        for line in scheduler.summary_lines():
+            print(line)
+        metrics.set_info(**scheduler.to_info())
 
+    # --- per-phase spans ---
+    metrics.set_info(
+        completed=len(result),
+        errors=len(jobs) - len(result),
+        seconds=round(execution_time.total_seconds(), 3),
+        pages=readiness.timings.pages,
+    )
+    if blocker is not None:
+        metrics.set_info(received_bytes=blocker.received_bytes, blocked_requests=sum(blocker.blocked_requests.values()))
+    print("処理時間の内訳:")
+    for line in metrics.summary_lines():
+        print(line)
+    try:
+        metrics_path = metrics.write(app_base_dir())
+        if metrics_path is not None:
+            print(f"メトリクスを書き出しました: {metrics_path}")
+    except OSError as e:
+        print(f"メトリクスの書き出しに失敗しました: {e}")
+    sys.stdout.flush()
 
-if __name__ == "__main__":
+    emit(
+        "run_finished",
+        run_id=run_id,
+        count=len(result),
+        errors=len(jobs) - len(result),
+        seconds=round(execution_time.total_seconds(), 3),
+    )
+
+    # 結果をまとめてJSONとしても出力（イベントに対応していない読み取り側のため）
+    if result:
+        print(f"RESULT_DATA:{json.dumps(result, ensure_ascii=False)}", flush=True)
+
+    return result
+
+
+def build_arg_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("--spreadsheet-id", help="Google Spreadsheet ID")
     parser.add_argument("--sheet", help="Sheet name")
-    args = parser.parse_args()
-    
-    asyncio.run(scraping(args.spreadsheet_id, args.sheet))
\ No newline at end of file
+    parser.add_argument("--concurrency", type=int, help="Number of pages scraping keywords in parallel (default: CONCURRENCY or 1)")
+    parser.add_argument("--depth", type=int, help=f"Result pages to scrape per keyword, 1-{MAX_SEARCH_DEPTH} (default: SEARCH_DEPTH or {DEFAULT_SEARCH_DEPTH})")
+    parser.add_argument("--resume", action="store_true", default=None, help="Skip keywords already recorded in today's journal (default: RESUME)")
+    parser.add_argument("--keywords-file", help="Keywords CSV to scrape (default: KEYWORDS_FILE)")
+    parser.add_argument("--profile", choices=PROFILE_NAMES, help="Run profile (default: RUN_PROFILE or interactive)")
+    parser.add_argument("--shards", type=int, help="Worker processes, each with its own browser (default: SHARDS or 1)")
+    parser.add_argument("--shard-worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--marketplaces", help="Comma-separated marketplaces searched in parallel, e.g. jp,us (default: MARKETPLACES or the TARGET_URL marketplace)")
+    parser.add_argument("--coordinator-port", type=int, help="Hand keywords to distributed.py workers on this port instead of running a browser (default: COORDINATOR_PORT)")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+
+    if args.shard_worker:
+        asyncio.run(run_shard_worker(args.concurrency, args.profile))
+    else:
+        asyncio.run(scraping(args.spreadsheet_id, args.sheet, args.concurrency, args.depth, resume=args.resume, keywords_file=args.keywords_file,
+                             profile=args.profile, shards=args.shards, coordinator_port=args.coordinator_port,
+                             marketplaces=args.marketplaces))
@@ -0,0 +1,155 @@
+"""
+常駐スクレイパーサーバー。
+Chromium とブラウザコンテキストを起動したまま保持し、ローカルの TCP ソケットで
+ジョブを受け付ける。実行中のログは scrap.py を直接実行した場合と同じ行形式で
+クライアント（app.py）へ逐次送り返し、最後に終了コードを SCRAP_EXIT:<code> で送る。
+
+起動方法:
+    python scrap_server.py
+    AmazonRankingTool.exe --run-scrap-server（exe の場合）
+
+リクエスト（1行の JSON）:
+    {"spreadsheet_id": "...", "sheet": "...", "concurrency": 4, "depth": 2, "resume": false,
+     "keywords_file": "...", "profile": "throughput"}
+
+ジョブは1件ずつ実行する。実行中に届いたジョブには SCRAP_BUSY の1行だけを返して切断する
+（実行中のジョブの print() の出力先を切り替えているため、同時に2件目を受け付けると出力が混ざる）。
+
+ブラウザは RUN_PROFILE のプロファイルで起動し、ジョブが表示やサイズの異なる
+プロファイルを指定した場合は、そのプロファイルで起動し直す。
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import traceback
+from dotenv import load_dotenv
+from run_profiles import get_profile
+from scrap import BrowserSession, scraping
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+EXIT_PREFIX = "SCRAP_EXIT:"
+BUSY_LINE = "SCRAP_BUSY"
+
+
+def server_address():
+    """SCRAP_SERVER_HOST / SCRAP_SERVER_PORT から待ち受けアドレスを返す。"""
+    host = os.getenv("SCRAP_SERVER_HOST", DEFAULT_HOST)
+    try:
+        port = int(os.getenv("SCRAP_SERVER_PORT", DEFAULT_PORT))
+    except ValueError:
+        port = DEFAULT_PORT
+    return host, port
+
+
+class _SocketTextIO(io.TextIOBase):
+    """print() の出力をクライアントのソケットへ流すためのテキストストリーム。"""
+
+    def __init__(self, writer):
+        self._writer = writer
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if not self._writer.is_closing():
+            self._writer.write(text.encode("utf-8"))
+        return len(text)
+
+
+class ScrapServer:
+    """ブラウザを起動したまま、受け付けたジョブを1件ずつ順に実行する。"""
+
+    def __init__(self):
+        self.session = BrowserSession()
+        # print() is redirected per job, so jobs must not overlap
+        self._job_lock = asyncio.Lock()
+
+    def _log(self, message):
+        # Server messages go to the console even while a job has sys.stdout
+        print(message, file=sys.__stdout__, flush=True)
+
+    async def _ensure_session(self, profile=None):
+        if profile is not None and profile.browser_key() != self.session.profile.browser_key():
+            # headless / slow_mo / viewport are fixed at launch
+            print(f"実行プロファイル {profile.name} でブラウザを起動し直します。", flush=True)
+            await self.session.close()
+            self.session = BrowserSession(profile)
+        if not self.session.is_alive():
+            if self.session.browser is not None:
+                print("ブラウザが終了していたため、再起動します。", flush=True)
+                await self.session.close()
+            await self.session.start()
+
+    async def handle_client(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            job = json.loads(request_line.decode("utf-8"))
+            if self._job_lock.locked():
+                # Reject instead of queueing: the running job owns sys.stdout until it finishes
+                writer.write(f"{BUSY_LINE}\n".encode("utf-8"))
+                await writer.drain()
+                self._log("実行中のジョブがあるため、新しいジョブを断りました。")
+                return
+            stream = _SocketTextIO(writer)
+
+            async with self._job_lock:
+                exit_code = 0
+                with contextlib.redirect_stdout(stream):
+                    try:
+                        profile = get_profile(job.get("profile"))
+                        await self._ensure_session(profile)
+                        await scraping(
+                            job.get("spreadsheet_id"),
+                            job.get("sheet"),
+                            job.get("concurrency"),
+                            job.get("depth"),
+                            session=self.session,
+                            resume=job.get("resume"),
+                            keywords_file=job.get("keywords_file"),
+                            profile=profile,
+                            marketplaces=job.get("marketplaces"),
+                        )
+                    except Exception:
+                        traceback.print_exc(file=stream)
+                        exit_code = 1
+                print(f"{EXIT_PREFIX}{exit_code}", file=stream, flush=True)
+                await writer.drain()
+        except (ConnectionError, json.JSONDecodeError) as e:
+            self._log(f"ジョブの受信に失敗しました: {e}")
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        await self._ensure_session()
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print(f"常駐スクレイパーを起動しました: {host}:{port}", flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.session.close()
+
+
+def main(argv=None):
+    load_dotenv()
+    host, port = server_address()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--run-scrap-server", action="store_true")
+    parser.add_argument("--host", default=host)
+    parser.add_argument("--port", type=int, default=port)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(ScrapServer().serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
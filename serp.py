@@ -0,0 +1,180 @@
+"""
+検索結果ページ（SERP）のスナップショット取得と分類。
+ブラウザからは1回の page.evaluate で必要最小限のデータだけを取り出すか、
+page.content() の HTML をプロセスプールで解析してスナップショットを作り、
+自然検索・SP・SB の振り分けは Python 側で行う。
+スポンサーの目印・SB の除外見出しなどの判定ルールは serp_rules.json（serp_rules.py）にある。
+"""
+from bs4 import BeautifulSoup
+from serp_rules import get_rules
+
+# Ranking slots, in the column order of the sheet
+SLOTS = ("自然検索", "SP", "SB")
+
+# Runs inside the page and returns everything the classifier needs in one round trip:
+# {"products": [{"asin": "", "sponsored": bool}, ...],
+#  "blocks": [{"headers": ["<h2 ...>...</h2>", ...], "asins": ["B0...", ...]}, ...]}
+SNAPSHOT_JS = """
+([sponsoredPattern, asinPattern]) => {
+    const sponsored = new RegExp(sponsoredPattern);
+    const products = Array.from(
+        document.querySelectorAll('[role="listitem"][data-asin]'),
+        (el) => ({
+            asin: el.getAttribute("data-asin"),
+            sponsored: sponsored.test(el.innerHTML),
+        })
+    );
+    const pattern = new RegExp(asinPattern, "g");
+    const blocks = Array.from(
+        document.querySelectorAll('[data-asin=""]'),
+        (el) => ({
+            headers: Array.from(el.querySelectorAll("h2"), (h2) => h2.outerHTML),
+            asins: Array.from(new Set(el.innerHTML.match(pattern) || [])),
+        })
+    );
+    return { products, blocks };
+}
+"""
+
+
+# Amazon's robot check ("文字を入力してください" with a validateCaptcha form)
+BOT_CHECK_JS = """
+() => Boolean(document.querySelector('form[action*="validateCaptcha"], #captchacharacters'))
+"""
+
+
+async def is_bot_check(page):
+    """現在のページがボットチェック（CAPTCHA）なら True を返す。"""
+    return await page.evaluate(BOT_CHECK_JS)
+
+
+# Amazon's "no results" message (the texts are no_results_markers in serp_rules.json)
+NO_RESULTS_JS = """
+(pattern) => new RegExp(pattern).test(document.body ? document.body.innerText : "")
+"""
+
+
+async def is_no_results(page, marketplace=None):
+    """現在のページが「検索に一致する商品はありません」の表示なら True を返す。"""
+    return await page.evaluate(NO_RESULTS_JS, get_rules(marketplace).no_results_pattern)
+
+
+async def take_snapshot(page, marketplace=None):
+    """現在のページから SERP スナップショットを1回の呼び出しで取得する。"""
+    rules = get_rules(marketplace)
+    return await page.evaluate(SNAPSHOT_JS, [rules.sponsored_pattern, rules.asin_pattern])
+
+
+def parse_serp_html(html, marketplace=None):
+    """page.content() の HTML から take_snapshot と同じ形式のスナップショットを作る。
+
+    プロセスプール上で実行されるため、引数・戻り値は pickle 可能な値のみ。
+    """
+    rules = get_rules(marketplace)
+    soup = BeautifulSoup(html, "lxml")
+
+    products = []
+    for element in soup.select('[role="listitem"][data-asin]'):
+        products.append({
+            "asin": element.get("data-asin"),
+            "sponsored": rules.is_sponsored(element.decode_contents()),
+        })
+
+    blocks = []
+    for element in soup.select('[data-asin=""]'):
+        blocks.append({
+            "headers": [str(h2) for h2 in element.find_all("h2")],
+            "asins": list(dict.fromkeys(rules.asin_re.findall(element.decode_contents()))),  # remove duplicates, keep order
+        })
+
+    return {"products": products, "blocks": blocks}
+
+
+def classify_snapshot(snapshot, page_index, marketplace=None):
+    """スナップショットを自然検索・SP・SB のリストに振り分ける。"""
+    rules = get_rules(marketplace)
+    organic = []  # [{"asin": "", "page": number}, ...]
+    sponsored = []  # [{"asin": "", "page": number}, ...]
+    sb = []  # [{"asins": ["", ""], "page": number}, ...]
+
+    for product in snapshot["products"]:
+        entry = {"asin": product["asin"], "page": page_index}
+        if product["sponsored"]:
+            sponsored.append(entry)
+        else:
+            organic.append(entry)
+
+    for block in snapshot["blocks"]:
+        # One scan of the headings: cut from "関連検索キーワード", skip unwanted <h2> blocks
+        kind = rules.block_kind(block["headers"])
+        if kind == "cut":
+            break
+        if kind == "excluded":
+            continue
+        if block["asins"]:
+            sb.append({"asins": block["asins"], "page": page_index})
+
+    return organic, sponsored, sb
+
+
+def rank_targets(organic, sponsored, sb, target_asins):
+    """全ページの結果を1回ずつ走査し、各ターゲット ASIN の枠ごとの最上位順位を求める。
+
+    target_asins は set / frozenset を渡すこと（ASIN ごとの判定が O(1) になる）。
+    戻り値: {"自然検索": {asin: {"rank": number, "page": number}}, "SP": {...}, "SB": {...}}
+    """
+    ranks = {slot: {} for slot in SLOTS}
+
+    for slot, products in (("自然検索", organic), ("SP", sponsored)):
+        slot_ranks = ranks[slot]
+        for index, product in enumerate(products, start=1):
+            asin = product["asin"]
+            if asin in target_asins and asin not in slot_ranks:
+                slot_ranks[asin] = {"rank": index, "page": product["page"]}
+
+    # Every target ASIN in an SB block gets the rank of that block
+    sb_ranks = ranks["SB"]
+    for index, block in enumerate(sb, start=1):
+        for asin in block["asins"]:
+            if asin in target_asins and asin not in sb_ranks:
+                sb_ranks[asin] = {"rank": index, "page": block["page"]}
+
+    return ranks
+
+
+class SerpRanking:
+    """1つのキーワードの分類結果をページ順に蓄積し、途中経過の順位を求める。"""
+
+    def __init__(self, target_asins, marketplace=None):
+        self.target_asins = target_asins
+        self.marketplace = marketplace
+        self.organic = []  # [{"asin": "", "page": number}, ...]
+        self.sponsored = []  # [{"asin": "", "page": number}, ...]
+        self.sb = []  # [{"asins": ["", ""], "page": number}, ...]
+        self.pages = 0
+
+    def add_snapshot(self, snapshot, page_index):
+        organic, sponsored, sb = classify_snapshot(snapshot, page_index, self.marketplace)
+        self.organic.extend(organic)
+        self.sponsored.extend(sponsored)
+        self.sb.extend(sb)
+        self.pages = page_index
+
+    def ranks(self):
+        return rank_targets(self.organic, self.sponsored, self.sb, self.target_asins)
+
+    def is_complete(self, slots=SLOTS):
+        """すべてのターゲット ASIN が slots のすべての枠で見つかっていれば True を返す。"""
+        if not self.target_asins:
+            return False
+        ranks = self.ranks()
+        return all(len(ranks[slot]) == len(self.target_asins) for slot in slots)
+
+
+def best_rank(slot_ranks):
+    """枠内で最も順位の高いターゲット ASIN の {"asin", "rank", "page"} を返す（無ければ None）。"""
+    best = None
+    for asin, entry in slot_ranks.items():
+        if best is None or entry["rank"] < best["rank"]:
+            best = {"asin": asin, **entry}
+    return best
@@ -0,0 +1,171 @@
+"""
+検索結果ページのスナップショットのキャッシュ（SQLite）。
+
+キーは (マーケットプレイス, キーワード, ページ番号)。保存するのは ASIN の分類に使う
+スナップショット（serp.take_snapshot と同じ形）なので、ターゲット ASIN が変わっても
+ブラウザを使わずに順位を求め直せる。
+
+- SERP_CACHE_TTL 秒を過ぎたエントリは使わない（0 でキャッシュ無効）
+- SERP_CACHE_MAX_ENTRIES 件を超えたら、最後に使われた時刻が古いものから削除する（LRU。保存 EVICT_EVERY 件ごとと終了時に確認する）
+- シャードのワーカープロセスが同じファイルを共有するため、ロック待ちは BUSY_TIMEOUT_SECONDS 秒まで。
+  それでも読み書きに失敗した場合はキャッシュを使わなかったものとして続ける（キーワードの取得は失敗させない）。
+  ファイル自体を開けない場合はキャッシュなしで実行する
+"""
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from env import read_int
+
+DEFAULT_TTL_SECONDS = 600
+DEFAULT_MAX_ENTRIES = 5000
+EVICT_EVERY = 100
+BUSY_TIMEOUT_SECONDS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS serp_snapshots (
+    marketplace TEXT NOT NULL,
+    keyword TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    snapshot_json TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (marketplace, keyword, page)
+);
+CREATE INDEX IF NOT EXISTS idx_serp_snapshots_accessed ON serp_snapshots (accessed_at);
+"""
+
+# Stored for a page that does not exist, so a short result list is still a complete hit
+MISSING_PAGE = {"products": [], "blocks": [], "missing": True}
+
+
+class SerpCache:
+    """TTL と LRU で管理するスナップショットのキャッシュ。ヒット・ミスの件数を数える。"""
+
+    def __init__(self, path, ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = str(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self.conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS)
+        try:
+            self.conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_SECONDS * 1000}")
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+        except sqlite3.Error:
+            self.conn.close()
+            raise
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.stores = 0
+        self.errors = 0
+        try:
+            with self.conn:
+                self.conn.execute("DELETE FROM serp_snapshots WHERE fetched_at < ?", (time.time() - self.ttl_seconds,))
+        except sqlite3.Error as e:
+            self._failed(e)
+
+    @classmethod
+    def from_env(cls, base_dir):
+        """環境変数から設定を読み込む。SERP_CACHE_TTL=0 の場合と、ファイルを開けない場合は None を返す。"""
+        ttl_seconds = read_int("SERP_CACHE_TTL", DEFAULT_TTL_SECONDS)
+        if ttl_seconds == 0:
+            return None
+        path = os.getenv("SERP_CACHE_FILE") or Path(base_dir) / "serp_cache.sqlite3"
+        try:
+            return cls(path, ttl_seconds, read_int("SERP_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+        except sqlite3.Error as e:
+            # A locked, corrupt or read-only cache file must not stop the run
+            print(f"検索結果キャッシュを開けませんでした（キャッシュを使わずに続けます）: {path}: {e}")
+            return None
+
+    def _failed(self, error):
+        self.errors += 1
+        if self.errors == 1:
+            print(f"検索結果キャッシュの読み書きに失敗しました（キャッシュを使わずに続けます）: {error}")
+
+    def get(self, marketplace, keyword, page):
+        """有効なスナップショットを返す。無い・期限切れ・読み込みに失敗した場合は None。"""
+        try:
+            return self._get(marketplace, keyword, page)
+        except sqlite3.Error as e:
+            self._failed(e)
+            self.misses += 1
+            return None
+
+    def _get(self, marketplace, keyword, page):
+        row = self.conn.execute(
+            "SELECT snapshot_json, fetched_at FROM serp_snapshots WHERE marketplace = ? AND keyword = ? AND page = ?",
+            (marketplace, keyword, page),
+        ).fetchone()
+        now = time.time()
+        if row is None or now - row[1] > self.ttl_seconds:
+            if row is not None:
+                self.expired += 1
+                with self.conn:
+                    self.conn.execute(
+                        "DELETE FROM serp_snapshots WHERE marketplace = ? AND keyword = ? AND page = ?",
+                        (marketplace, keyword, page),
+                    )
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self.conn:
+            self.conn.execute(
+                "UPDATE serp_snapshots SET accessed_at = ? WHERE marketplace = ? AND keyword = ? AND page = ?",
+                (now, marketplace, keyword, page),
+            )
+        return json.loads(row[0])
+
+    def put(self, marketplace, keyword, page, snapshot):
+        """スナップショットを保存する。保存に失敗してもエラーにはしない。"""
+        now = time.time()
+        try:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO serp_snapshots "
+                    "(marketplace, keyword, page, snapshot_json, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (marketplace, keyword, page, json.dumps(snapshot, ensure_ascii=False), now, now),
+                )
+            self.stores += 1
+            # Counting the table on every put is a full scan; check the size now and then
+            if self.stores % EVICT_EVERY == 0:
+                self._evict()
+        except sqlite3.Error as e:
+            self._failed(e)
+
+    def _evict(self):
+        """件数が上限を超えていれば、最後に使われた時刻が古いものから削除する。"""
+        with self.conn:
+            count = self.conn.execute("SELECT COUNT(*) FROM serp_snapshots").fetchone()[0]
+            if count > self.max_entries:
+                # Least recently used entries go first
+                cursor = self.conn.execute(
+                    "DELETE FROM serp_snapshots WHERE rowid IN "
+                    "(SELECT rowid FROM serp_snapshots ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+                self.evictions += cursor.rowcount
+
+    def put_missing(self, marketplace, keyword, page):
+        """存在しないページを記録する（キャッシュから順位を求めるときはそこで打ち切る）。"""
+        self.put(marketplace, keyword, page, MISSING_PAGE)
+
+    def summary_lines(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups else 0.0
+        return [
+            f"  ヒット: {self.hits}件, ミス: {self.misses}件（うち期限切れ {self.expired}件）, ヒット率: {hit_rate:.1f}%",
+            f"  保存: {self.stores}件, 削除（LRU）: {self.evictions}件, 有効期間: {self.ttl_seconds}秒"
+            + (f", 読み書きの失敗: {self.errors}件" if self.errors else ""),
+        ]
+
+    def close(self):
+        try:
+            self._evict()
+        except sqlite3.Error as e:
+            self._failed(e)
+        self.conn.close()
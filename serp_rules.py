@@ -0,0 +1,179 @@
+"""
+検索結果ページの分類ルール（serp_rules.json）の読み込みとコンパイル。
+
+ルールファイル（SERP_RULES_FILE、省略時は serp_rules.json）:
+    asin_pattern       ASIN の正規表現
+    sponsored_markers  商品カードの HTML にこの文字列があればスポンサー（SP）
+    cut_markers        SB 候補の見出しにこの文字列があれば、以降のブロックは SB として扱わない
+    excluded_blocks    SB 候補の見出しにこの文字列があれば、そのブロックは SB ではない
+    no_results_markers ページの本文にこの文字列があれば「検索に一致する商品が無い」ページ（読み込みのタイムアウトと区別する）
+    marketplaces       マーケットプレイス（ホスト名）ごとの上書き（例: {"www.amazon.com": {"sponsored_markers": ["Sponsored"]}}）
+
+文字列の一覧はそれぞれ1つの正規表現にまとめてコンパイルし、見出しや HTML を1回の走査で判定する。
+ファイルの更新時刻が変わると次の判定から読み込み直す（Amazon のマークアップ変更に再起動なしで対応）。
+読み込みに失敗した場合は、直前のルール（初回は組み込みのルール）を使い続ける。
+"""
+import json
+import os
+import re
+import sys
+import threading
+from pathlib import Path
+
+DEFAULT_RULES = {
+    "asin_pattern": r"B0[A-Z0-9]{8}",
+    # Product cards containing this text are Sponsored Products
+    "sponsored_markers": ["スポンサー"],
+    # SB candidates after this heading are related-search widgets, not ads
+    "cut_markers": ['<h2 class="a-size-medium-plus a-color-base">関連検索キーワード</h2>'],
+    # Headings of [data-asin=""] blocks that are not SB ads
+    "excluded_blocks": [
+        '<h2 class="a-size-medium-plus a-spacing-none a-color-base a-text-bold">結果</h2>',
+        '<h2 id="loom-desktop-inline-slot_featuredasins-heading" class="a-size-medium-plus a-color-base">高評価</h2>',
+        '<h2 class="a-size-medium-plus a-spacing-none a-color-base a-text-bold">その他の結果</h2>',
+        '<h2 id="loom-desktop-bottom-slot_featuredasins-heading" class="a-size-medium-plus a-color-base">開催中のタイムセール</h2>',
+        '<h2 id="loom-desktop-inline-slot_featuredasins-heading" class="a-size-medium-plus a-color-base">今のトレンド</h2>',
+    ],
+    # Text of the "no results" message, told apart from a page that never finished loading
+    "no_results_markers": ["に一致する商品はありませんでした"],
+    "marketplaces": {},
+}
+
+RULE_KEYS = ("asin_pattern", "sponsored_markers", "cut_markers", "excluded_blocks", "no_results_markers")
+
+
+def _escape(text):
+    # Escapes that mean the same in Python and JavaScript, so the pattern can be sent to the page
+    return re.sub(r"[\\^$.|?*+()\[\]{}/]", lambda match: "\\" + match.group(0), text)
+
+
+def _alternation(markers):
+    """文字列の一覧を1つの正規表現（どれにも一致しない場合は一致しないパターン）にする。"""
+    if not markers:
+        return r"(?!)"
+    # Longest first so a marker that contains another one wins
+    return "|".join(_escape(marker) for marker in sorted(set(markers), key=len, reverse=True))
+
+
+class CompiledRules:
+    """1つのマーケットプレイスのルールをコンパイルしたもの。"""
+
+    def __init__(self, rules):
+        self.asin_pattern = rules["asin_pattern"]
+        self.asin_re = re.compile(self.asin_pattern)
+        self.sponsored_pattern = _alternation(rules["sponsored_markers"])
+        self.sponsored_re = re.compile(self.sponsored_pattern)
+        # One pass over a block's headings answers both questions
+        self.block_re = re.compile(
+            f"(?P<cut>{_alternation(rules['cut_markers'])})|(?P<excluded>{_alternation(rules['excluded_blocks'])})"
+        )
+        self.no_results_pattern = _alternation(rules["no_results_markers"])
+
+    def is_sponsored(self, html):
+        return self.sponsored_re.search(html) is not None
+
+    def block_kind(self, headers):
+        """SB 候補の見出しから "cut"（以降は対象外）・"excluded"（このブロックは対象外）・None（SB）を返す。"""
+        kind = None
+        for match in self.block_re.finditer("\n".join(headers)):
+            if match.lastgroup == "cut":
+                return "cut"
+            kind = "excluded"
+        return kind
+
+
+def _rules_path():
+    override = os.getenv("SERP_RULES_FILE")
+    if override:
+        return Path(override)
+    if getattr(sys, 'frozen', False):
+        return Path(sys.executable).parent / "serp_rules.json"
+    return Path(__file__).parent / "serp_rules.json"
+
+
+def _check(rules, where=""):
+    """マージ済みのルールの型と正規表現を検証する。問題があれば ValueError / re.error を送出する。"""
+    for key in RULE_KEYS[1:]:
+        if not isinstance(rules[key], list) or not all(isinstance(item, str) for item in rules[key]):
+            raise ValueError(f"{where}{key} は文字列のリストにしてください")
+    if not isinstance(rules["asin_pattern"], str):
+        raise ValueError(f"{where}asin_pattern は文字列にしてください")
+    re.compile(rules["asin_pattern"])
+
+
+def _validate(raw):
+    """ルールファイルの内容を検証し、(既定のルール, ホスト名 -> 上書きをマージしたルール) を返す。"""
+    if not isinstance(raw, dict):
+        raise ValueError("ルールファイルの最上位は JSON オブジェクトにしてください")
+    rules = {key: raw.get(key, DEFAULT_RULES[key]) for key in RULE_KEYS}
+    _check(rules)
+    marketplaces = raw.get("marketplaces") or {}
+    if not isinstance(marketplaces, dict):
+        raise ValueError("marketplaces はホスト名をキーにしたオブジェクトにしてください")
+    merged = {}
+    for host, overrides in marketplaces.items():
+        if not isinstance(overrides, dict):
+            raise ValueError(f"marketplaces.{host} はオブジェクトにしてください")
+        # A bad override must reject the whole file, not compile into a pattern that matches everything
+        host_rules = {**rules, **{key: overrides[key] for key in RULE_KEYS if key in overrides}}
+        _check(host_rules, f"marketplaces.{host}.")
+        merged[host.lower()] = host_rules
+    return rules, merged
+
+
+class RuleSet:
+    """ルールファイルを監視し、マーケットプレイスごとにコンパイル済みのルールを返す。"""
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path is not None else None
+        self.mtime = None
+        self.base = dict(DEFAULT_RULES)
+        self.marketplaces = {}
+        self.compiled = {}  # marketplace -> CompiledRules
+        self._lock = threading.Lock()
+
+    def _reload_if_changed(self):
+        path = self.path or _rules_path()
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self.mtime:
+            return
+        self.mtime = mtime
+        if mtime is None:
+            self.base, self.marketplaces = dict(DEFAULT_RULES), {}
+            self.compiled = {}
+            return
+        try:
+            with open(path, "r", encoding="utf-8-sig") as f:
+                base, marketplaces = _validate(json.load(f))
+            compiled = {None: CompiledRules(base)}
+            for host, rules in marketplaces.items():
+                compiled[host] = CompiledRules(rules)
+        except (OSError, ValueError, re.error) as e:
+            print(f"分類ルールの読み込みに失敗しました（{path}）。以前のルールを使います: {e}")
+            return
+        self.base, self.marketplaces, self.compiled = base, marketplaces, compiled
+        print(f"分類ルールを読み込みました: {path}")
+
+    def get(self, marketplace=None):
+        """マーケットプレイス（ホスト名、省略時は既定）のコンパイル済みルールを返す。"""
+        with self._lock:
+            self._reload_if_changed()
+            key = (marketplace or "").lower() or None
+            if key not in self.marketplaces:
+                key = None
+            rules = self.compiled.get(key)
+            if rules is None:
+                rules = CompiledRules(self.marketplaces.get(key, self.base))
+                self.compiled[key] = rules
+            return rules
+
+
+_rule_set = RuleSet()
+
+
+def get_rules(marketplace=None):
+    """プロセス共通のルールセットから、マーケットプレイスのルールを返す。"""
+    return _rule_set.get(marketplace)
@@ -0,0 +1,125 @@
+"""
+ブラウザのセッション（Cookie・ローカルストレージ）の保存と再利用。
+
+実行のたびに新しいブラウザコンテキストでトップページを開き、Cookie・お届け先・同意状態を作り直す代わりに、
+Playwright の storage_state を (実行プロファイル, マーケットプレイス) ごとに保存し、次の起動時に読み込む。
+お届け先によって変わる順位も、実行をまたいで揃う。
+
+- 保存先は SESSION_STATE_DIR（省略時は session_state/）の <プロファイル>_<マーケットプレイス>.json
+- 保存から SESSION_STATE_MAX_AGE 秒（省略時は 12 時間）を過ぎたもの、マーケットプレイスの
+  session-id Cookie が無い・期限切れのものは使わない（トップページを開き直して保存し直す）
+- ボットチェックが出た実行のセッションは保存せず、保存済みのものも削除する
+- SESSION_STATE=0 で無効
+"""
+import json
+import os
+import re
+import tempfile
+import time
+from pathlib import Path
+from env import read_flag, read_int
+
+DEFAULT_MAX_AGE_SECONDS = 12 * 60 * 60
+# Amazon's session cookie; without a live one the saved state is no better than a cold start
+SESSION_COOKIE = "session-id"
+# Treat a cookie that expires within this many seconds as already expired
+EXPIRY_MARGIN_SECONDS = 60
+
+
+def _domain_matches(host, domain):
+    domain = domain.lstrip(".").lower()
+    return host == domain or host.endswith("." + domain)
+
+
+class SessionStateStore:
+    """storage_state の JSON ファイルを (実行プロファイル, マーケットプレイス) ごとに保存・検証する。"""
+
+    def __init__(self, directory, max_age_seconds=DEFAULT_MAX_AGE_SECONDS):
+        self.directory = Path(directory)
+        self.max_age_seconds = max_age_seconds
+        self.reset_counters()
+
+    def reset_counters(self):
+        """復元・作り直しの件数を 0 に戻す（常駐ブラウザでは実行の開始ごとに呼ばれる）。"""
+        self.restored = 0
+        self.refreshed = 0
+
+    @classmethod
+    def from_env(cls, base_dir):
+        """環境変数から設定を読み込む。SESSION_STATE=0 の場合は None を返す。"""
+        if not read_flag("SESSION_STATE"):
+            return None
+        directory = os.getenv("SESSION_STATE_DIR") or Path(base_dir) / "session_state"
+        return cls(directory, read_int("SESSION_STATE_MAX_AGE", DEFAULT_MAX_AGE_SECONDS))
+
+    def path(self, run_profile, marketplace_profile):
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{run_profile.name}_{marketplace_profile.name}")
+        return self.directory / f"{name}.json"
+
+    def load(self, run_profile, marketplace_profile):
+        """有効な storage_state（dict）を返す。無い・古い・壊れている場合は None。"""
+        path = self.path(run_profile, marketplace_profile)
+        try:
+            age = time.time() - path.stat().st_mtime
+            if age > self.max_age_seconds:
+                print(f"保存済みのセッションが古いため、作り直します（{marketplace_profile.name}）。")
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"保存済みのセッションを読み込めませんでした（{path}）: {e}")
+            return None
+        if not self.is_valid(state, marketplace_profile.host):
+            print(f"保存済みのセッションの Cookie が期限切れのため、作り直します（{marketplace_profile.name}）。")
+            return None
+        self.restored += 1
+        return state
+
+    def is_valid(self, state, host):
+        """マーケットプレイスの session-id Cookie が期限内なら True。"""
+        if not isinstance(state, dict) or not isinstance(state.get("cookies"), list):
+            return False
+        now = time.time()
+        for cookie in state["cookies"]:
+            if cookie.get("name") != SESSION_COOKIE or not _domain_matches(host, cookie.get("domain", "")):
+                continue
+            expires = cookie.get("expires", -1)
+            # -1 is a session cookie: valid for as long as the saved state is
+            if expires == -1 or expires > now + EXPIRY_MARGIN_SECONDS:
+                return True
+        return False
+
+    def save(self, run_profile, marketplace_profile, state):
+        """storage_state を書き出す（書き込み途中のファイルを読まないように置き換える）。
+
+        一時ファイルは毎回別の名前にする（同じプロファイルを保存する複数のプロセスが書き込み先を取り合わないように）。
+        """
+        path = self.path(run_profile, marketplace_profile)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        temp_path = None
+        try:
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=path.parent, prefix=path.stem + "_", suffix=".tmp", delete=False) as f:
+                temp_path = f.name
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except BaseException:
+            # Do not leave half-written temporary files behind
+            if temp_path is not None:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+            raise
+        self.refreshed += 1
+
+    def invalidate(self, run_profile, marketplace_profile):
+        """保存済みの storage_state を削除する（ボットチェックが出た場合）。"""
+        try:
+            self.path(run_profile, marketplace_profile).unlink()
+        except FileNotFoundError:
+            pass
+
+    def summary_lines(self):
+        return [f"  保存済みのセッションを使用: {self.restored}件, 保存: {self.refreshed}件, 有効期間: {self.max_age_seconds}秒"]
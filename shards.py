@@ -0,0 +1,300 @@
+"""
+キーワードを複数のワーカープロセスに分けて取得する（シャード）。
+
+1つの asyncio ループと1つの Chromium では Python 側の処理が1コアに収まってしまうため、
+scraping() は SHARDS（または --shards）が 2 以上の場合、ワーカープロセス（それぞれ別の Chromium）を
+起動し、キーワードを小さなまとまり（バッチ）で順に割り当てる。
+
+- 各ワーカーは空いたら次のバッチを受け取るので、遅いワーカーには少なく、速いワーカーには多く割り当たる
+- 割り当てたバッチは「リース」として管理し、ワーカーが終了した場合は未完了のキーワードを
+  キューの先頭に戻す（ワーカーは SHARD_MAX_RESTARTS 回まで起動し直す）
+- 手の空いたワーカーは、SHARD_STALL_SECONDS 秒を過ぎても終わらない他のワーカーのバッチの残りも
+  取得する（先に返った結果を使う）
+- SHARD_MAX_ATTEMPTS 回割り当てても完了しないキーワードはエラーとする
+
+ワーカーとの通信は行区切り JSON:
+    コーディネーター → ワーカー（標準入力）:  {"lease": "...", "items": [[index, keyword, depth], ...]}
+    ワーカー → コーディネーター（標準出力）: events.py のイベント行（keyword_result など）と通常のログ行。
+        バッチの終わりに shard_batch_done {"lease"}、終了時に shard_metrics {"spans"} を出力する
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from env import read_int
+from events import emit, parse_event
+
+DEFAULT_STALL_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_MAX_RESTARTS = 2
+IDLE_POLL_SECONDS = 1.0
+
+
+def read_shards(shards=None):
+    """ワーカープロセス数を返す（省略時は SHARDS、1 ならシャードを使わない）。"""
+    if shards is None:
+        shards = os.getenv("SHARDS", "1")
+    try:
+        return max(1, int(shards))
+    except (TypeError, ValueError):
+        return 1
+
+
+class WorkQueue:
+    """未割り当てのキーワードとリース（割り当て中のバッチ）を管理する。複数スレッドから使ってよい。
+
+    items は (index, keyword, depth) のリスト。index はキーワードの識別に使う。
+    """
+
+    def __init__(self, items, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.pending = [tuple(item) for item in items]
+        self.items = {item[0]: item for item in self.pending}
+        self.leases = {}  # lease_id -> {"worker", "items", "started", "expires"}
+        self.done = set()
+        self.attempts = {}  # index -> times handed out
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+    def lease(self, worker, size, ttl=None):
+        """未割り当てのキーワードを最大 size 件リースする。なければ None。
+
+        ttl（秒）を渡すと、その時間内に延長（renew）されないリースは expire_leases() で回収される。
+        """
+        with self._lock:
+            batch = []
+            while self.pending and len(batch) < size:
+                item = self.pending.pop(0)
+                if item[0] not in self.done:
+                    batch.append(item)
+            if not batch:
+                return None
+            return self._new_lease(worker, batch, ttl)
+
+    def steal(self, worker, size, stall_seconds, ttl=None):
+        """stall_seconds を過ぎても終わらない他のワーカーのリースから、未完了のキーワードを重複して割り当てる。"""
+        now = time.time()
+        with self._lock:
+            for lease_id, lease in sorted(self.leases.items(), key=lambda entry: entry[1]["started"]):
+                if lease["worker"] == worker or now - lease["started"] < stall_seconds:
+                    continue
+                batch = [item for item in lease["items"] if item[0] not in self.done][:size]
+                if batch:
+                    # Count from now so the same slow lease is not stolen again right away
+                    lease["started"] = now
+                    return self._new_lease(worker, batch, ttl)
+            return None
+
+    def _new_lease(self, worker, batch, ttl):
+        lease_id = uuid.uuid4().hex
+        now = time.time()
+        for item in batch:
+            self.attempts[item[0]] = self.attempts.get(item[0], 0) + 1
+        self.leases[lease_id] = {
+            "worker": worker,
+            "items": batch,
+            "started": now,
+            "expires": now + ttl if ttl else None,
+            "ttl": ttl,
+        }
+        return lease_id, batch
+
+    def renew(self, lease_id):
+        """リースの期限を延長する（ハートビート）。リースが既に無い場合は False。"""
+        with self._lock:
+            lease = self.leases.get(lease_id)
+            if lease is None:
+                return False
+            if lease["ttl"]:
+                lease["expires"] = time.time() + lease["ttl"]
+            return True
+
+    def holds(self, lease_id, worker, index):
+        """lease_id のリースが worker のもので、index のキーワードを含んでいれば True。"""
+        with self._lock:
+            lease = self.leases.get(lease_id)
+            return lease is not None and lease["worker"] == worker and any(item[0] == index for item in lease["items"])
+
+    def complete(self, index):
+        """キーワードを完了にする。初めての完了なら True（重複して取得した結果は False）。"""
+        with self._lock:
+            if index in self.done or index not in self.items:
+                return False
+            self.done.add(index)
+            return True
+
+    def finish_lease(self, lease_id):
+        """バッチの処理が終わったリースを外す（未完了のキーワードがあれば戻す）。"""
+        return self.release(lease_id)
+
+    def release(self, lease_id):
+        """リースを外し、未完了のキーワードを先頭に戻す。上限回数に達したキーワードのリストを返す。"""
+        with self._lock:
+            lease = self.leases.pop(lease_id, None)
+            if lease is None:
+                return []
+            return self._requeue(lease["items"])
+
+    def expire_leases(self):
+        """期限切れのリースを回収し、(回収したリース数, 上限回数に達したキーワードのリスト) を返す。"""
+        now = time.time()
+        with self._lock:
+            expired = [lease_id for lease_id, lease in self.leases.items() if lease["expires"] and lease["expires"] < now]
+            given_up = []
+            for lease_id in expired:
+                given_up.extend(self._requeue(self.leases.pop(lease_id)["items"]))
+            return len(expired), given_up
+
+    def _requeue(self, items):
+        # Another live lease may still hold a stolen copy of the same keyword
+        leased = {item[0] for lease in self.leases.values() for item in lease["items"]}
+        requeued = []
+        given_up = []
+        for item in items:
+            index = item[0]
+            if index in self.done or index in leased or item in self.pending:
+                continue
+            if self.attempts.get(index, 0) >= self.max_attempts:
+                self.done.add(index)
+                given_up.append(item)
+            else:
+                requeued.append(item)
+        self.pending[0:0] = requeued
+        return given_up
+
+    def finished(self):
+        with self._lock:
+            return len(self.done) == len(self.items)
+
+    def remaining(self):
+        """まだ完了していないキーワードのリスト。"""
+        with self._lock:
+            return [item for index, item in self.items.items() if index not in self.done]
+
+
+class ShardCoordinator:
+    """ワーカープロセスを起動してバッチを割り当て、結果を on_result(index, keyword, result) に渡す。"""
+
+    def __init__(self, items, on_result, *, shards, command, batch_size, on_metrics=None):
+        self.work = WorkQueue(items, read_int("SHARD_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS, 1))
+        self.on_result = on_result
+        self.on_metrics = on_metrics
+        self.shards = shards
+        self.command = command
+        self.batch_size = max(1, batch_size)
+        self.stall_seconds = read_int("SHARD_STALL_SECONDS", DEFAULT_STALL_SECONDS, 1)
+        self.max_restarts = read_int("SHARD_MAX_RESTARTS", DEFAULT_MAX_RESTARTS)
+        self.restarts = 0
+        self.stolen = 0
+
+    async def run(self):
+        await asyncio.gather(*(self._drive(shard) for shard in range(1, self.shards + 1)))
+        # Every worker gave up: report what is left instead of waiting forever
+        for index, keyword, _ in self.work.remaining():
+            self.work.complete(index)
+            emit("keyword_error", index=index, keyword=keyword, error="すべてのシャードのワーカーが終了しました")
+
+    async def _spawn(self):
+        env = os.environ.copy()
+        env["PYTHONIOENCODING"] = "utf-8"
+        env["PYTHONUNBUFFERED"] = "1"
+        return await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=env,
+            # Event lines carry whole results; the default 64 KiB line limit is too small
+            limit=16 * 1024 * 1024,
+        )
+
+    async def _drive(self, shard):
+        """1つのワーカープロセスを担当する。プロセスが終了した場合は上限回数まで起動し直す。"""
+        while not self.work.finished():
+            proc = await self._spawn()
+            print(f"[shard {shard}] ワーカーを起動しました (pid {proc.pid})", flush=True)
+            try:
+                alive = await self._feed(shard, proc)
+            finally:
+                if proc.returncode is None and proc.stdin is not None and not proc.stdin.is_closing():
+                    proc.stdin.close()
+                try:
+                    await asyncio.wait_for(self._drain(shard, proc), timeout=30)
+                except asyncio.TimeoutError:
+                    proc.kill()
+                await proc.wait()
+            if alive:
+                return
+            if self.restarts >= self.max_restarts:
+                print(f"[shard {shard}] ワーカーが終了しました。再起動の上限に達したため、このシャードを停止します。", flush=True)
+                return
+            self.restarts += 1
+            print(f"[shard {shard}] ワーカーが終了しました (exit {proc.returncode})。未完了のキーワードを戻して再起動します。", flush=True)
+
+    async def _feed(self, shard, proc):
+        """バッチを送り続ける。すべて完了したら True、ワーカーが途中で終了したら False を返す。"""
+        while not self.work.finished():
+            lease = self.work.lease(shard, self.batch_size)
+            if lease is None:
+                lease = self.work.steal(shard, self.batch_size, self.stall_seconds)
+                if lease is None:
+                    await asyncio.sleep(IDLE_POLL_SECONDS)
+                    continue
+                self.stolen += len(lease[1])
+                print(f"[shard {shard}] 遅れているシャードのキーワード {len(lease[1])} 件を並行して取得します。", flush=True)
+            lease_id, batch = lease
+            try:
+                proc.stdin.write((json.dumps({"lease": lease_id, "items": batch}, ensure_ascii=False) + "\n").encode("utf-8"))
+                await proc.stdin.drain()
+            except OSError:
+                self._give_up(self.work.release(lease_id))
+                return False
+            if not await self._read_until_done(shard, proc, lease_id):
+                self._give_up(self.work.release(lease_id))
+                return False
+            self._give_up(self.work.finish_lease(lease_id))
+        return True
+
+    async def _read_until_done(self, shard, proc, lease_id):
+        """ワーカーの出力を処理し、バッチが終わったら True、出力が途切れたら False を返す。"""
+        while True:
+            event = await self._read_line(shard, proc)
+            if event is False:
+                return False
+            if event is not None and event["type"] == "shard_batch_done" and event.get("lease") == lease_id:
+                return True
+
+    async def _drain(self, shard, proc):
+        while await self._read_line(shard, proc) is not False:
+            pass
+
+    async def _read_line(self, shard, proc):
+        """1行を処理し、イベントならその dict、ログ行なら None、出力の終わりなら False を返す。"""
+        raw = await proc.stdout.readline()
+        if not raw:
+            return False
+        line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+        event = parse_event(line)
+        if event is None:
+            if line:
+                print(f"[shard {shard}] {line}", flush=True)
+            return None
+        event_type = event["type"]
+        if event_type == "keyword_result":
+            if self.work.complete(event["index"]):
+                self.on_result(event["index"], event["keyword"], event["result"])
+        elif event_type == "keyword_error":
+            if self.work.complete(event["index"]):
+                # Keep "reason" (captcha / throttled / timeout) and the other fields of the worker's event
+                emit("keyword_error", **{key: value for key, value in event.items() if key not in ("v", "type", "ts")})
+        elif event_type in ("keyword_started", "keyword_retry", "timing"):
+            fields = {key: value for key, value in event.items() if key not in ("v", "type", "ts")}
+            emit(event_type, shard=shard, **fields)
+        elif event_type == "shard_metrics" and self.on_metrics is not None:
+            self.on_metrics(shard, event.get("spans", []))
+        return event
+
+    def _give_up(self, items):
+        for index, keyword, _ in items:
+            emit("keyword_error", index=index, keyword=keyword, error="ワーカーが続けて終了したため取得を中止しました")
@@ -0,0 +1,134 @@
+"""
+スプレッドシートのレイアウト（列・行の位置計算）。
+
+    1行目: 日付/キーワード | 自然検索 | ... | SP | ... | SB | ...
+    2行目:                 | kw1 ... kwN    | kw1 ... kwN | kw1 ... kwN
+    3行目以降: 日付ごとに1行
+
+列数は 1 + 3 × キーワード数 で、Z 列を超えても A1 表記（AA, AB, ..., ZZ, AAA, ...）で扱う。
+日付 → 行番号、キーワード → 列番号はどちらも辞書で引く。
+"""
+
+CATEGORIES = ("自然検索", "SP", "SB")
+HEADER_ROWS = 2
+FIRST_DATA_ROW = HEADER_ROWS + 1
+DATE_HEADER = "日付/キーワード"
+
+
+def column_letter(index):
+    """1始まりの列番号を A1 表記の列名にする（1 → A, 27 → AA, 703 → AAA）。"""
+    if index < 1:
+        raise ValueError(f"column index must be >= 1: {index}")
+    letters = ""
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def column_index(letters):
+    """A1 表記の列名を1始まりの列番号にする（A → 1, AA → 27）。"""
+    index = 0
+    for char in letters.upper():
+        index = index * 26 + (ord(char) - ord("A") + 1)
+    return index
+
+
+def quote_sheet(sheet_name):
+    """A1 表記で使えるようにシート名を引用符で囲む（空白や記号を含む名前のため）。"""
+    return "'" + sheet_name.replace("'", "''") + "'"
+
+
+def normalize_keyword(keyword):
+    return keyword.lstrip("\ufeff").strip()
+
+
+class DateIndex:
+    """日付列（A3 以降）の値から、日付 → 行番号の索引と次の空き行を作る。"""
+
+    def __init__(self, date_values):
+        self.rows = {}
+        last_row = FIRST_DATA_ROW - 1
+        for offset, row in enumerate(date_values):
+            value = row[0] if row else ""
+            if value:
+                row_number = FIRST_DATA_ROW + offset
+                # Keep the first row of a date, as the old top-down search did
+                self.rows.setdefault(value, row_number)
+                last_row = row_number
+        self.next_row = last_row + 1
+
+    def row_for(self, date):
+        """日付の行番号を返す。なければ次の空き行を返す。"""
+        return self.rows.get(date, self.next_row)
+
+
+class SheetLayout:
+    """キーワード一覧から、ヘッダー・列の位置・データ行を組み立てる。"""
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        # keyword -> 0-based position inside each category block
+        self.keyword_positions = {}
+        for position, keyword in enumerate(self.keywords):
+            self.keyword_positions.setdefault(normalize_keyword(keyword), position)
+        self.total_columns = 1 + len(CATEGORIES) * len(self.keywords)
+        self.end_column = column_letter(self.total_columns)
+
+    def expected_headers(self):
+        keyword_count = len(self.keywords)
+        header1 = [DATE_HEADER]
+        header2 = [""]
+        for category in CATEGORIES:
+            header1.append(category)
+            header1.extend([""] * (keyword_count - 1))
+            header2.extend(self.keywords)
+        return header1, header2
+
+    def headers_match(self, values):
+        """シートの1〜2行目がこのレイアウトのヘッダーと一致するか（末尾の空セルは無視）。"""
+        if len(values) < 2:
+            return False
+        expected1, expected2 = self.expected_headers()
+        return (
+            self._padded(values[0]) == expected1
+            and self._padded(values[1]) == expected2
+        )
+
+    def _padded(self, row):
+        row = list(row[:self.total_columns])
+        return row + [""] * (self.total_columns - len(row))
+
+    def column_for(self, category, keyword):
+        """カテゴリとキーワードの列番号（1始まり）を返す。キーワードがなければ None。"""
+        position = self.keyword_positions.get(normalize_keyword(keyword))
+        if position is None:
+            return None
+        return 2 + CATEGORIES.index(category) * len(self.keywords) + position
+
+    def data_row(self, date, result_data):
+        """結果のリストから日付の行（未取得のセルは "-"）を作る。"""
+        keyword_count = len(self.keywords)
+        row = [date] + ["-"] * (len(CATEGORIES) * keyword_count)
+        for item in result_data:
+            position = self.keyword_positions.get(normalize_keyword(item["keyword"]))
+            if position is None:
+                continue
+            for block, category in enumerate(CATEGORIES):
+                row[1 + block * keyword_count + position] = item[category]
+        return row
+
+    def header_range(self, sheet_name):
+        return f"{quote_sheet(sheet_name)}!A1:{self.end_column}{HEADER_ROWS}"
+
+    def row_range(self, sheet_name, row_number):
+        return f"{quote_sheet(sheet_name)}!A{row_number}:{self.end_column}{row_number}"
+
+    @staticmethod
+    def date_column_range(sheet_name):
+        return f"{quote_sheet(sheet_name)}!A{FIRST_DATA_ROW}:A"
+
+    @staticmethod
+    def sheet_range(sheet_name):
+        """シート全体（クリア用）。"""
+        return quote_sheet(sheet_name)
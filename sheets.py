@@ -0,0 +1,180 @@
+"""
+Google Sheets API クライアント（プロセスごとに1つを使い回す）。
+
+- ディスカバリ済みのサービスはプロセス内で1度だけ作成し、スレッド間で共有する
+  （httplib2 はスレッドセーフでないため、リクエストごとに新しい Http を使う）
+- 読み込みは values.batchGet、書き込みは values.batchUpdate にまとめる
+- 429（クォータ超過）と 5xx は指数バックオフで再試行する（Retry-After があれば従う）
+- SHEETS_API_ROOT でエンドポイントを差し替えられる（ローカルの偽 Sheets サーバーでの確認用。
+  この場合は認証なしで接続する）
+"""
+import os
+import random
+import threading
+import time
+import google_auth_httplib2
+import httplib2
+from google.auth.credentials import AnonymousCredentials
+from google.oauth2 import service_account
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+from env import read_int
+
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+# Quota (429) and transient server errors are retried; anything else is a real error
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 64.0
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _retry_after_seconds(error):
+    try:
+        return float(error.resp.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def get_client(creds_path):
+    """認証ファイルごとに1つの SheetsClient を返す（初回のみ作成）。"""
+    api_root = os.getenv("SHEETS_API_ROOT") or None
+    key = (str(creds_path), api_root)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = SheetsClient(creds_path, api_root=api_root)
+            _clients[key] = client
+        return client
+
+
+class SheetsClient:
+    """Sheets API の呼び出しをまとめ、再試行を行うクライアント。"""
+
+    def __init__(self, creds_path, api_root=None, max_retries=None):
+        if api_root:
+            credentials = AnonymousCredentials()
+        else:
+            credentials = service_account.Credentials.from_service_account_file(str(creds_path), scopes=SCOPES)
+        self.credentials = credentials
+        self.max_retries = read_int("SHEETS_MAX_RETRIES", DEFAULT_MAX_RETRIES) if max_retries is None else max_retries
+        self.api_calls = 0
+        self.retries = 0
+        self._counter_lock = threading.Lock()
+
+        def _build_request(http, *args, **kwargs):
+            # A fresh Http per request keeps the shared service usable from several threads
+            return HttpRequest(self._new_http(), *args, **kwargs)
+
+        client_options = {"api_endpoint": api_root} if api_root else None
+        self.service = build(
+            "sheets", "v4",
+            http=self._new_http(),
+            requestBuilder=_build_request,
+            client_options=client_options,
+            cache_discovery=False,
+        )
+
+    def _new_http(self):
+        return google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+
+    def execute(self, request, log=None):
+        """リクエストを実行する。429 / 5xx は指数バックオフ（+ ジッター）で再試行する。"""
+        attempt = 0
+        while True:
+            with self._counter_lock:
+                self.api_calls += 1
+            try:
+                return request.execute()
+            except HttpError as e:
+                status = e.resp.status
+                if status not in RETRY_STATUSES or attempt >= self.max_retries:
+                    raise
+                delay = _retry_after_seconds(e)
+                if delay is None:
+                    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt) + random.uniform(0, 1)
+                if log is not None:
+                    log(f"⏳ Sheets API が {status} を返しました。{delay:.1f}秒後に再試行します ({attempt + 1}/{self.max_retries})")
+                with self._counter_lock:
+                    self.retries += 1
+                time.sleep(delay)
+                attempt += 1
+
+    def sheet_titles(self, spreadsheet_id, log=None):
+        """シート名の一覧を返す。"""
+        meta = self.execute(
+            self.service.spreadsheets().get(spreadsheetId=spreadsheet_id, fields="sheets.properties.title"),
+            log,
+        )
+        sheets = meta.get("sheets", [])
+        return [s["properties"]["title"] for s in sheets if "properties" in s and "title" in s["properties"]]
+
+    def sheet_properties(self, spreadsheet_id, sheet_name, log=None):
+        """シートの sheetId と行数・列数を {"sheetId", "rowCount", "columnCount"} で返す。"""
+        meta = self.execute(
+            self.service.spreadsheets().get(
+                spreadsheetId=spreadsheet_id,
+                fields="sheets.properties(sheetId,title,gridProperties(rowCount,columnCount))",
+            ),
+            log,
+        )
+        for sheet in meta.get("sheets", []):
+            properties = sheet.get("properties", {})
+            if properties.get("title") == sheet_name:
+                grid = properties.get("gridProperties", {})
+                return {
+                    "sheetId": properties.get("sheetId"),
+                    "rowCount": grid.get("rowCount", 0),
+                    "columnCount": grid.get("columnCount", 0),
+                }
+        raise ValueError(f"シートが見つかりません: {sheet_name}")
+
+    def ensure_grid(self, spreadsheet_id, properties, rows, columns, log=None):
+        """シートの行数・列数が足りなければ、1回の batchUpdate で行・列を追加する。"""
+        requests = []
+        if rows > properties["rowCount"]:
+            requests.append({"appendDimension": {
+                "sheetId": properties["sheetId"], "dimension": "ROWS", "length": rows - properties["rowCount"],
+            }})
+        if columns > properties["columnCount"]:
+            requests.append({"appendDimension": {
+                "sheetId": properties["sheetId"], "dimension": "COLUMNS", "length": columns - properties["columnCount"],
+            }})
+        if not requests:
+            return False
+        self.execute(
+            self.service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": requests}),
+            log,
+        )
+        properties["rowCount"] = max(properties["rowCount"], rows)
+        properties["columnCount"] = max(properties["columnCount"], columns)
+        return True
+
+    def batch_get(self, spreadsheet_id, ranges, log=None):
+        """複数の範囲を1回の呼び出しで読み込み、範囲ごとの values（行のリスト）を順に返す。"""
+        response = self.execute(
+            self.service.spreadsheets().values().batchGet(spreadsheetId=spreadsheet_id, ranges=list(ranges)),
+            log,
+        )
+        value_ranges = response.get("valueRanges", [])
+        return [value_range.get("values", []) for value_range in value_ranges]
+
+    def batch_update(self, spreadsheet_id, data, log=None):
+        """[{"range": ..., "values": [[...]]}, ...] を1回の values.batchUpdate で書き込む。"""
+        if not data:
+            return None
+        body = {"valueInputOption": "RAW", "data": list(data)}
+        return self.execute(
+            self.service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheet_id, body=body),
+            log,
+        )
+
+    def clear(self, spreadsheet_id, range_name, log=None):
+        return self.execute(
+            self.service.spreadsheets().values().clear(spreadsheetId=spreadsheet_id, range=range_name, body={}),
+            log,
+        )
@@ -0,0 +1,97 @@
+import asyncio
+from collections import Counter
+
+import distributed
+from distributed import DistributedCoordinator, run_worker
+
+TARGET_URL = "https://www.amazon.co.jp/?language=ja_JP"
+ITEMS = [(index, f"キーワード{index}", 1) for index in range(12)]
+
+
+class WorkerDied(BaseException):
+    """ワーカーのプロセスが落ちた代わり（/done もハートビートも送られない）。"""
+
+
+class FakeProfile:
+    name = "test"
+
+
+class FakeMetrics:
+    def __init__(self):
+        self.spans = []
+
+
+class StubRunner:
+    """BatchRunner の代わりに、キーワードごとに結果を返す。die_after 件目の後で落ちる。"""
+
+    def __init__(self, die_after=None):
+        self.concurrency = 1
+        self.profile = FakeProfile()
+        self.metrics = FakeMetrics()
+        self.die_after = die_after
+        self.handled = 0
+
+    async def run(self, items, on_result, target_url=None, target_asins=None):
+        for index, keyword, _ in items:
+            if self.die_after is not None and self.handled >= self.die_after:
+                raise WorkerDied()
+            await asyncio.sleep(0.01)
+            self.handled += 1
+            on_result(index, keyword, {"keyword": keyword, "自然検索": "1", "SP": "-", "SB": "-"})
+
+    async def close(self):
+        pass
+
+
+async def _run_cluster(monkeypatch):
+    monkeypatch.delenv("DISTRIBUTED_TOKEN", raising=False)
+    monkeypatch.setattr(distributed, "WAIT_SECONDS", 0.2)
+    monkeypatch.setattr(distributed, "RETRY_SECONDS", 0.2)
+    completed = Counter()
+    coordinator = DistributedCoordinator(
+        ITEMS, lambda index, keyword, result: completed.update([index]),
+        host="127.0.0.1", port=0, run_id="test", target_url=TARGET_URL, target_asins={"B0TARGET01"},
+    )
+    coordinator.ttl = 2
+    serving = asyncio.create_task(coordinator.run())
+    while coordinator.port == 0:
+        await asyncio.sleep(0.01)
+    url = f"http://127.0.0.1:{coordinator.port}"
+
+    dying = StubRunner(die_after=1)
+    # The dying worker leases first so that it holds keywords when it goes down
+    died = asyncio.create_task(run_worker(url, worker_id="dying", exit_when_done=True, runner=dying))
+    while dying.handled == 0:
+        await asyncio.sleep(0.01)
+    workers = [
+        asyncio.create_task(run_worker(url, worker_id=f"worker{n}", exit_when_done=True, runner=StubRunner()))
+        for n in range(2)
+    ]
+    await asyncio.wait_for(serving, timeout=30)
+    for task in workers:
+        task.cancel()
+    outcomes = await asyncio.gather(died, *workers, return_exceptions=True)
+    return coordinator, completed, outcomes[0]
+
+
+def test_every_keyword_completes_once_when_a_worker_dies(monkeypatch):
+    coordinator, completed, died = asyncio.run(_run_cluster(monkeypatch))
+    assert isinstance(died, WorkerDied)
+    assert coordinator.expired >= 1
+    assert completed == Counter(index for index, _, _ in ITEMS)
+
+
+def test_result_for_an_unknown_lease_is_rejected(monkeypatch):
+    monkeypatch.delenv("DISTRIBUTED_TOKEN", raising=False)
+    coordinator = DistributedCoordinator(
+        ITEMS, lambda *args: None,
+        host="127.0.0.1", port=0, run_id="test", target_url=TARGET_URL, target_asins=set(),
+    )
+    lease = coordinator.handle("/lease", {"worker": "a", "size": 2})
+    index, keyword, _ = lease["items"][0]
+    result = {"worker": "a", "lease": lease["lease"], "index": index, "keyword": keyword, "result": {}}
+
+    assert coordinator.handle("/result", {**result, "lease": "unknown"}) == {"ok": False}
+    assert coordinator.handle("/result", {**result, "worker": "b"}) == {"ok": False}
+    assert coordinator.handle("/result", {**result, "index": ITEMS[-1][0]}) == {"ok": False}
+    assert coordinator.handle("/result", result) == {"ok": True}
@@ -0,0 +1,22 @@
+from env import read_flag, read_int
+
+
+def test_read_int_clamps_and_falls_back(monkeypatch):
+    monkeypatch.setenv("N", "-5")
+    assert read_int("N", 3, 1) == 1
+    monkeypatch.setenv("N", "abc")
+    assert read_int("N", 3, 1) == 3
+    monkeypatch.delenv("N")
+    assert read_int("N", 3, 1) == 3
+
+
+def test_read_flag(monkeypatch):
+    for value in ("0", "false", "No", " OFF "):
+        monkeypatch.setenv("FLAG", value)
+        assert not read_flag("FLAG")
+    monkeypatch.setenv("FLAG", "1")
+    assert read_flag("FLAG", "0")
+    # An empty value in .env means "use the default"
+    monkeypatch.setenv("FLAG", "")
+    assert read_flag("FLAG")
+    assert not read_flag("FLAG", "0")
@@ -0,0 +1,32 @@
+from history import RankHistory
+
+TARGETS = {"B0TARGET01", "B0TARGET02"}
+
+
+def _result(keyword, organic):
+    return {"keyword": keyword, "ranks": {"自然検索": organic, "SP": {}, "SB": {}}}
+
+
+def test_later_run_of_the_same_day_replaces_the_earlier_ranks(tmp_path):
+    history = RankHistory(tmp_path / "history.sqlite3")
+    try:
+        history.record_run("run1", "2025-01-01", [_result("キーワード", {"B0TARGET01": {"rank": 3, "page": 1}})], TARGETS)
+        history.record_run("run2", "2025-01-01", [_result("キーワード", {})], TARGETS)
+
+        organic = [row for row in history.trend("キーワード") if row[2] == "自然検索"]
+        assert organic == [("2025-01-01", "B0TARGET01", "自然検索", None, None), ("2025-01-01", "B0TARGET02", "自然検索", None, None)]
+    finally:
+        history.close()
+
+
+def test_not_found_asins_are_recorded_in_every_slot(tmp_path):
+    history = RankHistory(tmp_path / "history.sqlite3")
+    try:
+        count = history.record_run("run1", "2025-01-01", [_result("キーワード", {"B0TARGET01": {"rank": 3, "page": 1}})], TARGETS)
+        assert count == len(TARGETS) * 3
+        assert ("2025-01-01", "B0TARGET01", "自然検索", 1, 3) in history.trend("キーワード", asin="B0TARGET01")
+        # Other keywords of the day are left alone
+        history.record_run("run2", "2025-01-01", [_result("別のキーワード", {})], TARGETS)
+        assert len(history.trend("キーワード")) == len(TARGETS) * 3
+    finally:
+        history.close()
@@ -0,0 +1,12 @@
+from marketplaces import MARKETPLACE_PROFILES, split_tagged_keyword, tagged_keyword
+
+
+def test_tagged_keyword_round_trips():
+    keyword = tagged_keyword("キーワード", MARKETPLACE_PROFILES["us"], primary=False)
+    assert split_tagged_keyword(keyword) == ("us", "キーワード")
+
+
+def test_plain_keywords_with_a_colon_are_kept():
+    assert split_tagged_keyword("キーワード") == (None, "キーワード")
+    assert split_tagged_keyword("a:b") == (None, "a:b")
+    assert split_tagged_keyword("us:") == (None, "us:")
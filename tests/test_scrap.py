@@ -0,0 +1,271 @@
+import asyncio
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from events import parse_event
+from readiness import PageTimeoutError
+from marketplaces import MARKETPLACE_PROFILES
+from scheduler import BlockedPageError
+from scrap import KeywordScraper, _keyword_worker, plan_jobs
+from serp import BOT_CHECK_JS, NO_RESULTS_JS, SerpRanking
+
+TARGET_URL = "https://www.amazon.co.jp/?language=ja_JP"
+TARGETS = frozenset({"B0TARGET01", "B0TARGET02"})
+
+
+def _page_of(url):
+    return int(parse_qs(urlsplit(url).query).get("page", ["1"])[0])
+
+
+class FakeResponse:
+    status = 200
+    headers = {}
+
+    def __init__(self, ok=True):
+        self.ok = ok
+
+
+class FakeReadiness:
+    """PageReadiness の代わりに、開いた URL を記録する。
+
+    missing_pages のページは検索結果の表示を待ってタイムアウトし、rejected_pages のページは応答が拒否される。
+    """
+
+    def __init__(self, has_results=True, missing_pages=(), rejected_pages=()):
+        self.requested = []
+        self.has_results = has_results
+        self.missing_pages = missing_pages
+        self.rejected_pages = rejected_pages
+
+    async def goto(self, page, url):
+        self.requested.append(url)
+        page.url = url
+        return FakeResponse(ok=_page_of(url) not in self.rejected_pages)
+
+    async def wait_for_results(self, page, needs_pagination=True):
+        return self.has_results and _page_of(page.url) not in self.missing_pages
+
+
+class FakeTab:
+    """開いたページ番号に応じたスナップショットを返すタブ。empty_pages のページは「検索結果なし」の表示になる。"""
+
+    def __init__(self, snapshots, empty_pages=()):
+        self.snapshots = snapshots
+        self.empty_pages = empty_pages
+        self.url = "about:blank"
+
+    def page_index(self):
+        return _page_of(self.url)
+
+    async def evaluate(self, script, arg=None):
+        if script == BOT_CHECK_JS:
+            return False
+        if script == NO_RESULTS_JS:
+            return self.page_index() in self.empty_pages
+        return self.snapshots[self.page_index()]
+
+
+class FakeScheduler:
+    """RequestScheduler の代わりに、ブロックと正常な読み込みの報告を記録する。"""
+
+    max_retries = 3
+
+    def __init__(self):
+        self.blocks = []
+        self.clean = []
+
+    async def before_request(self, url):
+        pass
+
+    def report_block(self, url, kind):
+        self.blocks.append(kind)
+        return 0
+
+    def report_clean(self, url):
+        self.clean.append(url)
+
+
+class FakeCache:
+    """SerpCache の代わりに、存在しないページとして記録したページを記録する。"""
+
+    def __init__(self):
+        self.missing = []
+
+    def put(self, marketplace, keyword, page, snapshot):
+        pass
+
+    def put_missing(self, marketplace, keyword, page):
+        self.missing.append(page)
+
+
+def _snapshot(asins, sponsored=()):
+    products = [{"asin": asin, "sponsored": False} for asin in asins]
+    products += [{"asin": asin, "sponsored": True} for asin in sponsored]
+    return {"products": products, "blocks": [{"headers": [], "asins": sorted(TARGETS)}]}
+
+
+def _scrape(early_stop):
+    snapshots = {
+        1: _snapshot(["B0OTHER001", *sorted(TARGETS)], sponsored=sorted(TARGETS)),
+        2: _snapshot(["B0OTHER002"]),
+    }
+    readiness = FakeReadiness()
+    scraper = KeywordScraper(TARGET_URL, TARGETS, readiness, early_stop=early_stop)
+    tabs = [FakeTab(snapshots), FakeTab(snapshots)]
+    result = asyncio.run(scraper.scrape(tabs, "キーワード", 2))
+    pages = [_page_of(url) for url in readiness.requested]
+    return result, pages
+
+
+def test_early_stop_skips_page_2_when_page_1_has_every_target():
+    result, pages = _scrape(early_stop=True)
+    assert pages == [1]
+    assert result["pages"] == 1
+    assert (result["自然検索"], result["SP"], result["SB"]) == ("2", "1", "1")
+
+
+def test_without_early_stop_every_page_is_loaded():
+    result, pages = _scrape(early_stop=False)
+    assert sorted(pages) == [1, 2]
+    assert result["pages"] == 2
+
+
+def test_ranking_is_incomplete_without_targets():
+    assert not SerpRanking(frozenset()).is_complete()
+
+
+def test_empty_first_page_is_an_empty_ranking_not_a_block():
+    readiness = FakeReadiness(has_results=False)
+    scheduler = FakeScheduler()
+    cache = FakeCache()
+    scraper = KeywordScraper(TARGET_URL, TARGETS, readiness, scheduler=scheduler, cache=cache)
+    tabs = [FakeTab({}, empty_pages={1}), FakeTab({}, empty_pages={1})]
+    result = asyncio.run(scraper.scrape(tabs, "キーワード", 2))
+    assert len(readiness.requested) == 1
+    assert (result["自然検索"], result["SP"], result["SB"]) == ("-", "-", "-")
+    assert cache.missing == [1]
+    assert scheduler.blocks == []
+    assert scraper.direct_urls and scraper._direct_rejections == 0
+
+
+def test_timed_out_first_page_is_neither_empty_nor_cached():
+    scheduler = FakeScheduler()
+    cache = FakeCache()
+    scraper = KeywordScraper(TARGET_URL, TARGETS, FakeReadiness(has_results=False), scheduler=scheduler, cache=cache)
+    with pytest.raises(PageTimeoutError):
+        asyncio.run(scraper.scrape([FakeTab({}), FakeTab({})], "キーワード", 2))
+    assert cache.missing == []
+    assert scheduler.blocks == []
+
+
+def test_timed_out_keyword_is_retried_then_reported_with_its_reason(capsys):
+    scraper = KeywordScraper(TARGET_URL, TARGETS, FakeReadiness(has_results=False))
+    results = {}
+
+    async def run():
+        queue = asyncio.Queue()
+        queue.put_nowait((0, "キーワード", 2))
+        await _keyword_worker([FakeTab({}), FakeTab({})], queue, results, scraper, lambda *args: None, warm_up=False)
+
+    asyncio.run(run())
+    events = [event for event in map(parse_event, capsys.readouterr().out.splitlines()) if event is not None]
+    reasons = [(event["type"], event.get("reason")) for event in events if event["type"] in ("keyword_retry", "keyword_error")]
+    assert reasons == [("keyword_retry", "timeout"), ("keyword_error", "timeout")]
+    assert results == {}
+
+
+def _scrape_page_2(readiness, empty_pages=()):
+    snapshots = {1: _snapshot(["B0OTHER001"])}
+    cache = FakeCache()
+    scraper = KeywordScraper(TARGET_URL, TARGETS, readiness, early_stop=False, cache=cache)
+    tabs = [FakeTab(snapshots, empty_pages), FakeTab(snapshots, empty_pages)]
+    asyncio.run(scraper.scrape(tabs, "キーワード", 2))
+    return cache.missing
+
+
+def test_page_2_without_results_is_cached_as_missing():
+    assert _scrape_page_2(FakeReadiness(missing_pages={2}), empty_pages={2}) == [2]
+
+
+def test_rejected_page_2_is_not_cached_as_missing():
+    assert _scrape_page_2(FakeReadiness(rejected_pages={2})) == []
+
+
+def test_timed_out_page_2_is_not_cached_as_missing():
+    cache = FakeCache()
+    scraper = KeywordScraper(TARGET_URL, TARGETS, FakeReadiness(missing_pages={2}), early_stop=False, cache=cache)
+    snapshots = {1: _snapshot(["B0OTHER001"])}
+    with pytest.raises(PageTimeoutError):
+        asyncio.run(scraper.scrape([FakeTab(snapshots), FakeTab(snapshots)], "キーワード", 2))
+    assert cache.missing == []
+
+
+def test_keywords_are_searched_only_in_their_listed_marketplaces():
+    rows = [["キーワード1", "3", "jp us"], ["キーワード2", "", "us"], ["キーワード3"]]
+    profiles = [MARKETPLACE_PROFILES["jp"], MARKETPLACE_PROFILES["us"]]
+    jobs = plan_jobs(rows, profiles, TARGET_URL, 2)
+    assert [(profile.name, primary, keyword, depth) for profile, primary, keyword, depth in jobs] == [
+        ("jp", True, "キーワード1", 3),
+        ("jp", True, "キーワード3", 2),
+        ("us", False, "キーワード1", 3),
+        ("us", False, "キーワード2", 2),
+        ("us", False, "キーワード3", 2),
+    ]
+
+
+class SlowPage2Readiness(FakeReadiness):
+    """1ページ目は 503 をすぐに返し、2ページ目は遅れて読み込みを終える。"""
+
+    def __init__(self):
+        super().__init__()
+        self.finished = []
+
+    async def goto(self, page, url):
+        page.url = url
+        if _page_of(url) == 1:
+            response = FakeResponse(ok=False)
+            response.status = 503
+            return response
+        await asyncio.sleep(0.05)
+        self.finished.append(_page_of(url))
+        return FakeResponse()
+
+
+def test_a_failing_tab_waits_for_the_other_tabs_of_the_wave():
+    readiness = SlowPage2Readiness()
+    snapshots = {2: _snapshot(["B0OTHER002"])}
+    scraper = KeywordScraper(TARGET_URL, TARGETS, readiness, early_stop=False)
+    with pytest.raises(BlockedPageError):
+        asyncio.run(scraper.scrape([FakeTab(snapshots), FakeTab(snapshots)], "キーワード", 2))
+    # Page 2 finished on its tab before the error reached the caller
+    assert readiness.finished == [2]
+
+
+class BrokenTopPageTab(FakeTab):
+    async def goto(self, url):
+        raise RuntimeError("net::ERR_CONNECTION_RESET")
+
+
+def test_worker_reports_warm_up_and_on_result_failures_per_keyword(capsys):
+    snapshots = {1: _snapshot(["B0OTHER001", *sorted(TARGETS)], sponsored=sorted(TARGETS))}
+    scraper = KeywordScraper(TARGET_URL, TARGETS, FakeReadiness())
+    results = {}
+    recorded = []
+
+    def on_result(index, keyword, result):
+        if index == 0:
+            raise OSError("journal is read-only")
+        recorded.append(index)
+
+    async def run():
+        queue = asyncio.Queue()
+        queue.put_nowait((0, "キーワード1", 1))
+        queue.put_nowait((1, "キーワード2", 1))
+        await _keyword_worker([BrokenTopPageTab(snapshots), FakeTab(snapshots)], queue, results, scraper, on_result)
+
+    asyncio.run(run())
+    errors = [event for event in map(parse_event, capsys.readouterr().out.splitlines()) if event and event["type"] == "keyword_error"]
+    assert [event["index"] for event in errors] == [0]
+    assert recorded == [1]
+    assert list(results) == [1]
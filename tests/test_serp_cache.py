@@ -0,0 +1,71 @@
+import serp_cache
+from scrap import rank_from_cache
+from serp_cache import MISSING_PAGE, SerpCache
+
+MARKETPLACE = "www.amazon.co.jp"
+SNAPSHOT = {"products": [{"asin": "B0TARGET01", "sponsored": False}], "blocks": []}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_entries_expire_after_the_ttl(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(serp_cache.time, "time", clock.time)
+    cache = SerpCache(tmp_path / "cache.sqlite3", ttl_seconds=60)
+    try:
+        cache.put(MARKETPLACE, "キーワード", 1, SNAPSHOT)
+        clock.now += 59
+        assert cache.get(MARKETPLACE, "キーワード", 1) == SNAPSHOT
+        clock.now += 2
+        assert cache.get(MARKETPLACE, "キーワード", 1) is None
+        assert (cache.hits, cache.misses, cache.expired) == (1, 1, 1)
+    finally:
+        cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(serp_cache.time, "time", clock.time)
+    monkeypatch.setattr(serp_cache, "EVICT_EVERY", 1)
+    cache = SerpCache(tmp_path / "cache.sqlite3", max_entries=2)
+    try:
+        cache.put(MARKETPLACE, "キーワード1", 1, SNAPSHOT)
+        clock.now += 1
+        cache.put(MARKETPLACE, "キーワード2", 1, SNAPSHOT)
+        clock.now += 1
+        # Reading keyword 1 makes keyword 2 the least recently used
+        assert cache.get(MARKETPLACE, "キーワード1", 1) == SNAPSHOT
+        clock.now += 1
+        cache.put(MARKETPLACE, "キーワード3", 1, SNAPSHOT)
+        assert cache.evictions == 1
+        assert cache.get(MARKETPLACE, "キーワード2", 1) is None
+        assert cache.get(MARKETPLACE, "キーワード1", 1) == SNAPSHOT
+        assert cache.get(MARKETPLACE, "キーワード3", 1) == SNAPSHOT
+    finally:
+        cache.close()
+
+
+def test_missing_page_round_trip_ends_the_cached_ranking(tmp_path):
+    cache = SerpCache(tmp_path / "cache.sqlite3")
+    try:
+        cache.put(MARKETPLACE, "キーワード", 1, SNAPSHOT)
+        cache.put_missing(MARKETPLACE, "キーワード", 2)
+        assert cache.get(MARKETPLACE, "キーワード", 2) == MISSING_PAGE
+        # Page 3 is never looked up: the missing page 2 ends the result list
+        result = rank_from_cache(cache, MARKETPLACE, "キーワード", 3, frozenset({"B0TARGET01"}), early_stop=False)
+        assert result["自然検索"] == "1"
+    finally:
+        cache.close()
+
+
+def test_a_cache_file_that_cannot_be_opened_disables_the_cache(tmp_path, monkeypatch):
+    # A directory cannot be opened as a database
+    monkeypatch.setenv("SERP_CACHE_FILE", str(tmp_path))
+    monkeypatch.delenv("SERP_CACHE_TTL", raising=False)
+    assert SerpCache.from_env(tmp_path) is None
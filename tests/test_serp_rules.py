@@ -0,0 +1,50 @@
+import json
+import os
+
+from serp_rules import CompiledRules, DEFAULT_RULES, RuleSet
+
+US = "www.amazon.com"
+
+
+def _write(path, rules, mtime):
+    path.write_text(json.dumps(rules, ensure_ascii=False), encoding="utf-8")
+    # Each write must look like a change even within the file system's timestamp resolution
+    os.utime(path, (mtime, mtime))
+
+
+def test_markers_compile_to_one_alternation():
+    rules = CompiledRules({**DEFAULT_RULES, "sponsored_markers": ["Sponsored", "スポンサー"], "cut_markers": ["関連"], "excluded_blocks": ["結果"]})
+    assert rules.is_sponsored("<span>Sponsored</span>")
+    assert not rules.is_sponsored("<span>Best seller</span>")
+    assert rules.block_kind(["<h2>結果</h2>"]) == "excluded"
+    assert rules.block_kind(["<h2>結果</h2>", "<h2>関連</h2>"]) == "cut"
+    assert rules.block_kind(["<h2>Brand</h2>"]) is None
+
+
+def test_marketplace_override_is_merged_over_the_defaults(tmp_path):
+    path = tmp_path / "serp_rules.json"
+    _write(path, {"sponsored_markers": ["スポンサー"], "marketplaces": {US: {"sponsored_markers": ["Sponsored"]}}}, 1000)
+    rule_set = RuleSet(path)
+
+    us = rule_set.get(US)
+    assert us.is_sponsored("<span>Sponsored</span>")
+    assert not us.is_sponsored("<span>スポンサー</span>")
+    # Keys the override leaves out come from the top level
+    assert us.asin_pattern == DEFAULT_RULES["asin_pattern"]
+    assert rule_set.get("www.amazon.co.jp").is_sponsored("<span>スポンサー</span>")
+
+
+def test_bad_override_is_rejected_and_the_previous_rules_are_kept(tmp_path):
+    path = tmp_path / "serp_rules.json"
+    _write(path, {"marketplaces": {US: {"sponsored_markers": ["Sponsored"]}}}, 1000)
+    rule_set = RuleSet(path)
+    assert not rule_set.get(US).is_sponsored("<span>Best seller</span>")
+
+    # A string instead of a list would otherwise become the pattern o|r|d|S|p|n|e|s
+    _write(path, {"marketplaces": {US: {"sponsored_markers": "Sponsored"}}}, 2000)
+    us = rule_set.get(US)
+    assert not us.is_sponsored("<span>Best seller</span>")
+    assert us.is_sponsored("<span>Sponsored</span>")
+
+    _write(path, {"marketplaces": {US: {"asin_pattern": "B0[A-Z"}}}, 3000)
+    assert rule_set.get(US).asin_pattern == DEFAULT_RULES["asin_pattern"]
@@ -0,0 +1,33 @@
+import threading
+
+from marketplaces import MARKETPLACE_PROFILES
+from run_profiles import get_profile
+from session_state import SessionStateStore
+
+JP = MARKETPLACE_PROFILES["jp"]
+
+
+def _state(n):
+    return {"cookies": [{"name": "session-id", "domain": ".amazon.co.jp", "expires": -1}], "origins": [], "n": n}
+
+
+def test_concurrent_saves_leave_one_valid_file(tmp_path):
+    store = SessionStateStore(tmp_path)
+    profile = get_profile("throughput")
+    errors = []
+
+    def save(n):
+        try:
+            store.save(profile, JP, _state(n))
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save, args=(n,)) for n in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert [path.name for path in tmp_path.iterdir()] == [store.path(profile, JP).name]
+    assert store.load(profile, JP)["n"] in range(20)
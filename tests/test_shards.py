@@ -0,0 +1,90 @@
+import shards
+from shards import WorkQueue
+
+ITEMS = [(0, "a", 1), (1, "b", 1), (2, "c", 1)]
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def _clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(shards.time, "time", clock.time)
+    return clock
+
+
+def test_expired_lease_is_requeued_at_the_front(monkeypatch):
+    clock = _clock(monkeypatch)
+    queue = WorkQueue(ITEMS)
+    lease_id, batch = queue.lease("w1", 2, ttl=10)
+    assert batch == ITEMS[:2]
+
+    clock.now += 5
+    assert queue.expire_leases() == (0, [])
+    clock.now += 6
+    assert queue.expire_leases() == (1, [])
+    assert not queue.renew(lease_id)
+    assert queue.lease("w2", 3)[1] == ITEMS
+
+
+def test_renewed_lease_does_not_expire(monkeypatch):
+    clock = _clock(monkeypatch)
+    queue = WorkQueue(ITEMS)
+    lease_id, _ = queue.lease("w1", 1, ttl=10)
+    clock.now += 8
+    assert queue.renew(lease_id)
+    clock.now += 8
+    assert queue.expire_leases() == (0, [])
+    assert queue.holds(lease_id, "w1", 0)
+
+
+def test_release_requeues_only_unfinished_items():
+    queue = WorkQueue(ITEMS)
+    lease_id, _ = queue.lease("w1", 2)
+    assert queue.complete(0)
+    assert queue.release(lease_id) == []
+    assert queue.lease("w2", 3)[1] == [ITEMS[1], ITEMS[2]]
+
+
+def test_duplicate_and_late_results_are_not_counted_twice(monkeypatch):
+    clock = _clock(monkeypatch)
+    queue = WorkQueue(ITEMS)
+    slow_id, _ = queue.lease("w1", 1, ttl=10)
+    clock.now += 400
+    stolen_id, batch = queue.steal("w2", 1, stall_seconds=300)
+    assert batch == [ITEMS[0]]
+
+    assert queue.complete(0)
+    # The slow worker reports the same keyword later
+    assert not queue.complete(0)
+    assert not queue.complete(99)
+    # Its lease has expired; the keyword must not come back to the queue
+    assert queue.expire_leases() == (1, [])
+    assert queue.finish_lease(stolen_id) == []
+    assert queue.lease("w3", 3)[1] == [ITEMS[1], ITEMS[2]]
+    assert not queue.holds(slow_id, "w1", 0)
+
+
+def test_keyword_is_given_up_after_max_attempts():
+    queue = WorkQueue(ITEMS[:1], max_attempts=2)
+    lease_id, _ = queue.lease("w1", 1)
+    assert queue.release(lease_id) == []
+    lease_id, _ = queue.lease("w1", 1)
+    assert queue.release(lease_id) == [ITEMS[0]]
+    assert queue.lease("w1", 1) is None
+    assert queue.finished()
+    assert queue.remaining() == []
+
+
+def test_holds_checks_worker_and_index():
+    queue = WorkQueue(ITEMS)
+    lease_id, _ = queue.lease("w1", 1)
+    assert queue.holds(lease_id, "w1", 0)
+    assert not queue.holds(lease_id, "w2", 0)
+    assert not queue.holds(lease_id, "w1", 1)
+    assert not queue.holds("missing", "w1", 0)
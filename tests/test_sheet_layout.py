@@ -0,0 +1,52 @@
+import pytest
+
+from sheet_layout import FIRST_DATA_ROW, DateIndex, SheetLayout, column_index, column_letter
+
+
+@pytest.mark.parametrize("index, letters", [
+    (1, "A"), (26, "Z"), (27, "AA"), (52, "AZ"), (53, "BA"), (702, "ZZ"), (703, "AAA"), (18278, "ZZZ"),
+])
+def test_column_letter_boundaries(index, letters):
+    assert column_letter(index) == letters
+    assert column_index(letters) == index
+
+
+def test_column_letter_round_trip():
+    for index in range(1, 20000):
+        assert column_index(column_letter(index)) == index
+
+
+def test_column_letter_rejects_zero():
+    with pytest.raises(ValueError):
+        column_letter(0)
+
+
+def test_layout_past_column_z():
+    layout = SheetLayout([f"キーワード{n}" for n in range(10)])
+    assert layout.total_columns == 31
+    assert layout.end_column == "AE"
+    assert layout.column_for("SB", "キーワード9") == 31
+
+
+def test_date_index_finds_existing_dates():
+    index = DateIndex([["2025/01/01"], ["2025/01/02"]])
+    assert index.row_for("2025/01/01") == FIRST_DATA_ROW
+    assert index.row_for("2025/01/02") == FIRST_DATA_ROW + 1
+
+
+def test_date_index_appends_a_missing_date_after_the_last_row():
+    index = DateIndex([["2025/01/01"], ["2025/01/02"]])
+    assert index.row_for("2025/01/03") == FIRST_DATA_ROW + 2
+    assert DateIndex([]).row_for("2025/01/01") == FIRST_DATA_ROW
+
+
+def test_date_index_with_gaps_appends_after_the_last_filled_row():
+    index = DateIndex([["2025/01/01"], [], [""], ["2025/01/04"], []])
+    assert index.row_for("2025/01/04") == FIRST_DATA_ROW + 3
+    assert index.row_for("2025/01/05") == FIRST_DATA_ROW + 4
+
+
+def test_date_index_past_row_1000():
+    index = DateIndex([[f"day{n}"] for n in range(1500)])
+    assert index.row_for("day1499") == FIRST_DATA_ROW + 1499
+    assert index.row_for("new") == FIRST_DATA_ROW + 1500